@@ -7,16 +7,30 @@
 
 static PyObject *_cext_dense_tree_shap(PyObject *self, PyObject *args);
 static PyObject *_cext_dense_tree_predict(PyObject *self, PyObject *args);
+static PyObject *_cext_dense_tree_predict_leaves(PyObject *self, PyObject *args);
 static PyObject *_cext_dense_tree_update_weights(PyObject *self, PyObject *args);
 static PyObject *_cext_dense_tree_saabas(PyObject *self, PyObject *args);
+static PyObject *_cext_dense_tree_shap_truncated(PyObject *self, PyObject *args);
 static PyObject *_cext_compute_expectations(PyObject *self, PyObject *args);
+static PyObject *_cext_compute_path_tables(PyObject *self, PyObject *args);
+static PyObject *_cext_dense_tree_shap_path_tables(PyObject *self, PyObject *args);
+static PyObject *_cext_compute_paths(PyObject *self, PyObject *args);
+static PyObject *_cext_dense_tree_shap_paths(PyObject *self, PyObject *args);
+static PyObject *_cext_compute_background_cache(PyObject *self, PyObject *args);
 
 static PyMethodDef module_methods[] = {
     {"dense_tree_shap", _cext_dense_tree_shap, METH_VARARGS, "C implementation of Tree SHAP for dense."},
     {"dense_tree_predict", _cext_dense_tree_predict, METH_VARARGS, "C implementation of tree predictions."},
+    {"dense_tree_predict_leaves", _cext_dense_tree_predict_leaves, METH_VARARGS, "C implementation of tree leaf index predictions."},
     {"dense_tree_update_weights", _cext_dense_tree_update_weights, METH_VARARGS, "C implementation of tree node weight compuatations."},
     {"dense_tree_saabas", _cext_dense_tree_saabas, METH_VARARGS, "C implementation of Saabas (rough fast approximation to Tree SHAP)."},
+    {"dense_tree_shap_truncated", _cext_dense_tree_shap_truncated, METH_VARARGS, "C implementation of Tree SHAP that is exact over the top levels of the trees and Saabas below."},
     {"compute_expectations", _cext_compute_expectations, METH_VARARGS, "Compute expectations of internal nodes."},
+    {"compute_path_tables", _cext_compute_path_tables, METH_VARARGS, "Precompute the leaf path tables of a tree ensemble."},
+    {"dense_tree_shap_path_tables", _cext_dense_tree_shap_path_tables, METH_VARARGS, "C implementation of Tree SHAP using precomputed path tables."},
+    {"compute_paths", _cext_compute_paths, METH_VARARGS, "Extract the root to leaf paths of a tree ensemble."},
+    {"dense_tree_shap_paths", _cext_dense_tree_shap_paths, METH_VARARGS, "C implementation of Tree SHAP over root to leaf paths."},
+    {"compute_background_cache", _cext_compute_background_cache, METH_VARARGS, "Precompute the background data dependent parts of interventional Tree SHAP."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -96,7 +110,10 @@ static PyObject *_cext_compute_expectations(PyObject *self, PyObject *args)
     tree.values = (tfloat*)PyArray_DATA(values_array);
     tree.node_sample_weights = (tfloat*)PyArray_DATA(node_sample_weight_array);
 
-    const int max_depth = compute_expectations(tree);
+    int max_depth;
+    Py_BEGIN_ALLOW_THREADS
+    max_depth = compute_expectations(tree);
+    Py_END_ALLOW_THREADS
 
     // clean up the created python objects
     Py_XDECREF(children_left_array);
@@ -110,6 +127,56 @@ static PyObject *_cext_compute_expectations(PyObject *self, PyObject *args)
 }
 
 
+/**
+ * X can also be passed as a (data, indices, indptr, num_columns) tuple holding a CSR matrix. Then
+ * X_obj is replaced with the data array and the index arrays are returned, otherwise they are NULL.
+ */
+static bool parse_csr_input(PyObject **X_obj, PyArrayObject **indices_array, PyArrayObject **indptr_array, int *num_columns)
+{
+    *indices_array = NULL;
+    *indptr_array = NULL;
+    if (!PyTuple_Check(*X_obj)) return true;
+
+    PyObject *data_obj, *indices_obj, *indptr_obj;
+    if (!PyArg_ParseTuple(*X_obj, "OOOi", &data_obj, &indices_obj, &indptr_obj, num_columns)) return false;
+    *indices_array = (PyArrayObject*)PyArray_FROM_OTF(indices_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    *indptr_array = (PyArrayObject*)PyArray_FROM_OTF(indptr_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    if (*indices_array == NULL || *indptr_array == NULL) {
+        Py_XDECREF(*indices_array);
+        Py_XDECREF(*indptr_array);
+        return false;
+    }
+    *X_obj = data_obj;
+    return true;
+}
+
+/**
+ * The categorical splits of a model are passed as an optional (cat_offsets, cat_bitsets) tuple, see
+ * split_goes_left in tree_shap.h. The arrays are NULL for models without categorical splits, and false
+ * is returned (with a Python error set) if the tuple can not be read.
+ */
+static bool parse_categorical_splits(PyObject *categorical_splits_obj, PyArrayObject **cat_offsets_array,
+                                     PyArrayObject **cat_bitsets_array)
+{
+    *cat_offsets_array = NULL;
+    *cat_bitsets_array = NULL;
+    if (categorical_splits_obj == Py_None) return true;
+
+    PyObject *cat_offsets_obj, *cat_bitsets_obj;
+    if (!PyArg_ParseTuple(categorical_splits_obj, "OO", &cat_offsets_obj, &cat_bitsets_obj)) return false;
+    *cat_offsets_array = (PyArrayObject*)PyArray_FROM_OTF(cat_offsets_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    *cat_bitsets_array = (PyArrayObject*)PyArray_FROM_OTF(cat_bitsets_obj, NPY_UINT, NPY_ARRAY_IN_ARRAY);
+    return *cat_offsets_array != NULL && *cat_bitsets_array != NULL;
+}
+
+template <typename T>
+static void set_categorical_splits(TreeEnsembleT<T> &trees, PyArrayObject *cat_offsets_array, PyArrayObject *cat_bitsets_array)
+{
+    if (cat_offsets_array == NULL) return;
+    trees.cat_offsets = (int*)PyArray_DATA(cat_offsets_array);
+    trees.cat_bitsets = (unsigned*)PyArray_DATA(cat_bitsets_array);
+}
+
 static PyObject *_cext_dense_tree_shap(PyObject *self, PyObject *args)
 {
     PyObject *children_left_obj;
@@ -131,40 +198,133 @@ static PyObject *_cext_dense_tree_shap(PyObject *self, PyObject *args)
     int model_output;
     PyObject *base_offset_obj;
     bool interactions;
+    int num_threads = 1;
+    PyObject *stages_obj = Py_None;
+    PyObject *background_cache_obj = Py_None;
+    PyObject *R_weights_obj = Py_None;
+    PyObject *unique_features_obj = Py_None;
+    PyObject *out_predictions_obj = Py_None;
+    PyObject *categorical_splits_obj = Py_None;
 
     /* Parse the input tuple */
     if (!PyArg_ParseTuple(
-        args, "OOOOOOOiOOOOOiOOiib", &children_left_obj, &children_right_obj, &children_default_obj,
+        args, "OOOOOOOiOOOOOiOOiib|iOOOOOO", &children_left_obj, &children_right_obj, &children_default_obj,
         &features_obj, &thresholds_obj, &values_obj, &node_sample_weights_obj,
         &max_depth, &X_obj, &X_missing_obj, &y_obj, &R_obj, &R_missing_obj, &tree_limit, &base_offset_obj,
-        &out_contribs_obj, &feature_dependence, &model_output, &interactions
+        &out_contribs_obj, &feature_dependence, &model_output, &interactions, &num_threads, &stages_obj,
+        &background_cache_obj, &R_weights_obj, &unique_features_obj, &out_predictions_obj, &categorical_splits_obj
     )) return NULL;
+    if (num_threads < 1) num_threads = 1;
+
+    // the optional (# samples, # outputs) buffer for the (transformed) model output of each sample
+    if (out_predictions_obj != Py_None && (feature_dependence == FEATURE_DEPENDENCE::global_path_dependent ||
+                                           interactions || stages_obj != Py_None)) {
+        PyErr_SetString(PyExc_ValueError, "Predictions are only returned for independent and tree_path_dependent SHAP values without interactions or stages!");
+        return NULL;
+    }
+
+    // the merged tree of the global path dependent algorithm only has numerical splits
+    if (categorical_splits_obj != Py_None && feature_dependence == FEATURE_DEPENDENCE::global_path_dependent) {
+        PyErr_SetString(PyExc_ValueError, "Categorical splits are not supported by the global_path_dependent algorithm!");
+        return NULL;
+    }
+
+    // the optional weights of the background samples (normalized to sum to one)
+    if (R_weights_obj != Py_None && (feature_dependence != FEATURE_DEPENDENCE::independent || interactions)) {
+        PyErr_SetString(PyExc_ValueError, "Background weights are only supported for independent SHAP values without interactions!");
+        return NULL;
+    }
+
+    // the optional (# trees, width) array of the unique features of each tree, padded with -1
+    if (unique_features_obj != Py_None && (feature_dependence != FEATURE_DEPENDENCE::tree_path_dependent || !interactions)) {
+        PyErr_SetString(PyExc_ValueError, "Unique feature lists are only used for tree_path_dependent SHAP interaction values!");
+        return NULL;
+    }
+
+    // the optional output of compute_background_cache, built for the same trees, tree_limit and R
+    PyObject *background_cache_objs[4] = {NULL, NULL, NULL, NULL};
+    if (background_cache_obj != Py_None) {
+        if (feature_dependence != FEATURE_DEPENDENCE::independent || interactions || PyTuple_Check(X_obj)) {
+            PyErr_SetString(PyExc_ValueError, "A background cache is only supported for dense independent SHAP values without interactions!");
+            return NULL;
+        }
+        if (!PyArg_ParseTuple(
+            background_cache_obj, "OOOO", &background_cache_objs[0], &background_cache_objs[1],
+            &background_cache_objs[2], &background_cache_objs[3]
+        )) return NULL;
+    }
+
+    // the optional (increasing) tree counts at which the per tree path dependent values are snapshot,
+    // out_contribs then has an extra leading dimension with one block per stage
+    if (stages_obj != Py_None && (feature_dependence != FEATURE_DEPENDENCE::tree_path_dependent || interactions)) {
+        PyErr_SetString(PyExc_ValueError, "Staged SHAP values are only supported for tree_path_dependent SHAP values without interactions!");
+        return NULL;
+    }
+
+    // a float32 values array selects the single precision kernels, all other floating point
+    // inputs are then converted to float32 as well
+    const int float_type = (PyArray_Check(values_obj) && PyArray_TYPE((PyArrayObject*)values_obj) == NPY_FLOAT) ? NPY_FLOAT : NPY_DOUBLE;
+
+    PyArrayObject *csr_indices_array;
+    PyArrayObject *csr_indptr_array;
+    int csr_num_columns = 0;
+    if (PyTuple_Check(X_obj) && (float_type == NPY_FLOAT || interactions || stages_obj != Py_None)) {
+        PyErr_SetString(PyExc_ValueError, "CSR inputs are only supported for float64 SHAP values without interactions or stages!");
+        return NULL;
+    }
+    if (!parse_csr_input(&X_obj, &csr_indices_array, &csr_indptr_array, &csr_num_columns)) return NULL;
+    const bool csr = csr_indptr_array != NULL;
+
+    PyArrayObject *cat_offsets_array;
+    PyArrayObject *cat_bitsets_array;
+    const bool categorical_splits_ok = parse_categorical_splits(categorical_splits_obj, &cat_offsets_array, &cat_bitsets_array);
 
     /* Interpret the input objects as numpy arrays. */
     PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *node_sample_weights_array = (PyArrayObject*)PyArray_FROM_OTF(node_sample_weights_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *node_sample_weights_array = (PyArrayObject*)PyArray_FROM_OTF(node_sample_weights_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_missing_array = NULL;
+    if (!csr) X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *y_array = NULL;
-    if (y_obj != Py_None) y_array = (PyArrayObject*)PyArray_FROM_OTF(y_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (y_obj != Py_None) y_array = (PyArrayObject*)PyArray_FROM_OTF(y_obj, float_type, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *R_array = NULL;
-    if (R_obj != Py_None) R_array = (PyArrayObject*)PyArray_FROM_OTF(R_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (R_obj != Py_None) R_array = (PyArrayObject*)PyArray_FROM_OTF(R_obj, float_type, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *R_missing_array = NULL;
     if (R_missing_obj != Py_None) R_missing_array = (PyArrayObject*)PyArray_FROM_OTF(R_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *out_contribs_array = (PyArrayObject*)PyArray_FROM_OTF(out_contribs_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
-    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
+    PyArrayObject *R_weights_array = NULL;
+    if (R_weights_obj != Py_None) R_weights_array = (PyArrayObject*)PyArray_FROM_OTF(R_weights_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *unique_features_array = NULL;
+    if (unique_features_obj != Py_None) unique_features_array = (PyArrayObject*)PyArray_FROM_OTF(unique_features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_contribs_array = (PyArrayObject*)PyArray_FROM_OTF(out_contribs_obj, float_type, NPY_ARRAY_INOUT_ARRAY);
+    PyArrayObject *out_predictions_array = NULL;
+    if (out_predictions_obj != Py_None) out_predictions_array = (PyArrayObject*)PyArray_FROM_OTF(out_predictions_obj, float_type, NPY_ARRAY_INOUT_ARRAY);
+    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, float_type, NPY_ARRAY_INOUT_ARRAY);
+    PyArrayObject *stages_array = NULL;
+    if (stages_obj != Py_None) stages_array = (PyArrayObject*)PyArray_FROM_OTF(stages_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    const int background_cache_types[4] = {NPY_UINT8, NPY_FLOAT, NPY_UINT8, NPY_DOUBLE};
+    PyArrayObject *background_cache_arrays[4] = {NULL, NULL, NULL, NULL};
+    bool background_cache_ok = true;
+    for (unsigned i = 0; i < 4 && background_cache_obj != Py_None; ++i) {
+        background_cache_arrays[i] = (PyArrayObject*)PyArray_FROM_OTF(background_cache_objs[i], background_cache_types[i], NPY_ARRAY_IN_ARRAY);
+        if (background_cache_arrays[i] == NULL) background_cache_ok = false;
+    }
 
     /* If that didn't work, throw an exception. Note that R and y are optional. */
-    if (children_left_array == NULL || children_right_array == NULL ||
+    if (!categorical_splits_ok || children_left_array == NULL || children_right_array == NULL ||
         children_default_array == NULL || features_array == NULL || thresholds_array == NULL ||
         values_array == NULL || node_sample_weights_array == NULL || X_array == NULL ||
-        X_missing_array == NULL || out_contribs_array == NULL) {
+        (!csr && X_missing_array == NULL) || out_contribs_array == NULL || (stages_obj != Py_None && stages_array == NULL) ||
+        !background_cache_ok || (R_weights_obj != Py_None && R_weights_array == NULL) ||
+        (unique_features_obj != Py_None && unique_features_array == NULL) ||
+        (out_predictions_obj != Py_None && out_predictions_array == NULL)) {
         Py_XDECREF(children_left_array);
+        Py_XDECREF(cat_offsets_array);
+        Py_XDECREF(cat_bitsets_array);
         Py_XDECREF(children_right_array);
         Py_XDECREF(children_default_array);
         Py_XDECREF(features_array);
@@ -179,51 +339,135 @@ static PyObject *_cext_dense_tree_shap(PyObject *self, PyObject *args)
         //PyArray_ResolveWritebackIfCopy(out_contribs_array);
         Py_XDECREF(out_contribs_array);
         Py_XDECREF(base_offset_array);
+        Py_XDECREF(stages_array);
+        Py_XDECREF(csr_indices_array);
+        Py_XDECREF(csr_indptr_array);
+        for (unsigned i = 0; i < 4; ++i) Py_XDECREF(background_cache_arrays[i]);
+        Py_XDECREF(R_weights_array);
+        Py_XDECREF(unique_features_array);
+        Py_XDECREF(out_predictions_array);
         return NULL;
     }
 
-    const unsigned num_X = PyArray_DIM(X_array, 0);
-    const unsigned M = PyArray_DIM(X_array, 1);
+    const unsigned num_X = csr ? PyArray_DIM(csr_indptr_array, 0) - 1 : PyArray_DIM(X_array, 0);
+    const unsigned M = csr ? csr_num_columns : PyArray_DIM(X_array, 1);
     const unsigned max_nodes = PyArray_DIM(values_array, 1);
     const unsigned num_outputs = PyArray_DIM(values_array, 2);
     unsigned num_R = 0;
     if (R_array != NULL) num_R = PyArray_DIM(R_array, 0);
+    int *stages = NULL;
+    unsigned num_stages = 0;
+    if (stages_array != NULL) {
+        stages = (int*)PyArray_DATA(stages_array);
+        num_stages = PyArray_SIZE(stages_array);
+    }
 
     // Get pointers to the data as C-types
     int *children_left = (int*)PyArray_DATA(children_left_array);
     int *children_right = (int*)PyArray_DATA(children_right_array);
     int *children_default = (int*)PyArray_DATA(children_default_array);
     int *features = (int*)PyArray_DATA(features_array);
-    tfloat *thresholds = (tfloat*)PyArray_DATA(thresholds_array);
-    tfloat *values = (tfloat*)PyArray_DATA(values_array);
-    tfloat *node_sample_weights = (tfloat*)PyArray_DATA(node_sample_weights_array);
-    tfloat *X = (tfloat*)PyArray_DATA(X_array);
-    bool *X_missing = (bool*)PyArray_DATA(X_missing_array);
-    tfloat *y = NULL;
-    if (y_array != NULL) y = (tfloat*)PyArray_DATA(y_array);
-    tfloat *R = NULL;
-    if (R_array != NULL) R = (tfloat*)PyArray_DATA(R_array);
+    bool *X_missing = csr ? NULL : (bool*)PyArray_DATA(X_missing_array);
     bool *R_missing = NULL;
     if (R_missing_array != NULL) R_missing = (bool*)PyArray_DATA(R_missing_array);
-    tfloat *out_contribs = (tfloat*)PyArray_DATA(out_contribs_array);
-    tfloat *base_offset = (tfloat*)PyArray_DATA(base_offset_array);
-
-    // these are just a wrapper objects for all the pointers and numbers associated with
-    // the ensemble tree model and the dataset we are explaining
-    TreeEnsemble trees = TreeEnsemble(
-        children_left, children_right, children_default, features, thresholds, values,
-        node_sample_weights, max_depth, tree_limit, base_offset,
-        max_nodes, num_outputs
-    );
-    ExplanationDataset data = ExplanationDataset(X, X_missing, y, R, R_missing, num_X, M, num_R);
 
-    dense_tree_shap(trees, data, out_contribs, feature_dependence, model_output, interactions);
-
-    // retrieve return value before python cleanup of objects
-    tfloat ret_value = (double)values[0];
+    tfloat ret_value = 0;
+    bool unsupported = false;
+    if (float_type == NPY_FLOAT) {
+        float *thresholds = (float*)PyArray_DATA(thresholds_array);
+        float *values = (float*)PyArray_DATA(values_array);
+        float *node_sample_weights = (float*)PyArray_DATA(node_sample_weights_array);
+        float *X = (float*)PyArray_DATA(X_array);
+        float *y = NULL;
+        if (y_array != NULL) y = (float*)PyArray_DATA(y_array);
+        float *R = NULL;
+        if (R_array != NULL) R = (float*)PyArray_DATA(R_array);
+        float *out_contribs = (float*)PyArray_DATA(out_contribs_array);
+        float *base_offset = (float*)PyArray_DATA(base_offset_array);
+
+        // only the per tree path dependent algorithm has a single precision implementation
+        if (feature_dependence != FEATURE_DEPENDENCE::tree_path_dependent || interactions) {
+            unsupported = true;
+        } else {
+            TreeEnsembleT<float> trees = TreeEnsembleT<float>(
+                children_left, children_right, children_default, features, thresholds, values,
+                node_sample_weights, max_depth, tree_limit, base_offset,
+                max_nodes, num_outputs
+            );
+            set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+            ExplanationDatasetT<float> data = ExplanationDatasetT<float>(X, X_missing, y, R, R_missing, num_X, M, num_R);
+            if (out_predictions_array != NULL) data.out_predictions = (float*)PyArray_DATA(out_predictions_array);
+
+            Py_BEGIN_ALLOW_THREADS
+            dense_tree_path_dependent(trees, data, out_contribs, get_transform(model_output), num_threads, stages, num_stages);
+            Py_END_ALLOW_THREADS
+
+            ret_value = (double)values[0];
+        }
+    } else {
+        tfloat *thresholds = (tfloat*)PyArray_DATA(thresholds_array);
+        tfloat *values = (tfloat*)PyArray_DATA(values_array);
+        tfloat *node_sample_weights = (tfloat*)PyArray_DATA(node_sample_weights_array);
+        tfloat *X = (tfloat*)PyArray_DATA(X_array);
+        tfloat *y = NULL;
+        if (y_array != NULL) y = (tfloat*)PyArray_DATA(y_array);
+        tfloat *R = NULL;
+        if (R_array != NULL) R = (tfloat*)PyArray_DATA(R_array);
+        tfloat *out_contribs = (tfloat*)PyArray_DATA(out_contribs_array);
+        tfloat *base_offset = (tfloat*)PyArray_DATA(base_offset_array);
+
+        // these are just a wrapper objects for all the pointers and numbers associated with
+        // the ensemble tree model and the dataset we are explaining
+        TreeEnsemble trees = TreeEnsemble(
+            children_left, children_right, children_default, features, thresholds, values,
+            node_sample_weights, max_depth, tree_limit, base_offset,
+            max_nodes, num_outputs
+        );
+        set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+        ExplanationDataset data = ExplanationDataset(X, X_missing, y, R, R_missing, num_X, M, num_R);
+        if (R_weights_array != NULL) data.R_weights = (tfloat*)PyArray_DATA(R_weights_array);
+        if (out_predictions_array != NULL) data.out_predictions = (tfloat*)PyArray_DATA(out_predictions_array);
+
+        // the model and data arrays are only read (and each call gets its own output buffer), so we can
+        // let other Python threads run while we compute
+        Py_BEGIN_ALLOW_THREADS
+        if (csr) {
+            // explain blocks of dense rows expanded from the CSR matrix, each block on a single thread
+            CSRDataset csr_data = CSRDataset(
+                X, (int*)PyArray_DATA(csr_indices_array), (int*)PyArray_DATA(csr_indptr_array), num_X, M
+            );
+            for_each_dense_block(csr_data, num_threads, [&](const unsigned start, const unsigned end, tfloat *X_block, bool *X_missing_block) {
+                ExplanationDataset block = ExplanationDataset(
+                    X_block, X_missing_block, y == NULL ? NULL : y + start, R, R_missing, end - start, M, num_R
+                );
+                block.R_weights = data.R_weights;
+                if (data.out_predictions != NULL) block.out_predictions = data.out_predictions + start * num_outputs;
+                dense_tree_shap(trees, block, out_contribs + start * (M + 1) * num_outputs, feature_dependence, model_output, false, 1);
+            });
+        } else if (num_stages > 0) {
+            dense_tree_path_dependent(trees, data, out_contribs, get_transform(model_output), num_threads, stages, num_stages);
+        } else if (background_cache_obj != Py_None) {
+            IndependentBackgroundCache background_cache = {
+                (Node*)PyArray_DATA(background_cache_arrays[0]), (float*)PyArray_DATA(background_cache_arrays[1]),
+                (unsigned char*)PyArray_DATA(background_cache_arrays[2]), (tfloat*)PyArray_DATA(background_cache_arrays[3])
+            };
+            dense_independent(trees, data, out_contribs, get_transform(model_output), num_threads, &background_cache);
+        } else if (unique_features_array != NULL) {
+            dense_tree_interactions_path_dependent(
+                trees, data, out_contribs, get_transform(model_output), num_threads,
+                (int*)PyArray_DATA(unique_features_array), PyArray_DIM(unique_features_array, 1)
+            );
+        } else dense_tree_shap(trees, data, out_contribs, feature_dependence, model_output, interactions, num_threads);
+        Py_END_ALLOW_THREADS
+
+        // retrieve return value before python cleanup of objects
+        ret_value = (double)values[0];
+    }
 
     // clean up the created python objects
     Py_XDECREF(children_left_array);
+    Py_XDECREF(cat_offsets_array);
+    Py_XDECREF(cat_bitsets_array);
     Py_XDECREF(children_right_array);
     Py_XDECREF(children_default_array);
     Py_XDECREF(features_array);
@@ -238,6 +482,18 @@ static PyObject *_cext_dense_tree_shap(PyObject *self, PyObject *args)
     //PyArray_ResolveWritebackIfCopy(out_contribs_array);
     Py_XDECREF(out_contribs_array);
     Py_XDECREF(base_offset_array);
+    Py_XDECREF(stages_array);
+    Py_XDECREF(csr_indices_array);
+    Py_XDECREF(csr_indptr_array);
+    for (unsigned i = 0; i < 4; ++i) Py_XDECREF(background_cache_arrays[i]);
+    Py_XDECREF(R_weights_array);
+    Py_XDECREF(unique_features_array);
+    Py_XDECREF(out_predictions_array);
+
+    if (unsupported) {
+        PyErr_SetString(PyExc_ValueError, "float32 inputs are only supported for tree_path_dependent SHAP values without interactions!");
+        return NULL;
+    }
 
     /* Build the output tuple */
     PyObject *ret = Py_BuildValue("d", ret_value);
@@ -261,34 +517,55 @@ static PyObject *_cext_dense_tree_predict(PyObject *self, PyObject *args)
     PyObject *X_missing_obj;
     PyObject *y_obj;
     PyObject *out_pred_obj;
+    PyObject *categorical_splits_obj = Py_None;
 
     /* Parse the input tuple */
     if (!PyArg_ParseTuple(
-        args, "OOOOOOiiOiOOOO", &children_left_obj, &children_right_obj, &children_default_obj,
+        args, "OOOOOOiiOiOOOO|O", &children_left_obj, &children_right_obj, &children_default_obj,
         &features_obj, &thresholds_obj, &values_obj, &max_depth, &tree_limit, &base_offset_obj, &model_output,
-        &X_obj, &X_missing_obj, &y_obj, &out_pred_obj
+        &X_obj, &X_missing_obj, &y_obj, &out_pred_obj, &categorical_splits_obj
     )) return NULL;
 
+    // a float32 values array selects the single precision kernels
+    const int float_type = (PyArray_Check(values_obj) && PyArray_TYPE((PyArrayObject*)values_obj) == NPY_FLOAT) ? NPY_FLOAT : NPY_DOUBLE;
+
+    PyArrayObject *csr_indices_array;
+    PyArrayObject *csr_indptr_array;
+    int csr_num_columns = 0;
+    if (PyTuple_Check(X_obj) && float_type == NPY_FLOAT) {
+        PyErr_SetString(PyExc_ValueError, "CSR inputs are only supported for float64 predictions!");
+        return NULL;
+    }
+    if (!parse_csr_input(&X_obj, &csr_indices_array, &csr_indptr_array, &csr_num_columns)) return NULL;
+    const bool csr = csr_indptr_array != NULL;
+
+    PyArrayObject *cat_offsets_array;
+    PyArrayObject *cat_bitsets_array;
+    const bool categorical_splits_ok = parse_categorical_splits(categorical_splits_obj, &cat_offsets_array, &cat_bitsets_array);
+
     /* Interpret the input objects as numpy arrays. */
     PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_missing_array = NULL;
+    if (!csr) X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *y_array = NULL;
-    if (y_obj != Py_None) y_array = (PyArrayObject*)PyArray_FROM_OTF(y_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *out_pred_array = (PyArrayObject*)PyArray_FROM_OTF(out_pred_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
+    if (y_obj != Py_None) y_array = (PyArrayObject*)PyArray_FROM_OTF(y_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_pred_array = (PyArrayObject*)PyArray_FROM_OTF(out_pred_obj, float_type, NPY_ARRAY_INOUT_ARRAY);
 
     /* If that didn't work, throw an exception. Note that R and y are optional. */
-    if (children_left_array == NULL || children_right_array == NULL ||
+    if (!categorical_splits_ok || children_left_array == NULL || children_right_array == NULL ||
         children_default_array == NULL || features_array == NULL || thresholds_array == NULL ||
         values_array == NULL || X_array == NULL ||
-        X_missing_array == NULL || out_pred_array == NULL) {
+        (!csr && X_missing_array == NULL) || out_pred_array == NULL) {
         Py_XDECREF(children_left_array);
+        Py_XDECREF(cat_offsets_array);
+        Py_XDECREF(cat_bitsets_array);
         Py_XDECREF(children_right_array);
         Py_XDECREF(children_default_array);
         Py_XDECREF(features_array);
@@ -300,11 +577,13 @@ static PyObject *_cext_dense_tree_predict(PyObject *self, PyObject *args)
         if (y_array != NULL) Py_XDECREF(y_array);
         //PyArray_ResolveWritebackIfCopy(out_pred_array);
         Py_XDECREF(out_pred_array);
+        Py_XDECREF(csr_indices_array);
+        Py_XDECREF(csr_indptr_array);
         return NULL;
     }
 
-    const unsigned num_X = PyArray_DIM(X_array, 0);
-    const unsigned M = PyArray_DIM(X_array, 1);
+    const unsigned num_X = csr ? PyArray_DIM(csr_indptr_array, 0) - 1 : PyArray_DIM(X_array, 0);
+    const unsigned M = csr ? csr_num_columns : PyArray_DIM(X_array, 1);
     const unsigned max_nodes = PyArray_DIM(values_array, 1);
     const unsigned num_outputs = PyArray_DIM(values_array, 2);
 
@@ -319,28 +598,73 @@ static PyObject *_cext_dense_tree_predict(PyObject *self, PyObject *args)
     int *children_right = (int*)PyArray_DATA(children_right_array);
     int *children_default = (int*)PyArray_DATA(children_default_array);
     int *features = (int*)PyArray_DATA(features_array);
-    tfloat *thresholds = (tfloat*)PyArray_DATA(thresholds_array);
-    tfloat *values = (tfloat*)PyArray_DATA(values_array);
-    tfloat *base_offset = (tfloat*)PyArray_DATA(base_offset_array);
-    tfloat *X = (tfloat*)PyArray_DATA(X_array);
-    bool *X_missing = (bool*)PyArray_DATA(X_missing_array);
-    tfloat *y = NULL;
-    if (y_array != NULL) y = (tfloat*)PyArray_DATA(y_array);
-    tfloat *out_pred = (tfloat*)PyArray_DATA(out_pred_array);
-
-    // these are just wrapper objects for all the pointers and numbers associated with
-    // the ensemble tree model and the dataset we are explaining
-    TreeEnsemble trees = TreeEnsemble(
-        children_left, children_right, children_default, features, thresholds, values,
-        NULL, max_depth, tree_limit, base_offset,
-        max_nodes, num_outputs
-    );
-    ExplanationDataset data = ExplanationDataset(X, X_missing, y, NULL, NULL, num_X, M, 0);
-
-    dense_tree_predict(out_pred, trees, data, model_output);
+    bool *X_missing = csr ? NULL : (bool*)PyArray_DATA(X_missing_array);
+
+    tfloat ret_value = 0;
+    if (float_type == NPY_FLOAT) {
+        float *thresholds = (float*)PyArray_DATA(thresholds_array);
+        float *values = (float*)PyArray_DATA(values_array);
+        float *base_offset = (float*)PyArray_DATA(base_offset_array);
+        float *X = (float*)PyArray_DATA(X_array);
+        float *y = NULL;
+        if (y_array != NULL) y = (float*)PyArray_DATA(y_array);
+        float *out_pred = (float*)PyArray_DATA(out_pred_array);
+
+        // these are just wrapper objects for all the pointers and numbers associated with
+        // the ensemble tree model and the dataset we are explaining
+        TreeEnsembleT<float> trees = TreeEnsembleT<float>(
+            children_left, children_right, children_default, features, thresholds, values,
+            NULL, max_depth, tree_limit, base_offset,
+            max_nodes, num_outputs
+        );
+        set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+        ExplanationDatasetT<float> data = ExplanationDatasetT<float>(X, X_missing, y, NULL, NULL, num_X, M, 0);
+
+        Py_BEGIN_ALLOW_THREADS
+        dense_tree_predict(out_pred, trees, data, model_output);
+        Py_END_ALLOW_THREADS
+
+        ret_value = (double)values[0];
+    } else {
+        tfloat *thresholds = (tfloat*)PyArray_DATA(thresholds_array);
+        tfloat *values = (tfloat*)PyArray_DATA(values_array);
+        tfloat *base_offset = (tfloat*)PyArray_DATA(base_offset_array);
+        tfloat *X = (tfloat*)PyArray_DATA(X_array);
+        tfloat *y = NULL;
+        if (y_array != NULL) y = (tfloat*)PyArray_DATA(y_array);
+        tfloat *out_pred = (tfloat*)PyArray_DATA(out_pred_array);
+
+        // these are just wrapper objects for all the pointers and numbers associated with
+        // the ensemble tree model and the dataset we are explaining
+        TreeEnsemble trees = TreeEnsemble(
+            children_left, children_right, children_default, features, thresholds, values,
+            NULL, max_depth, tree_limit, base_offset,
+            max_nodes, num_outputs
+        );
+        set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+        ExplanationDataset data = ExplanationDataset(X, X_missing, y, NULL, NULL, num_X, M, 0);
+
+        Py_BEGIN_ALLOW_THREADS
+        if (csr) {
+            CSRDataset csr_data = CSRDataset(
+                X, (int*)PyArray_DATA(csr_indices_array), (int*)PyArray_DATA(csr_indptr_array), num_X, M
+            );
+            for_each_dense_block(csr_data, 1, [&](const unsigned start, const unsigned end, tfloat *X_block, bool *X_missing_block) {
+                ExplanationDataset block = ExplanationDataset(
+                    X_block, X_missing_block, y == NULL ? NULL : y + start, NULL, NULL, end - start, M, 0
+                );
+                dense_tree_predict(out_pred + start * num_outputs, trees, block, model_output);
+            });
+        } else dense_tree_predict(out_pred, trees, data, model_output);
+        Py_END_ALLOW_THREADS
+
+        ret_value = (double)values[0];
+    }
 
     // clean up the created python objects
     Py_XDECREF(children_left_array);
+    Py_XDECREF(cat_offsets_array);
+    Py_XDECREF(cat_bitsets_array);
     Py_XDECREF(children_right_array);
     Py_XDECREF(children_default_array);
     Py_XDECREF(features_array);
@@ -352,13 +676,104 @@ static PyObject *_cext_dense_tree_predict(PyObject *self, PyObject *args)
     if (y_array != NULL) Py_XDECREF(y_array);
     //PyArray_ResolveWritebackIfCopy(out_pred_array);
     Py_XDECREF(out_pred_array);
+    Py_XDECREF(csr_indices_array);
+    Py_XDECREF(csr_indptr_array);
 
     /* Build the output tuple */
-    PyObject *ret = Py_BuildValue("d", (double)values[0]);
+    PyObject *ret = Py_BuildValue("d", ret_value);
     return ret;
 }
 
 
+static PyObject *_cext_dense_tree_predict_leaves(PyObject *self, PyObject *args)
+{
+    PyObject *children_left_obj;
+    PyObject *children_right_obj;
+    PyObject *children_default_obj;
+    PyObject *features_obj;
+    PyObject *thresholds_obj;
+    int tree_limit;
+    PyObject *X_obj;
+    PyObject *X_missing_obj;
+    PyObject *out_leaves_obj;
+    int num_threads = 1;
+    PyObject *categorical_splits_obj = Py_None;
+
+    /* Parse the input tuple */
+    if (!PyArg_ParseTuple(
+        args, "OOOOOiOOO|iO", &children_left_obj, &children_right_obj, &children_default_obj,
+        &features_obj, &thresholds_obj, &tree_limit, &X_obj, &X_missing_obj, &out_leaves_obj, &num_threads,
+        &categorical_splits_obj
+    )) return NULL;
+    if (num_threads < 1) num_threads = 1;
+
+    PyArrayObject *cat_offsets_array;
+    PyArrayObject *cat_bitsets_array;
+    const bool categorical_splits_ok = parse_categorical_splits(categorical_splits_obj, &cat_offsets_array, &cat_bitsets_array);
+
+    /* Interpret the input objects as numpy arrays. */
+    PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_leaves_array = (PyArrayObject*)PyArray_FROM_OTF(out_leaves_obj, NPY_INT, NPY_ARRAY_INOUT_ARRAY);
+
+    /* If that didn't work, throw an exception. */
+    if (!categorical_splits_ok || children_left_array == NULL || children_right_array == NULL ||
+        children_default_array == NULL || features_array == NULL || thresholds_array == NULL ||
+        X_array == NULL || X_missing_array == NULL || out_leaves_array == NULL) {
+        Py_XDECREF(children_left_array);
+        Py_XDECREF(cat_offsets_array);
+        Py_XDECREF(cat_bitsets_array);
+        Py_XDECREF(children_right_array);
+        Py_XDECREF(children_default_array);
+        Py_XDECREF(features_array);
+        Py_XDECREF(thresholds_array);
+        Py_XDECREF(X_array);
+        Py_XDECREF(X_missing_array);
+        Py_XDECREF(out_leaves_array);
+        return NULL;
+    }
+
+    const unsigned num_X = PyArray_DIM(X_array, 0);
+    const unsigned M = PyArray_DIM(X_array, 1);
+    const unsigned max_nodes = PyArray_DIM(children_left_array, 1);
+
+    // these are just wrapper objects for all the pointers and numbers associated with
+    // the ensemble tree model and the dataset we are explaining
+    TreeEnsemble trees = TreeEnsemble(
+        (int*)PyArray_DATA(children_left_array), (int*)PyArray_DATA(children_right_array),
+        (int*)PyArray_DATA(children_default_array), (int*)PyArray_DATA(features_array),
+        (tfloat*)PyArray_DATA(thresholds_array), NULL, NULL, 0, tree_limit, NULL, max_nodes, 0
+    );
+    set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+    ExplanationDataset data = ExplanationDataset(
+        (tfloat*)PyArray_DATA(X_array), (bool*)PyArray_DATA(X_missing_array), NULL, NULL, NULL, num_X, M, 0
+    );
+
+    Py_BEGIN_ALLOW_THREADS
+    dense_tree_predict_leaves((int*)PyArray_DATA(out_leaves_array), trees, data, num_threads);
+    Py_END_ALLOW_THREADS
+
+    // clean up the created python objects
+    Py_XDECREF(children_left_array);
+    Py_XDECREF(cat_offsets_array);
+    Py_XDECREF(cat_bitsets_array);
+    Py_XDECREF(children_right_array);
+    Py_XDECREF(children_default_array);
+    Py_XDECREF(features_array);
+    Py_XDECREF(thresholds_array);
+    Py_XDECREF(X_array);
+    Py_XDECREF(X_missing_array);
+    Py_XDECREF(out_leaves_array);
+
+    Py_RETURN_NONE;
+}
+
+
 static PyObject *_cext_dense_tree_update_weights(PyObject *self, PyObject *args)
 {
     PyObject *children_left_obj;
@@ -371,13 +786,20 @@ static PyObject *_cext_dense_tree_update_weights(PyObject *self, PyObject *args)
     PyObject *node_sample_weight_obj;
     PyObject *X_obj;
     PyObject *X_missing_obj;
+    PyObject *X_weights_obj = Py_None;
+    PyObject *categorical_splits_obj = Py_None;
 
     /* Parse the input tuple */
     if (!PyArg_ParseTuple(
-        args, "OOOOOOiOOO", &children_left_obj, &children_right_obj, &children_default_obj,
-        &features_obj, &thresholds_obj, &values_obj, &tree_limit, &node_sample_weight_obj, &X_obj, &X_missing_obj
+        args, "OOOOOOiOOO|OO", &children_left_obj, &children_right_obj, &children_default_obj,
+        &features_obj, &thresholds_obj, &values_obj, &tree_limit, &node_sample_weight_obj, &X_obj, &X_missing_obj,
+        &X_weights_obj, &categorical_splits_obj
     )) return NULL;
 
+    PyArrayObject *cat_offsets_array;
+    PyArrayObject *cat_bitsets_array;
+    const bool categorical_splits_ok = parse_categorical_splits(categorical_splits_obj, &cat_offsets_array, &cat_bitsets_array);
+
     /* Interpret the input objects as numpy arrays. */
     PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
@@ -388,13 +810,17 @@ static PyObject *_cext_dense_tree_update_weights(PyObject *self, PyObject *args)
     PyArrayObject *node_sample_weight_array = (PyArrayObject*)PyArray_FROM_OTF(node_sample_weight_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
     PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_weights_array = NULL;
+    if (X_weights_obj != Py_None) X_weights_array = (PyArrayObject*)PyArray_FROM_OTF(X_weights_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
 
     /* If that didn't work, throw an exception. */
-    if (children_left_array == NULL || children_right_array == NULL ||
+    if (!categorical_splits_ok || children_left_array == NULL || children_right_array == NULL ||
         children_default_array == NULL || features_array == NULL || thresholds_array == NULL ||
         values_array == NULL || node_sample_weight_array == NULL || X_array == NULL ||
-        X_missing_array == NULL) {
+        X_missing_array == NULL || (X_weights_obj != Py_None && X_weights_array == NULL)) {
         Py_XDECREF(children_left_array);
+        Py_XDECREF(cat_offsets_array);
+        Py_XDECREF(cat_bitsets_array);
         Py_XDECREF(children_right_array);
         Py_XDECREF(children_default_array);
         Py_XDECREF(features_array);
@@ -404,6 +830,7 @@ static PyObject *_cext_dense_tree_update_weights(PyObject *self, PyObject *args)
         Py_XDECREF(node_sample_weight_array);
         Py_XDECREF(X_array);
         Py_XDECREF(X_missing_array);
+        Py_XDECREF(X_weights_array);
         std::cerr << "Found a NULL input array in _cext_dense_tree_update_weights!\n";
         return NULL;
     }
@@ -429,12 +856,17 @@ static PyObject *_cext_dense_tree_update_weights(PyObject *self, PyObject *args)
         children_left, children_right, children_default, features, thresholds, values,
         node_sample_weight, 0, tree_limit, 0, max_nodes, 0
     );
+    set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
     ExplanationDataset data = ExplanationDataset(X, X_missing, NULL, NULL, NULL, num_X, M, 0);
 
-    dense_tree_update_weights(trees, data);
+    Py_BEGIN_ALLOW_THREADS
+    dense_tree_update_weights(trees, data, X_weights_array == NULL ? NULL : (tfloat*)PyArray_DATA(X_weights_array));
+    Py_END_ALLOW_THREADS
 
     // clean up the created python objects
     Py_XDECREF(children_left_array);
+    Py_XDECREF(cat_offsets_array);
+    Py_XDECREF(cat_bitsets_array);
     Py_XDECREF(children_right_array);
     Py_XDECREF(children_default_array);
     Py_XDECREF(features_array);
@@ -444,6 +876,7 @@ static PyObject *_cext_dense_tree_update_weights(PyObject *self, PyObject *args)
     Py_XDECREF(node_sample_weight_array);
     Py_XDECREF(X_array);
     Py_XDECREF(X_missing_array);
+    Py_XDECREF(X_weights_array);
 
     /* Build the output tuple */
     PyObject *ret = Py_BuildValue("d", 1);
@@ -467,35 +900,50 @@ static PyObject *_cext_dense_tree_saabas(PyObject *self, PyObject *args)
     PyObject *X_missing_obj;
     PyObject *y_obj;
     PyObject *out_pred_obj;
+    int num_threads = 1;
+    PyObject *out_predictions_obj = Py_None;
 
+    PyObject *categorical_splits_obj = Py_None;
 
     /* Parse the input tuple */
     if (!PyArg_ParseTuple(
-        args, "OOOOOOiiOiOOOO", &children_left_obj, &children_right_obj, &children_default_obj,
+        args, "OOOOOOiiOiOOOO|iOO", &children_left_obj, &children_right_obj, &children_default_obj,
         &features_obj, &thresholds_obj, &values_obj, &max_depth, &tree_limit, &base_offset_obj, &model_output,
-        &X_obj, &X_missing_obj, &y_obj, &out_pred_obj
+        &X_obj, &X_missing_obj, &y_obj, &out_pred_obj, &num_threads, &out_predictions_obj, &categorical_splits_obj
     )) return NULL;
+    if (num_threads < 1) num_threads = 1;
+
+    // a float32 values array selects the single precision kernels
+    const int float_type = (PyArray_Check(values_obj) && PyArray_TYPE((PyArrayObject*)values_obj) == NPY_FLOAT) ? NPY_FLOAT : NPY_DOUBLE;
+
+    PyArrayObject *cat_offsets_array;
+    PyArrayObject *cat_bitsets_array;
+    const bool categorical_splits_ok = parse_categorical_splits(categorical_splits_obj, &cat_offsets_array, &cat_bitsets_array);
 
     /* Interpret the input objects as numpy arrays. */
     PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, float_type, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
     PyArrayObject *y_array = NULL;
-    if (y_obj != Py_None) y_array = (PyArrayObject*)PyArray_FROM_OTF(y_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
-    PyArrayObject *out_pred_array = (PyArrayObject*)PyArray_FROM_OTF(out_pred_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    if (y_obj != Py_None) y_array = (PyArrayObject*)PyArray_FROM_OTF(y_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_pred_array = (PyArrayObject*)PyArray_FROM_OTF(out_pred_obj, float_type, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_predictions_array = NULL;
+    if (out_predictions_obj != Py_None) out_predictions_array = (PyArrayObject*)PyArray_FROM_OTF(out_predictions_obj, float_type, NPY_ARRAY_INOUT_ARRAY);
 
     /* If that didn't work, throw an exception. Note that R and y are optional. */
-    if (children_left_array == NULL || children_right_array == NULL ||
+    if (!categorical_splits_ok || children_left_array == NULL || children_right_array == NULL ||
         children_default_array == NULL || features_array == NULL || thresholds_array == NULL ||
         values_array == NULL || X_array == NULL ||
-        X_missing_array == NULL || out_pred_array == NULL) {
+        X_missing_array == NULL || out_pred_array == NULL || (out_predictions_obj != Py_None && out_predictions_array == NULL)) {
         Py_XDECREF(children_left_array);
+        Py_XDECREF(cat_offsets_array);
+        Py_XDECREF(cat_bitsets_array);
         Py_XDECREF(children_right_array);
         Py_XDECREF(children_default_array);
         Py_XDECREF(features_array);
@@ -507,6 +955,7 @@ static PyObject *_cext_dense_tree_saabas(PyObject *self, PyObject *args)
         if (y_array != NULL) Py_XDECREF(y_array);
         //PyArray_ResolveWritebackIfCopy(out_pred_array);
         Py_XDECREF(out_pred_array);
+        Py_XDECREF(out_predictions_array);
         return NULL;
     }
 
@@ -520,41 +969,682 @@ static PyObject *_cext_dense_tree_saabas(PyObject *self, PyObject *args)
     int *children_right = (int*)PyArray_DATA(children_right_array);
     int *children_default = (int*)PyArray_DATA(children_default_array);
     int *features = (int*)PyArray_DATA(features_array);
-    tfloat *thresholds = (tfloat*)PyArray_DATA(thresholds_array);
-    tfloat *values = (tfloat*)PyArray_DATA(values_array);
-    tfloat *base_offset = (tfloat*)PyArray_DATA(base_offset_array);
-    tfloat *X = (tfloat*)PyArray_DATA(X_array);
     bool *X_missing = (bool*)PyArray_DATA(X_missing_array);
-    tfloat *y = NULL;
-    if (y_array != NULL) y = (tfloat*)PyArray_DATA(y_array);
-    tfloat *out_pred = (tfloat*)PyArray_DATA(out_pred_array);
+
+    tfloat ret_value = 0;
+    if (float_type == NPY_FLOAT) {
+        float *thresholds = (float*)PyArray_DATA(thresholds_array);
+        float *values = (float*)PyArray_DATA(values_array);
+        float *base_offset = (float*)PyArray_DATA(base_offset_array);
+        float *X = (float*)PyArray_DATA(X_array);
+        float *y = NULL;
+        if (y_array != NULL) y = (float*)PyArray_DATA(y_array);
+        float *out_pred = (float*)PyArray_DATA(out_pred_array);
+
+        // these are just wrapper objects for all the pointers and numbers associated with
+        // the ensemble tree model and the dataset we are explaining
+        TreeEnsembleT<float> trees = TreeEnsembleT<float>(
+            children_left, children_right, children_default, features, thresholds, values,
+            NULL, max_depth, tree_limit, base_offset,
+            max_nodes, num_outputs
+        );
+        set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+        ExplanationDatasetT<float> data = ExplanationDatasetT<float>(X, X_missing, y, NULL, NULL, num_X, M, 0);
+        if (out_predictions_array != NULL) data.out_predictions = (float*)PyArray_DATA(out_predictions_array);
+
+        Py_BEGIN_ALLOW_THREADS
+        dense_tree_saabas(out_pred, trees, data, num_threads, get_transform(model_output));
+        Py_END_ALLOW_THREADS
+
+        ret_value = (double)values[0];
+    } else {
+        tfloat *thresholds = (tfloat*)PyArray_DATA(thresholds_array);
+        tfloat *values = (tfloat*)PyArray_DATA(values_array);
+        tfloat *base_offset = (tfloat*)PyArray_DATA(base_offset_array);
+        tfloat *X = (tfloat*)PyArray_DATA(X_array);
+        tfloat *y = NULL;
+        if (y_array != NULL) y = (tfloat*)PyArray_DATA(y_array);
+        tfloat *out_pred = (tfloat*)PyArray_DATA(out_pred_array);
+
+        // these are just wrapper objects for all the pointers and numbers associated with
+        // the ensemble tree model and the dataset we are explaining
+        TreeEnsemble trees = TreeEnsemble(
+            children_left, children_right, children_default, features, thresholds, values,
+            NULL, max_depth, tree_limit, base_offset,
+            max_nodes, num_outputs
+        );
+        set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+        ExplanationDataset data = ExplanationDataset(X, X_missing, y, NULL, NULL, num_X, M, 0);
+        if (out_predictions_array != NULL) data.out_predictions = (tfloat*)PyArray_DATA(out_predictions_array);
+
+        Py_BEGIN_ALLOW_THREADS
+        dense_tree_saabas(out_pred, trees, data, num_threads, get_transform(model_output));
+        Py_END_ALLOW_THREADS
+
+        ret_value = (double)values[0];
+    }
+
+    // clean up the created python objects
+    Py_XDECREF(children_left_array);
+    Py_XDECREF(cat_offsets_array);
+    Py_XDECREF(cat_bitsets_array);
+    Py_XDECREF(children_right_array);
+    Py_XDECREF(children_default_array);
+    Py_XDECREF(features_array);
+    Py_XDECREF(thresholds_array);
+    Py_XDECREF(values_array);
+    Py_XDECREF(base_offset_array);
+    Py_XDECREF(X_array);
+    Py_XDECREF(X_missing_array);
+    if (y_array != NULL) Py_XDECREF(y_array);
+    //PyArray_ResolveWritebackIfCopy(out_pred_array);
+    Py_XDECREF(out_pred_array);
+    Py_XDECREF(out_predictions_array);
+
+    /* Build the output tuple */
+    PyObject *ret = Py_BuildValue("d", ret_value);
+    return ret;
+}
+
+
+static PyObject *_cext_dense_tree_shap_truncated(PyObject *self, PyObject *args)
+{
+    PyObject *children_left_obj;
+    PyObject *children_right_obj;
+    PyObject *children_default_obj;
+    PyObject *features_obj;
+    PyObject *thresholds_obj;
+    PyObject *values_obj;
+    PyObject *node_sample_weights_obj;
+    int max_depth;
+    PyObject *X_obj;
+    PyObject *X_missing_obj;
+    PyObject *y_obj;
+    int tree_limit;
+    PyObject *base_offset_obj;
+    int exact_depth;
+    PyObject *out_contribs_obj;
+    int model_output;
+    int num_threads = 1;
+    PyObject *out_error_bounds_obj = Py_None;
+    PyObject *out_predictions_obj = Py_None;
+    PyObject *categorical_splits_obj = Py_None;
+
+    /* Parse the input tuple */
+    if (!PyArg_ParseTuple(
+        args, "OOOOOOOiOOOiOiOi|iOOO", &children_left_obj, &children_right_obj, &children_default_obj,
+        &features_obj, &thresholds_obj, &values_obj, &node_sample_weights_obj, &max_depth, &X_obj, &X_missing_obj,
+        &y_obj, &tree_limit, &base_offset_obj, &exact_depth, &out_contribs_obj, &model_output, &num_threads,
+        &out_error_bounds_obj, &out_predictions_obj, &categorical_splits_obj
+    )) return NULL;
+    if (num_threads < 1) num_threads = 1;
+    if (exact_depth < 0) {
+        PyErr_SetString(PyExc_ValueError, "The exactly explained depth can not be negative!");
+        return NULL;
+    }
+
+    PyArrayObject *cat_offsets_array;
+    PyArrayObject *cat_bitsets_array;
+    const bool categorical_splits_ok = parse_categorical_splits(categorical_splits_obj, &cat_offsets_array, &cat_bitsets_array);
+
+    /* Interpret the input objects as numpy arrays. */
+    PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *node_sample_weights_array = (PyArrayObject*)PyArray_FROM_OTF(node_sample_weights_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *y_array = NULL;
+    if (y_obj != Py_None) y_array = (PyArrayObject*)PyArray_FROM_OTF(y_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_contribs_array = (PyArrayObject*)PyArray_FROM_OTF(out_contribs_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
+    PyArrayObject *out_error_bounds_array = NULL;
+    if (out_error_bounds_obj != Py_None) out_error_bounds_array = (PyArrayObject*)PyArray_FROM_OTF(out_error_bounds_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
+    PyArrayObject *out_predictions_array = NULL;
+    if (out_predictions_obj != Py_None) out_predictions_array = (PyArrayObject*)PyArray_FROM_OTF(out_predictions_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
+
+    /* If that didn't work, throw an exception. Note that y is optional. */
+    if (!categorical_splits_ok || children_left_array == NULL || children_right_array == NULL ||
+        children_default_array == NULL || features_array == NULL || thresholds_array == NULL ||
+        values_array == NULL || node_sample_weights_array == NULL || X_array == NULL ||
+        X_missing_array == NULL || base_offset_array == NULL || out_contribs_array == NULL ||
+        (y_obj != Py_None && y_array == NULL) ||
+        (out_error_bounds_obj != Py_None && out_error_bounds_array == NULL) ||
+        (out_predictions_obj != Py_None && out_predictions_array == NULL)) {
+        Py_XDECREF(children_left_array);
+        Py_XDECREF(cat_offsets_array);
+        Py_XDECREF(cat_bitsets_array);
+        Py_XDECREF(children_right_array);
+        Py_XDECREF(children_default_array);
+        Py_XDECREF(features_array);
+        Py_XDECREF(thresholds_array);
+        Py_XDECREF(values_array);
+        Py_XDECREF(node_sample_weights_array);
+        Py_XDECREF(X_array);
+        Py_XDECREF(X_missing_array);
+        Py_XDECREF(y_array);
+        Py_XDECREF(base_offset_array);
+        Py_XDECREF(out_contribs_array);
+        Py_XDECREF(out_error_bounds_array);
+        Py_XDECREF(out_predictions_array);
+        return NULL;
+    }
+
+    const unsigned num_X = PyArray_DIM(X_array, 0);
+    const unsigned M = PyArray_DIM(X_array, 1);
+    const unsigned max_nodes = PyArray_DIM(values_array, 1);
+    const unsigned num_outputs = PyArray_DIM(values_array, 2);
 
     // these are just wrapper objects for all the pointers and numbers associated with
     // the ensemble tree model and the dataset we are explaining
     TreeEnsemble trees = TreeEnsemble(
-        children_left, children_right, children_default, features, thresholds, values,
-        NULL, max_depth, tree_limit, base_offset,
-        max_nodes, num_outputs
+        (int*)PyArray_DATA(children_left_array), (int*)PyArray_DATA(children_right_array),
+        (int*)PyArray_DATA(children_default_array), (int*)PyArray_DATA(features_array),
+        (tfloat*)PyArray_DATA(thresholds_array), (tfloat*)PyArray_DATA(values_array),
+        (tfloat*)PyArray_DATA(node_sample_weights_array), max_depth, tree_limit,
+        (tfloat*)PyArray_DATA(base_offset_array), max_nodes, num_outputs
+    );
+    set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+    ExplanationDataset data = ExplanationDataset(
+        (tfloat*)PyArray_DATA(X_array), (bool*)PyArray_DATA(X_missing_array),
+        y_array == NULL ? NULL : (tfloat*)PyArray_DATA(y_array), NULL, NULL, num_X, M, 0
     );
-    ExplanationDataset data = ExplanationDataset(X, X_missing, y, NULL, NULL, num_X, M, 0);
+    if (out_predictions_array != NULL) data.out_predictions = (tfloat*)PyArray_DATA(out_predictions_array);
+    tfloat *out_error_bounds = out_error_bounds_array == NULL ? NULL : (tfloat*)PyArray_DATA(out_error_bounds_array);
 
-    dense_tree_saabas(out_pred, trees, data);
+    Py_BEGIN_ALLOW_THREADS
+    dense_tree_shap_truncated(
+        trees, data, (tfloat*)PyArray_DATA(out_contribs_array), exact_depth, out_error_bounds,
+        get_transform(model_output), num_threads
+    );
+    Py_END_ALLOW_THREADS
 
     // clean up the created python objects
     Py_XDECREF(children_left_array);
+    Py_XDECREF(cat_offsets_array);
+    Py_XDECREF(cat_bitsets_array);
     Py_XDECREF(children_right_array);
     Py_XDECREF(children_default_array);
     Py_XDECREF(features_array);
     Py_XDECREF(thresholds_array);
     Py_XDECREF(values_array);
-    Py_XDECREF(base_offset_array);
+    Py_XDECREF(node_sample_weights_array);
     Py_XDECREF(X_array);
     Py_XDECREF(X_missing_array);
-    if (y_array != NULL) Py_XDECREF(y_array);
-    //PyArray_ResolveWritebackIfCopy(out_pred_array);
-    Py_XDECREF(out_pred_array);
+    Py_XDECREF(y_array);
+    Py_XDECREF(base_offset_array);
+    Py_XDECREF(out_contribs_array);
+    Py_XDECREF(out_error_bounds_array);
+    Py_XDECREF(out_predictions_array);
+
+    Py_RETURN_NONE;
+}
+
+
+template <typename T>
+static PyObject *vector_to_array(const std::vector<T> &v, const int typenum)
+{
+    npy_intp dims[1] = {static_cast<npy_intp>(v.size())};
+    PyObject *array = PyArray_SimpleNew(1, dims, typenum);
+    if (array != NULL) std::copy(v.begin(), v.end(), (T*)PyArray_DATA((PyArrayObject*)array));
+    return array;
+}
+
+
+static PyObject *_cext_compute_path_tables(PyObject *self, PyObject *args)
+{
+    PyObject *children_left_obj;
+    PyObject *children_right_obj;
+    PyObject *features_obj;
+    PyObject *node_sample_weights_obj;
+    int tree_limit;
+    long long max_table_size;
+
+    /* Parse the input tuple */
+    if (!PyArg_ParseTuple(
+        args, "OOOOiL", &children_left_obj, &children_right_obj, &features_obj, &node_sample_weights_obj,
+        &tree_limit, &max_table_size
+    )) return NULL;
+
+    /* Interpret the input objects as numpy arrays. */
+    PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *node_sample_weights_array = (PyArrayObject*)PyArray_FROM_OTF(node_sample_weights_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+
+    /* If that didn't work, throw an exception. */
+    if (children_left_array == NULL || children_right_array == NULL ||
+        features_array == NULL || node_sample_weights_array == NULL) {
+        Py_XDECREF(children_left_array);
+        Py_XDECREF(children_right_array);
+        Py_XDECREF(features_array);
+        Py_XDECREF(node_sample_weights_array);
+        return NULL;
+    }
+
+    // only the tree structure and the node weights are needed to build the tables
+    TreeEnsemble trees = TreeEnsemble(
+        (int*)PyArray_DATA(children_left_array), (int*)PyArray_DATA(children_right_array), NULL,
+        (int*)PyArray_DATA(features_array), NULL, NULL, (tfloat*)PyArray_DATA(node_sample_weights_array),
+        0, tree_limit, NULL, PyArray_DIM(children_left_array, 1), 0
+    );
+
+    PathTablesStorage tables;
+    bool success;
+    Py_BEGIN_ALLOW_THREADS
+    success = build_path_tables(trees, tables, max_table_size);
+    Py_END_ALLOW_THREADS
+
+    // clean up the created python objects
+    Py_XDECREF(children_left_array);
+    Py_XDECREF(children_right_array);
+    Py_XDECREF(features_array);
+    Py_XDECREF(node_sample_weights_array);
+
+    if (!success) {
+        PyErr_SetString(PyExc_ValueError, "The path tables of this model are too large! Please use algorithm=\"recursive\".");
+        return NULL;
+    }
+
+    /* Build the output tuple */
+    PyObject *ret = Py_BuildValue(
+        "(NNNNNNNN)",
+        vector_to_array(tables.tree_leaf_offsets, NPY_INT), vector_to_array(tables.leaf_nodes, NPY_INT),
+        vector_to_array(tables.leaf_feature_offsets, NPY_INT), vector_to_array(tables.features, NPY_INT),
+        vector_to_array(tables.zero_fractions, NPY_DOUBLE), vector_to_array(tables.node_positions, NPY_INT),
+        vector_to_array(tables.table_offsets, NPY_LONGLONG), vector_to_array(tables.tables, NPY_DOUBLE)
+    );
+    return ret;
+}
+
+
+static PyObject *_cext_dense_tree_shap_path_tables(PyObject *self, PyObject *args)
+{
+    PyObject *children_left_obj;
+    PyObject *children_right_obj;
+    PyObject *children_default_obj;
+    PyObject *features_obj;
+    PyObject *thresholds_obj;
+    PyObject *values_obj;
+    int tree_limit;
+    PyObject *base_offset_obj;
+    PyObject *table_objs[8];
+    PyObject *X_obj;
+    PyObject *X_missing_obj;
+    PyObject *out_contribs_obj;
+    int num_threads = 1;
+
+    /* Parse the input tuple */
+    if (!PyArg_ParseTuple(
+        args, "OOOOOOiO(OOOOOOOO)OOO|i", &children_left_obj, &children_right_obj, &children_default_obj,
+        &features_obj, &thresholds_obj, &values_obj, &tree_limit, &base_offset_obj,
+        &table_objs[0], &table_objs[1], &table_objs[2], &table_objs[3], &table_objs[4], &table_objs[5],
+        &table_objs[6], &table_objs[7],
+        &X_obj, &X_missing_obj, &out_contribs_obj, &num_threads
+    )) return NULL;
+    if (num_threads < 1) num_threads = 1;
+
+    /* Interpret the input objects as numpy arrays. */
+    PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_contribs_array = (PyArrayObject*)PyArray_FROM_OTF(out_contribs_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
+    const int table_types[8] = {
+        NPY_INT, NPY_INT, NPY_INT, NPY_INT, NPY_DOUBLE, NPY_INT, NPY_LONGLONG, NPY_DOUBLE
+    };
+    PyArrayObject *table_arrays[8];
+    bool tables_ok = true;
+    for (unsigned i = 0; i < 8; ++i) {
+        table_arrays[i] = (PyArrayObject*)PyArray_FROM_OTF(table_objs[i], table_types[i], NPY_ARRAY_IN_ARRAY);
+        if (table_arrays[i] == NULL) tables_ok = false;
+    }
+
+    /* If that didn't work, throw an exception. */
+    if (children_left_array == NULL || children_right_array == NULL ||
+        children_default_array == NULL || features_array == NULL || thresholds_array == NULL ||
+        values_array == NULL || base_offset_array == NULL || X_array == NULL ||
+        X_missing_array == NULL || out_contribs_array == NULL || !tables_ok) {
+        Py_XDECREF(children_left_array);
+        Py_XDECREF(children_right_array);
+        Py_XDECREF(children_default_array);
+        Py_XDECREF(features_array);
+        Py_XDECREF(thresholds_array);
+        Py_XDECREF(values_array);
+        Py_XDECREF(base_offset_array);
+        Py_XDECREF(X_array);
+        Py_XDECREF(X_missing_array);
+        Py_XDECREF(out_contribs_array);
+        for (unsigned i = 0; i < 8; ++i) Py_XDECREF(table_arrays[i]);
+        return NULL;
+    }
+
+    const unsigned num_X = PyArray_DIM(X_array, 0);
+    const unsigned M = PyArray_DIM(X_array, 1);
+    const unsigned max_nodes = PyArray_DIM(values_array, 1);
+    const unsigned num_outputs = PyArray_DIM(values_array, 2);
+
+    // these are just wrapper objects for all the pointers and numbers associated with
+    // the ensemble tree model, its path tables and the dataset we are explaining
+    TreeEnsemble trees = TreeEnsemble(
+        (int*)PyArray_DATA(children_left_array), (int*)PyArray_DATA(children_right_array),
+        (int*)PyArray_DATA(children_default_array), (int*)PyArray_DATA(features_array),
+        (tfloat*)PyArray_DATA(thresholds_array), (tfloat*)PyArray_DATA(values_array), NULL,
+        0, tree_limit, (tfloat*)PyArray_DATA(base_offset_array), max_nodes, num_outputs
+    );
+    PathTables tables = PathTables(
+        (int*)PyArray_DATA(table_arrays[0]), (int*)PyArray_DATA(table_arrays[1]),
+        (int*)PyArray_DATA(table_arrays[2]), (int*)PyArray_DATA(table_arrays[3]),
+        (tfloat*)PyArray_DATA(table_arrays[4]), (int*)PyArray_DATA(table_arrays[5]),
+        (long long*)PyArray_DATA(table_arrays[6]), (tfloat*)PyArray_DATA(table_arrays[7])
+    );
+    ExplanationDataset data = ExplanationDataset(
+        (tfloat*)PyArray_DATA(X_array), (bool*)PyArray_DATA(X_missing_array), NULL, NULL, NULL, num_X, M, 0
+    );
+
+    Py_BEGIN_ALLOW_THREADS
+    dense_tree_path_tables(trees, tables, data, (tfloat*)PyArray_DATA(out_contribs_array), num_threads);
+    Py_END_ALLOW_THREADS
+
+    // clean up the created python objects
+    Py_XDECREF(children_left_array);
+    Py_XDECREF(children_right_array);
+    Py_XDECREF(children_default_array);
+    Py_XDECREF(features_array);
+    Py_XDECREF(thresholds_array);
+    Py_XDECREF(values_array);
+    Py_XDECREF(base_offset_array);
+    Py_XDECREF(X_array);
+    Py_XDECREF(X_missing_array);
+    Py_XDECREF(out_contribs_array);
+    for (unsigned i = 0; i < 8; ++i) Py_XDECREF(table_arrays[i]);
+
+    /* Build the output tuple */
+    PyObject *ret = Py_BuildValue("d", 1);
+    return ret;
+}
+
+
+static PyObject *_cext_compute_paths(PyObject *self, PyObject *args)
+{
+    PyObject *children_left_obj;
+    PyObject *children_right_obj;
+    PyObject *children_default_obj;
+    PyObject *features_obj;
+    PyObject *thresholds_obj;
+    PyObject *node_sample_weights_obj;
+    int tree_limit;
+
+    /* Parse the input tuple */
+    if (!PyArg_ParseTuple(
+        args, "OOOOOOi", &children_left_obj, &children_right_obj, &children_default_obj, &features_obj,
+        &thresholds_obj, &node_sample_weights_obj, &tree_limit
+    )) return NULL;
+
+    /* Interpret the input objects as numpy arrays. */
+    PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *node_sample_weights_array = (PyArrayObject*)PyArray_FROM_OTF(node_sample_weights_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+
+    /* If that didn't work, throw an exception. */
+    if (children_left_array == NULL || children_right_array == NULL || children_default_array == NULL ||
+        features_array == NULL || thresholds_array == NULL || node_sample_weights_array == NULL) {
+        Py_XDECREF(children_left_array);
+        Py_XDECREF(children_right_array);
+        Py_XDECREF(children_default_array);
+        Py_XDECREF(features_array);
+        Py_XDECREF(thresholds_array);
+        Py_XDECREF(node_sample_weights_array);
+        return NULL;
+    }
+
+    // only the tree structure, the thresholds and the node weights are needed to extract the paths
+    TreeEnsemble trees = TreeEnsemble(
+        (int*)PyArray_DATA(children_left_array), (int*)PyArray_DATA(children_right_array),
+        (int*)PyArray_DATA(children_default_array), (int*)PyArray_DATA(features_array),
+        (tfloat*)PyArray_DATA(thresholds_array), NULL, (tfloat*)PyArray_DATA(node_sample_weights_array),
+        0, tree_limit, NULL, PyArray_DIM(children_left_array, 1), 0
+    );
+
+    TreePathsStorage paths;
+    Py_BEGIN_ALLOW_THREADS
+    extract_paths(trees, paths);
+    Py_END_ALLOW_THREADS
+
+    // clean up the created python objects
+    Py_XDECREF(children_left_array);
+    Py_XDECREF(children_right_array);
+    Py_XDECREF(children_default_array);
+    Py_XDECREF(features_array);
+    Py_XDECREF(thresholds_array);
+    Py_XDECREF(node_sample_weights_array);
+
+    /* Build the output tuple */
+    PyObject *ret = Py_BuildValue(
+        "(NNNNNNNN)",
+        vector_to_array(paths.tree_path_offsets, NPY_INT), vector_to_array(paths.path_leaves, NPY_INT),
+        vector_to_array(paths.path_offsets, NPY_INT), vector_to_array(paths.features, NPY_INT),
+        vector_to_array(paths.lower_bounds, NPY_DOUBLE), vector_to_array(paths.upper_bounds, NPY_DOUBLE),
+        vector_to_array(paths.missing_branches, NPY_BOOL), vector_to_array(paths.zero_fractions, NPY_DOUBLE)
+    );
+    return ret;
+}
+
+
+static PyObject *_cext_dense_tree_shap_paths(PyObject *self, PyObject *args)
+{
+    PyObject *values_obj;
+    int tree_limit;
+    PyObject *base_offset_obj;
+    PyObject *path_objs[8];
+    PyObject *X_obj;
+    PyObject *X_missing_obj;
+    PyObject *out_contribs_obj;
+    int num_threads = 1;
+
+    /* Parse the input tuple */
+    if (!PyArg_ParseTuple(
+        args, "OiO(OOOOOOOO)OOO|i", &values_obj, &tree_limit, &base_offset_obj,
+        &path_objs[0], &path_objs[1], &path_objs[2], &path_objs[3], &path_objs[4], &path_objs[5],
+        &path_objs[6], &path_objs[7], &X_obj, &X_missing_obj, &out_contribs_obj, &num_threads
+    )) return NULL;
+    if (num_threads < 1) num_threads = 1;
+
+    /* Interpret the input objects as numpy arrays. */
+    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_array = (PyArrayObject*)PyArray_FROM_OTF(X_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *X_missing_array = (PyArrayObject*)PyArray_FROM_OTF(X_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *out_contribs_array = (PyArrayObject*)PyArray_FROM_OTF(out_contribs_obj, NPY_DOUBLE, NPY_ARRAY_INOUT_ARRAY);
+    const int path_types[8] = {NPY_INT, NPY_INT, NPY_INT, NPY_INT, NPY_DOUBLE, NPY_DOUBLE, NPY_BOOL, NPY_DOUBLE};
+    PyArrayObject *path_arrays[8];
+    bool paths_ok = true;
+    for (unsigned i = 0; i < 8; ++i) {
+        path_arrays[i] = (PyArrayObject*)PyArray_FROM_OTF(path_objs[i], path_types[i], NPY_ARRAY_IN_ARRAY);
+        if (path_arrays[i] == NULL) paths_ok = false;
+    }
+
+    /* If that didn't work, throw an exception. */
+    if (values_array == NULL || base_offset_array == NULL || X_array == NULL ||
+        X_missing_array == NULL || out_contribs_array == NULL || !paths_ok) {
+        Py_XDECREF(values_array);
+        Py_XDECREF(base_offset_array);
+        Py_XDECREF(X_array);
+        Py_XDECREF(X_missing_array);
+        Py_XDECREF(out_contribs_array);
+        for (unsigned i = 0; i < 8; ++i) Py_XDECREF(path_arrays[i]);
+        return NULL;
+    }
+
+    const unsigned num_X = PyArray_DIM(X_array, 0);
+    const unsigned M = PyArray_DIM(X_array, 1);
+    const unsigned max_nodes = PyArray_DIM(values_array, 1);
+    const unsigned num_outputs = PyArray_DIM(values_array, 2);
+
+    // these are just wrapper objects for all the pointers and numbers associated with
+    // the ensemble tree model, its paths and the dataset we are explaining
+    TreeEnsemble trees = TreeEnsemble(
+        NULL, NULL, NULL, NULL, NULL, (tfloat*)PyArray_DATA(values_array), NULL,
+        0, tree_limit, (tfloat*)PyArray_DATA(base_offset_array), max_nodes, num_outputs
+    );
+    TreePaths paths = TreePaths(
+        (int*)PyArray_DATA(path_arrays[0]), (int*)PyArray_DATA(path_arrays[1]),
+        (int*)PyArray_DATA(path_arrays[2]), (int*)PyArray_DATA(path_arrays[3]),
+        (tfloat*)PyArray_DATA(path_arrays[4]), (tfloat*)PyArray_DATA(path_arrays[5]),
+        (bool*)PyArray_DATA(path_arrays[6]), (tfloat*)PyArray_DATA(path_arrays[7])
+    );
+    ExplanationDataset data = ExplanationDataset(
+        (tfloat*)PyArray_DATA(X_array), (bool*)PyArray_DATA(X_missing_array), NULL, NULL, NULL, num_X, M, 0
+    );
+
+    Py_BEGIN_ALLOW_THREADS
+    dense_tree_paths(trees, paths, data, (tfloat*)PyArray_DATA(out_contribs_array), num_threads);
+    Py_END_ALLOW_THREADS
+
+    // clean up the created python objects
+    Py_XDECREF(values_array);
+    Py_XDECREF(base_offset_array);
+    Py_XDECREF(X_array);
+    Py_XDECREF(X_missing_array);
+    Py_XDECREF(out_contribs_array);
+    for (unsigned i = 0; i < 8; ++i) Py_XDECREF(path_arrays[i]);
+
+    /* Build the output tuple */
+    PyObject *ret = Py_BuildValue("d", 1);
+    return ret;
+}
+
+
+static PyObject *_cext_compute_background_cache(PyObject *self, PyObject *args)
+{
+    PyObject *children_left_obj;
+    PyObject *children_right_obj;
+    PyObject *children_default_obj;
+    PyObject *features_obj;
+    PyObject *thresholds_obj;
+    PyObject *values_obj;
+    int max_depth;
+    PyObject *R_obj;
+    PyObject *R_missing_obj;
+    int tree_limit;
+    PyObject *base_offset_obj;
+    int num_threads = 1;
+    PyObject *categorical_splits_obj = Py_None;
+
+    /* Parse the input tuple */
+    if (!PyArg_ParseTuple(
+        args, "OOOOOOiOOiO|iO", &children_left_obj, &children_right_obj, &children_default_obj,
+        &features_obj, &thresholds_obj, &values_obj, &max_depth, &R_obj, &R_missing_obj,
+        &tree_limit, &base_offset_obj, &num_threads, &categorical_splits_obj
+    )) return NULL;
+    if (num_threads < 1) num_threads = 1;
+
+    PyArrayObject *cat_offsets_array;
+    PyArrayObject *cat_bitsets_array;
+    const bool categorical_splits_ok = parse_categorical_splits(categorical_splits_obj, &cat_offsets_array, &cat_bitsets_array);
+
+    /* Interpret the input objects as numpy arrays. */
+    PyArrayObject *children_left_array = (PyArrayObject*)PyArray_FROM_OTF(children_left_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_right_array = (PyArrayObject*)PyArray_FROM_OTF(children_right_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *children_default_array = (PyArrayObject*)PyArray_FROM_OTF(children_default_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *features_array = (PyArrayObject*)PyArray_FROM_OTF(features_obj, NPY_INT, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *thresholds_array = (PyArrayObject*)PyArray_FROM_OTF(thresholds_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *values_array = (PyArrayObject*)PyArray_FROM_OTF(values_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *R_array = (PyArrayObject*)PyArray_FROM_OTF(R_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *R_missing_array = (PyArrayObject*)PyArray_FROM_OTF(R_missing_obj, NPY_BOOL, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *base_offset_array = (PyArrayObject*)PyArray_FROM_OTF(base_offset_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+
+    /* If that didn't work, throw an exception. */
+    if (!categorical_splits_ok || children_left_array == NULL || children_right_array == NULL || children_default_array == NULL ||
+        features_array == NULL || thresholds_array == NULL || values_array == NULL || R_array == NULL ||
+        R_missing_array == NULL || base_offset_array == NULL) {
+        Py_XDECREF(children_left_array);
+        Py_XDECREF(cat_offsets_array);
+        Py_XDECREF(cat_bitsets_array);
+        Py_XDECREF(children_right_array);
+        Py_XDECREF(children_default_array);
+        Py_XDECREF(features_array);
+        Py_XDECREF(thresholds_array);
+        Py_XDECREF(values_array);
+        Py_XDECREF(R_array);
+        Py_XDECREF(R_missing_array);
+        Py_XDECREF(base_offset_array);
+        return NULL;
+    }
+
+    const unsigned num_R = PyArray_DIM(R_array, 0);
+    const unsigned M = PyArray_DIM(R_array, 1);
+    const unsigned max_nodes = PyArray_DIM(values_array, 1);
+    const unsigned num_outputs = PyArray_DIM(values_array, 2);
+
+    TreeEnsemble trees = TreeEnsemble(
+        (int*)PyArray_DATA(children_left_array), (int*)PyArray_DATA(children_right_array),
+        (int*)PyArray_DATA(children_default_array), (int*)PyArray_DATA(features_array),
+        (tfloat*)PyArray_DATA(thresholds_array), (tfloat*)PyArray_DATA(values_array), NULL,
+        max_depth, tree_limit, (tfloat*)PyArray_DATA(base_offset_array), max_nodes, num_outputs
+    );
+    set_categorical_splits(trees, cat_offsets_array, cat_bitsets_array);
+    ExplanationDataset data = ExplanationDataset(
+        NULL, NULL, NULL, (tfloat*)PyArray_DATA(R_array), (bool*)PyArray_DATA(R_missing_array), 0, M, num_R
+    );
+
+    // the reformatted trees are stored as raw bytes, they are only ever read back by dense_tree_shap
+    const npy_intp num_tree_nodes = (npy_intp)tree_limit * max_nodes;
+    npy_intp node_dims[1] = {num_tree_nodes * num_outputs * (npy_intp)sizeof(Node)};
+    npy_intp weight_dims[1] = {(npy_intp)(max_depth + 1) * (max_depth + 1)};
+    npy_intp direction_dims[1] = {num_tree_nodes * num_R};
+    npy_intp margin_dims[2] = {num_R, num_outputs};
+    PyArrayObject *node_trees_array = (PyArrayObject*)PyArray_ZEROS(1, node_dims, NPY_UINT8, 0);
+    PyArrayObject *weights_array = (PyArrayObject*)PyArray_SimpleNew(1, weight_dims, NPY_FLOAT);
+    PyArrayObject *directions_array = (PyArrayObject*)PyArray_SimpleNew(1, direction_dims, NPY_UINT8);
+    PyArrayObject *margins_array = (PyArrayObject*)PyArray_SimpleNew(2, margin_dims, NPY_DOUBLE);
+
+    if (node_trees_array != NULL && weights_array != NULL && directions_array != NULL && margins_array != NULL) {
+        Node *node_trees = (Node*)PyArray_DATA(node_trees_array);
+
+        Py_BEGIN_ALLOW_THREADS
+        for (unsigned oind = 0; oind < num_outputs; ++oind) {
+            build_independent_node_trees(trees, oind, node_trees + oind * num_tree_nodes);
+        }
+        compute_independent_weights(max_depth, (float*)PyArray_DATA(weights_array));
+        compute_background_directions(trees, data, node_trees, (unsigned char*)PyArray_DATA(directions_array), num_threads);
+        compute_background_margins(trees, data, (tfloat*)PyArray_DATA(margins_array));
+        Py_END_ALLOW_THREADS
+    }
+
+    // clean up the created python objects
+    Py_XDECREF(children_left_array);
+    Py_XDECREF(cat_offsets_array);
+    Py_XDECREF(cat_bitsets_array);
+    Py_XDECREF(children_right_array);
+    Py_XDECREF(children_default_array);
+    Py_XDECREF(features_array);
+    Py_XDECREF(thresholds_array);
+    Py_XDECREF(values_array);
+    Py_XDECREF(R_array);
+    Py_XDECREF(R_missing_array);
+    Py_XDECREF(base_offset_array);
+
+    if (node_trees_array == NULL || weights_array == NULL || directions_array == NULL || margins_array == NULL) {
+        Py_XDECREF(node_trees_array);
+        Py_XDECREF(weights_array);
+        Py_XDECREF(directions_array);
+        Py_XDECREF(margins_array);
+        return NULL;
+    }
 
     /* Build the output tuple */
-    PyObject *ret = Py_BuildValue("d", (double)values[0]);
+    PyObject *ret = Py_BuildValue("(NNNN)", node_trees_array, weights_array, directions_array, margins_array);
     return ret;
 }
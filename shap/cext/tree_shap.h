@@ -11,6 +11,9 @@
 #include <stdio.h>
 #include <cmath>
 #include <ctime>
+#include <limits>
+#include <thread>
+#include <vector>
 #if defined(_WIN32) || defined(WIN32)
     #include <malloc.h>
 #elif defined(__MVS__)
@@ -29,24 +32,43 @@ namespace FEATURE_DEPENDENCE {
     const unsigned global_path_dependent = 2;
 }
 
-struct TreeEnsemble {
+/**
+ * Whether a (non missing) value x goes to the left child of internal node pos. Numerical splits send
+ * x <= threshold left. Categorical splits (cat_offsets[pos] >= 0) send x left if its category, the integer
+ * part of x, is in the set of the node: cat_bitsets[cat_offsets[pos]] holds the number of 32 bit words n
+ * of the set and the next n words its bits. Negative categories and categories past the set are not in it.
+ */
+template <typename T>
+inline bool split_goes_left(const T x, const T threshold, const int *cat_offsets, const unsigned *cat_bitsets,
+                            const unsigned pos) {
+    if (cat_offsets == NULL || cat_offsets[pos] < 0) return x <= threshold;
+    const unsigned *bitset = cat_bitsets + cat_offsets[pos];
+    if (!(x >= 0 && x < (T)32 * bitset[0])) return false;
+    const unsigned category = (unsigned)x;
+    return (bitset[1 + category / 32] >> (category % 32)) & 1u;
+}
+
+template <typename T>
+struct TreeEnsembleT {
     int *children_left;
     int *children_right;
     int *children_default;
     int *features;
-    tfloat *thresholds;
-    tfloat *values;
-    tfloat *node_sample_weights;
+    T *thresholds;
+    T *values;
+    T *node_sample_weights;
     unsigned max_depth;
     unsigned tree_limit;
-    tfloat *base_offset;
+    T *base_offset;
     unsigned max_nodes;
     unsigned num_outputs;
+    int *cat_offsets = NULL; // optional, see split_goes_left
+    unsigned *cat_bitsets = NULL;
 
-    TreeEnsemble() {}
-    TreeEnsemble(int *children_left, int *children_right, int *children_default, int *features,
-                 tfloat *thresholds, tfloat *values, tfloat *node_sample_weights,
-                 unsigned max_depth, unsigned tree_limit, tfloat *base_offset,
+    TreeEnsembleT() {}
+    TreeEnsembleT(int *children_left, int *children_right, int *children_default, int *features,
+                 T *thresholds, T *values, T *node_sample_weights,
+                 unsigned max_depth, unsigned tree_limit, T *base_offset,
                  unsigned max_nodes, unsigned num_outputs) :
         children_left(children_left), children_right(children_right),
         children_default(children_default), features(features), thresholds(thresholds),
@@ -54,7 +76,7 @@ struct TreeEnsemble {
         max_depth(max_depth), tree_limit(tree_limit),
         base_offset(base_offset), max_nodes(max_nodes), num_outputs(num_outputs) {}
 
-    void get_tree(TreeEnsemble &tree, const unsigned i) const {
+    void get_tree(TreeEnsembleT &tree, const unsigned i) const {
         const unsigned d = i * max_nodes;
 
         tree.children_left = children_left + d;
@@ -69,12 +91,18 @@ struct TreeEnsemble {
         tree.base_offset = base_offset;
         tree.max_nodes = max_nodes;
         tree.num_outputs = num_outputs;
+        tree.cat_offsets = cat_offsets == NULL ? NULL : cat_offsets + d;
+        tree.cat_bitsets = cat_bitsets;
     }
 
     bool is_leaf(unsigned pos)const {
         return children_left[pos] < 0;
     }
 
+    bool goes_left(unsigned pos, T x) const {
+        return split_goes_left(x, thresholds[pos], cat_offsets, cat_bitsets, pos);
+    }
+
     void allocate(unsigned tree_limit_in, unsigned max_nodes_in, unsigned num_outputs_in) {
         tree_limit = tree_limit_in;
         max_nodes = max_nodes_in;
@@ -83,9 +111,9 @@ struct TreeEnsemble {
         children_right = new int[tree_limit * max_nodes];
         children_default = new int[tree_limit * max_nodes];
         features = new int[tree_limit * max_nodes];
-        thresholds = new tfloat[tree_limit * max_nodes];
-        values = new tfloat[tree_limit * max_nodes * num_outputs];
-        node_sample_weights = new tfloat[tree_limit * max_nodes];
+        thresholds = new T[tree_limit * max_nodes];
+        values = new T[tree_limit * max_nodes * num_outputs];
+        node_sample_weights = new T[tree_limit * max_nodes];
     }
 
     void free() {
@@ -98,43 +126,131 @@ struct TreeEnsemble {
         delete[] node_sample_weights;
     }
 };
+typedef TreeEnsembleT<tfloat> TreeEnsemble;
 
-struct ExplanationDataset {
-    tfloat *X;
+template <typename T>
+struct ExplanationDatasetT {
+    T *X;
     bool *X_missing;
-    tfloat *y;
-    tfloat *R;
+    T *y;
+    T *R;
     bool *R_missing;
     unsigned num_X;
     unsigned M;
     unsigned num_R;
+    T *R_weights = NULL; // optional weights of the background samples (summing to one), uniform when NULL
+    T *out_predictions = NULL; // optional num_X * num_outputs buffer the SHAP kernels write the (transformed) model output to
 
-    ExplanationDataset() {}
-    ExplanationDataset(tfloat *X, bool *X_missing, tfloat *y, tfloat *R, bool *R_missing, unsigned num_X,
+    ExplanationDatasetT() {}
+    ExplanationDatasetT(T *X, bool *X_missing, T *y, T *R, bool *R_missing, unsigned num_X,
                        unsigned M, unsigned num_R) :
         X(X), X_missing(X_missing), y(y), R(R), R_missing(R_missing), num_X(num_X), M(M), num_R(num_R) {}
 
-    void get_x_instance(ExplanationDataset &instance, const unsigned i) const {
+    void get_x_instance(ExplanationDatasetT &instance, const unsigned i) const {
         instance.M = M;
         instance.X = X + i * M;
         instance.X_missing = X_missing + i * M;
         instance.num_X = 1;
     }
 };
+typedef ExplanationDatasetT<tfloat> ExplanationDataset;
 
 
 // data we keep about our decision path
 // note that pweight is included for convenience and is not tied with the other attributes
 // the pweight of the i'th path element is the permutation weight of paths with i-1 ones in them
-struct PathElement {
+template <typename T>
+struct PathElementT {
     int feature_index;
-    tfloat zero_fraction;
-    tfloat one_fraction;
-    tfloat pweight;
-    PathElement() {}
-    PathElement(int i, tfloat z, tfloat o, tfloat w) :
+    T zero_fraction;
+    T one_fraction;
+    T pweight;
+    PathElementT() {}
+    PathElementT(int i, T z, T o, T w) :
         feature_index(i), zero_fraction(z), one_fraction(o), pweight(w) {}
 };
+typedef PathElementT<tfloat> PathElement;
+
+/**
+ * Splits the range [0, num_items) into contiguous chunks and calls fn(start, end, thread_index)
+ * for each chunk using up to num_threads threads. The first chunk is always run on the calling
+ * thread, so only thread_index == 0 is allowed to touch the Python runtime (e.g. the progress bar).
+ * Every item is processed by exactly one call, so kernels that write to disjoint output slices
+ * give results identical to a serial run.
+ */
+template <typename F>
+inline void parallel_for_chunks(const unsigned num_items, unsigned num_threads, F fn) {
+    if (num_threads > num_items) num_threads = num_items;
+    if (num_threads <= 1) {
+        fn(0u, num_items, 0u);
+        return;
+    }
+
+    const unsigned chunk_size = (num_items + num_threads - 1) / num_threads;
+    std::vector<std::thread> workers;
+    for (unsigned t = 1; t < num_threads; ++t) {
+        const unsigned start = t * chunk_size;
+        if (start >= num_items) break;
+        const unsigned end = std::min(start + chunk_size, num_items);
+        workers.emplace_back(fn, start, end, t);
+    }
+    fn(0u, std::min(chunk_size, num_items), 0u);
+    for (unsigned t = 0; t < workers.size(); ++t) workers[t].join();
+}
+
+/**
+ * A CSR sparse matrix of samples. Entries that are not stored are zero, stored NaNs are missing.
+ */
+template <typename T>
+struct CSRDatasetT {
+    const T *data;
+    const int *indices;
+    const int *indptr;
+    unsigned num_X;
+    unsigned M;
+
+    CSRDatasetT() {}
+    CSRDatasetT(const T *data, const int *indices, const int *indptr, unsigned num_X, unsigned M) :
+        data(data), indices(indices), indptr(indptr), num_X(num_X), M(M) {}
+
+    // expand rows [start, end) into dense row major X and X_missing buffers
+    void densify(const unsigned start, const unsigned end, T *X, bool *X_missing) const {
+        std::fill_n(X, (end - start) * M, 0);
+        std::fill_n(X_missing, (end - start) * M, false);
+        for (unsigned i = start; i < end; ++i) {
+            T *x = X + (i - start) * M;
+            bool *x_missing = X_missing + (i - start) * M;
+            for (int k = indptr[i]; k < indptr[i + 1]; ++k) {
+                x[indices[k]] = data[k];
+                x_missing[indices[k]] = std::isnan(data[k]);
+            }
+        }
+    }
+};
+typedef CSRDatasetT<tfloat> CSRDataset;
+
+/**
+ * Calls fn(start, end, X, X_missing) for blocks of CSR rows expanded into small dense buffers, so
+ * the dense kernels can run on sparse data while only a block of dense rows per thread is in memory.
+ * The blocks are split across up to num_threads threads, so fn should run its kernel single threaded.
+ */
+template <typename T, typename F>
+inline void for_each_dense_block(const CSRDatasetT<T> &csr, const unsigned num_threads, F fn) {
+    const unsigned block_size = 256;
+    const unsigned num_blocks = (csr.num_X + block_size - 1) / block_size;
+    parallel_for_chunks(num_blocks, num_threads, [&](const unsigned start_block, const unsigned end_block, const unsigned) {
+        T *X = new T[block_size * csr.M];
+        bool *X_missing = new bool[block_size * csr.M];
+        for (unsigned b = start_block; b < end_block; ++b) {
+            const unsigned start = b * block_size;
+            const unsigned end = std::min(start + block_size, csr.num_X);
+            csr.densify(start, end, X, X_missing);
+            fn(start, end, X, X_missing);
+        }
+        delete[] X;
+        delete[] X_missing;
+    });
+}
 
 inline tfloat logistic_transform(const tfloat margin, const tfloat y) {
     return 1 / (1 + exp(-margin));
@@ -174,22 +290,24 @@ inline transform_f get_transform(unsigned model_transform) {
     return transform;
 }
 
-inline tfloat *tree_predict(unsigned i, const TreeEnsemble &trees, const tfloat *x, const bool *x_missing) {
+// returns the index (within tree i) of the leaf x lands in
+template <typename T>
+inline unsigned tree_predict_leaf(unsigned i, const TreeEnsembleT<T> &trees, const T *x, const bool *x_missing) {
     const unsigned offset = i * trees.max_nodes;
     unsigned node = 0;
     while (true) {
         const unsigned pos = offset + node;
         const unsigned feature = trees.features[pos];
 
-        // we hit a leaf so return a pointer to the values
+        // we hit a leaf so return its index
         if (trees.is_leaf(pos)) {
-            return trees.values + pos * trees.num_outputs;
+            return node;
         }
 
         // otherwise we are at an internal node and need to recurse
         if (x_missing[feature]) {
             node = trees.children_default[pos];
-        } else if (x[feature] <= trees.thresholds[pos]) {
+        } else if (trees.goes_left(pos, x[feature])) {
             node = trees.children_left[pos];
         } else {
             node = trees.children_right[pos];
@@ -197,9 +315,54 @@ inline tfloat *tree_predict(unsigned i, const TreeEnsemble &trees, const tfloat
     }
 }
 
-inline void dense_tree_predict(tfloat *out, const TreeEnsemble &trees, const ExplanationDataset &data, unsigned model_transform) {
-    tfloat *row_out = out;
-    const tfloat *x = data.X;
+template <typename T>
+inline T *tree_predict(unsigned i, const TreeEnsembleT<T> &trees, const T *x, const bool *x_missing) {
+    return trees.values + (i * trees.max_nodes + tree_predict_leaf(i, trees, x, x_missing)) * trees.num_outputs;
+}
+
+/**
+ * Writes the index of the leaf each sample lands in for each of the first tree_limit trees, out_leaves
+ * is laid out as num_X * tree_limit.
+ */
+template <typename T>
+inline void dense_tree_predict_leaves(int *out_leaves, const TreeEnsembleT<T> &trees, const ExplanationDatasetT<T> &data,
+                                      const unsigned num_threads = 1) {
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        for (unsigned i = start; i < end; ++i) {
+            const T *x = data.X + i * data.M;
+            const bool *x_missing = data.X_missing + i * data.M;
+            for (unsigned j = 0; j < trees.tree_limit; ++j) {
+                out_leaves[i * trees.tree_limit + j] = tree_predict_leaf(j, trees, x, x_missing);
+            }
+        }
+    });
+}
+
+/**
+ * Writes the (transformed) model output for sample i to data.out_predictions, if the caller asked for it.
+ */
+template <typename T>
+inline void predict_instance(const TreeEnsembleT<T> &trees, const ExplanationDatasetT<T> &data, const unsigned i,
+                             transform_f transform) {
+    if (data.out_predictions == NULL) return;
+    T *out = data.out_predictions + i * trees.num_outputs;
+    const T *x = data.X + i * data.M;
+    const bool *x_missing = data.X_missing + i * data.M;
+    for (unsigned k = 0; k < trees.num_outputs; ++k) out[k] = trees.base_offset[k];
+    for (unsigned j = 0; j < trees.tree_limit; ++j) {
+        const T *leaf_value = tree_predict(j, trees, x, x_missing);
+        for (unsigned k = 0; k < trees.num_outputs; ++k) out[k] += leaf_value[k];
+    }
+    if (transform != NULL) {
+        const T y_i = data.y == NULL ? 0 : data.y[i];
+        for (unsigned k = 0; k < trees.num_outputs; ++k) out[k] = transform(out[k], y_i);
+    }
+}
+
+template <typename T>
+inline void dense_tree_predict(T *out, const TreeEnsembleT<T> &trees, const ExplanationDatasetT<T> &data, unsigned model_transform) {
+    T *row_out = out;
+    const T *x = data.X;
     const bool *x_missing = data.X_missing;
 
     // see what transform (if any) we have
@@ -214,7 +377,7 @@ inline void dense_tree_predict(tfloat *out, const TreeEnsemble &trees, const Exp
 
         // add the leaf values from each tree
         for (unsigned j = 0; j < trees.tree_limit; ++j) {
-            const tfloat *leaf_value = tree_predict(j, trees, x, x_missing);
+            const T *leaf_value = tree_predict(j, trees, x, x_missing);
 
             for (unsigned k = 0; k < trees.num_outputs; ++k) {
                 row_out[k] += leaf_value[k];
@@ -223,7 +386,7 @@ inline void dense_tree_predict(tfloat *out, const TreeEnsemble &trees, const Exp
 
         // apply any needed transform
         if (transform != NULL) {
-            const tfloat y_i = data.y == NULL ? 0 : data.y[i];
+            const T y_i = data.y == NULL ? 0 : data.y[i];
             for (unsigned k = 0; k < trees.num_outputs; ++k) {
                 row_out[k] = transform(row_out[k], y_i);
             }
@@ -235,7 +398,8 @@ inline void dense_tree_predict(tfloat *out, const TreeEnsemble &trees, const Exp
     }
 }
 
-inline void tree_update_weights(unsigned i, TreeEnsemble &trees, const tfloat *x, const bool *x_missing) {
+inline void tree_update_weights(unsigned i, TreeEnsemble &trees, const tfloat *x, const bool *x_missing,
+                                const tfloat weight = 1.0) {
     const unsigned offset = i * trees.max_nodes;
     unsigned node = 0;
     while (true) {
@@ -243,7 +407,7 @@ inline void tree_update_weights(unsigned i, TreeEnsemble &trees, const tfloat *x
         const unsigned feature = trees.features[pos];
 
         // Record that a sample passed through this node
-        trees.node_sample_weights[pos] += 1.0;
+        trees.node_sample_weights[pos] += weight;
 
         // we hit a leaf so return a pointer to the values
         if (trees.children_left[pos] < 0) break;
@@ -251,7 +415,7 @@ inline void tree_update_weights(unsigned i, TreeEnsemble &trees, const tfloat *x
         // otherwise we are at an internal node and need to recurse
         if (x_missing[feature]) {
             node = trees.children_default[pos];
-        } else if (x[feature] <= trees.thresholds[pos]) {
+        } else if (trees.goes_left(pos, x[feature])) {
             node = trees.children_left[pos];
         } else {
             node = trees.children_right[pos];
@@ -259,15 +423,16 @@ inline void tree_update_weights(unsigned i, TreeEnsemble &trees, const tfloat *x
     }
 }
 
-inline void dense_tree_update_weights(TreeEnsemble &trees, const ExplanationDataset &data) {
+inline void dense_tree_update_weights(TreeEnsemble &trees, const ExplanationDataset &data,
+                                      const tfloat *weights = NULL) {
     const tfloat *x = data.X;
     const bool *x_missing = data.X_missing;
 
     for (unsigned i = 0; i < data.num_X; ++i) {
 
-        // add the leaf values from each tree
+        // add the (optionally weighted) sample to the nodes it passes through in each tree
         for (unsigned j = 0; j < trees.tree_limit; ++j) {
-            tree_update_weights(j, trees, x, x_missing);
+            tree_update_weights(j, trees, x, x_missing, weights == NULL ? 1.0 : weights[i]);
         }
 
         x += data.M;
@@ -275,27 +440,36 @@ inline void dense_tree_update_weights(TreeEnsemble &trees, const ExplanationData
     }
 }
 
-inline void tree_saabas(tfloat *out, const TreeEnsemble &tree, const ExplanationDataset &data) {
+// returns the leaf the sample lands in, only the splits at start_depth or below are credited (and if
+// out_error_estimate is given, the absolute credits times the fraction of the training data that does not
+// reach the split are added up in it for each output, see dense_tree_shap_truncated)
+template <typename T>
+inline unsigned tree_saabas(T *out, const TreeEnsembleT<T> &tree, const ExplanationDatasetT<T> &data,
+                            const unsigned start_depth = 0, T *out_error_estimate = NULL) {
+    const T root_weight = out_error_estimate == NULL ? 0 : tree.node_sample_weights[0];
     unsigned curr_node = 0;
     unsigned next_node = 0;
-    while (true) {
+    for (unsigned depth = 0; true; ++depth) {
 
         // we hit a leaf and are done
-        if (tree.children_left[curr_node] < 0) return;
+        if (tree.children_left[curr_node] < 0) return curr_node;
 
         // otherwise we are at an internal node and need to recurse
         const unsigned feature = tree.features[curr_node];
         if (data.X_missing[feature]) {
             next_node = tree.children_default[curr_node];
-        } else if (data.X[feature] <= tree.thresholds[curr_node]) {
+        } else if (tree.goes_left(curr_node, data.X[feature])) {
             next_node = tree.children_left[curr_node];
         } else {
             next_node = tree.children_right[curr_node];
         }
 
         // assign credit to this feature as the difference in values at the current node vs. the next node
-        for (unsigned i = 0; i < tree.num_outputs; ++i) {
-            out[feature * tree.num_outputs + i] += tree.values[next_node * tree.num_outputs + i] - tree.values[curr_node * tree.num_outputs + i];
+        const T outside_fraction = root_weight <= 0 ? 0 : 1 - tree.node_sample_weights[curr_node] / root_weight;
+        for (unsigned i = 0; depth >= start_depth && i < tree.num_outputs; ++i) {
+            const T credit = tree.values[next_node * tree.num_outputs + i] - tree.values[curr_node * tree.num_outputs + i];
+            out[feature * tree.num_outputs + i] += credit;
+            if (out_error_estimate != NULL) out_error_estimate[i] += std::abs(credit) * outside_fraction;
         }
 
         curr_node = next_node;
@@ -305,62 +479,80 @@ inline void tree_saabas(tfloat *out, const TreeEnsemble &tree, const Explanation
 /**
  * This runs Tree SHAP with a per tree path conditional dependence assumption.
  */
-inline void dense_tree_saabas(tfloat *out_contribs, const TreeEnsemble& trees, const ExplanationDataset &data) {
-    tfloat *instance_out_contribs;
-    TreeEnsemble tree;
-    ExplanationDataset instance;
+template <typename T>
+inline void dense_tree_saabas(T *out_contribs, const TreeEnsembleT<T>& trees, const ExplanationDatasetT<T> &data,
+                              const unsigned num_threads = 1, transform_f transform = NULL) {
 
-    // build explanation for each sample
-    for (unsigned i = 0; i < data.num_X; ++i) {
-        instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
-        data.get_x_instance(instance, i);
+    // build explanation for each sample (each sample only writes to its own slice of out_contribs)
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        T *instance_out_contribs;
+        TreeEnsembleT<T> tree;
+        ExplanationDatasetT<T> instance;
 
-        // aggregate the effect of explaining each tree
-        // (this works because of the linearity property of Shapley values)
-        for (unsigned j = 0; j < trees.tree_limit; ++j) {
-            trees.get_tree(tree, j);
-            tree_saabas(instance_out_contribs, tree, instance);
-        }
+        for (unsigned i = start; i < end; ++i) {
+            instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
+            data.get_x_instance(instance, i);
+
+            // aggregate the effect of explaining each tree
+            // (this works because of the linearity property of Shapley values)
+            T *prediction = data.out_predictions == NULL ? NULL : data.out_predictions + i * trees.num_outputs;
+            if (prediction != NULL) std::copy(trees.base_offset, trees.base_offset + trees.num_outputs, prediction);
+            for (unsigned j = 0; j < trees.tree_limit; ++j) {
+                trees.get_tree(tree, j);
+                const unsigned leaf = tree_saabas(instance_out_contribs, tree, instance);
+
+                // the walk ends in the leaf the sample lands in, so the prediction comes for free
+                if (prediction != NULL) {
+                    for (unsigned k = 0; k < trees.num_outputs; ++k) prediction[k] += tree.values[leaf * trees.num_outputs + k];
+                }
+            }
 
-        // apply the base offset to the bias term
-        for (unsigned j = 0; j < trees.num_outputs; ++j) {
-            instance_out_contribs[data.M * trees.num_outputs + j] += trees.base_offset[j];
+            // apply the base offset to the bias term
+            for (unsigned j = 0; j < trees.num_outputs; ++j) {
+                instance_out_contribs[data.M * trees.num_outputs + j] += trees.base_offset[j];
+            }
+            if (prediction != NULL && transform != NULL) {
+                const T y_i = data.y == NULL ? 0 : data.y[i];
+                for (unsigned k = 0; k < trees.num_outputs; ++k) prediction[k] = transform(prediction[k], y_i);
+            }
         }
-    }
+    });
 }
 
 
 // extend our decision path with a fraction of one and zero extensions
-inline void extend_path(PathElement *unique_path, unsigned unique_depth,
-                        tfloat zero_fraction, tfloat one_fraction, int feature_index) {
+template <typename T>
+inline void extend_path(PathElementT<T> *unique_path, unsigned unique_depth,
+                        T zero_fraction, T one_fraction, int feature_index) {
     unique_path[unique_depth].feature_index = feature_index;
     unique_path[unique_depth].zero_fraction = zero_fraction;
     unique_path[unique_depth].one_fraction = one_fraction;
     unique_path[unique_depth].pweight = (unique_depth == 0 ? 1.0f : 0.0f);
     for (int i = unique_depth - 1; i >= 0; i--) {
         unique_path[i + 1].pweight += one_fraction * unique_path[i].pweight * (i + 1)
-                                      / static_cast<tfloat>(unique_depth + 1);
+                                      / static_cast<T>(unique_depth + 1);
         unique_path[i].pweight = zero_fraction * unique_path[i].pweight * (unique_depth - i)
-                                 / static_cast<tfloat>(unique_depth + 1);
+                                 / static_cast<T>(unique_depth + 1);
     }
 }
 
 // undo a previous extension of the decision path
-inline void unwind_path(PathElement *unique_path, unsigned unique_depth, unsigned path_index) {
-    const tfloat one_fraction = unique_path[path_index].one_fraction;
-    const tfloat zero_fraction = unique_path[path_index].zero_fraction;
-    tfloat next_one_portion = unique_path[unique_depth].pweight;
+template <typename T>
+inline void unwind_path(PathElementT<T> *unique_path, unsigned unique_depth, unsigned path_index) {
+    const T one_fraction = unique_path[path_index].one_fraction;
+    const T zero_fraction = unique_path[path_index].zero_fraction;
+    T next_one_portion = unique_path[unique_depth].pweight;
 
     for (int i = unique_depth - 1; i >= 0; --i) {
         if (one_fraction != 0) {
-            const tfloat tmp = unique_path[i].pweight;
+            const T tmp = unique_path[i].pweight;
             unique_path[i].pweight = next_one_portion * (unique_depth + 1)
-                                     / static_cast<tfloat>((i + 1) * one_fraction);
+                                     / static_cast<T>((i + 1) * one_fraction);
             next_one_portion = tmp - unique_path[i].pweight * zero_fraction * (unique_depth - i)
-                               / static_cast<tfloat>(unique_depth + 1);
+                               / static_cast<T>(unique_depth + 1);
         } else {
             unique_path[i].pweight = (unique_path[i].pweight * (unique_depth + 1))
-                                     / static_cast<tfloat>(zero_fraction * (unique_depth - i));
+                                     / static_cast<T>(zero_fraction * (unique_depth - i));
         }
     }
 
@@ -373,16 +565,17 @@ inline void unwind_path(PathElement *unique_path, unsigned unique_depth, unsigne
 
 // determine what the total permutation weight would be if
 // we unwound a previous extension in the decision path
-inline tfloat unwound_path_sum(const PathElement *unique_path, unsigned unique_depth,
+template <typename T>
+inline T unwound_path_sum(const PathElementT<T> *unique_path, unsigned unique_depth,
                                unsigned path_index) {
-    const tfloat one_fraction = unique_path[path_index].one_fraction;
-    const tfloat zero_fraction = unique_path[path_index].zero_fraction;
-    tfloat next_one_portion = unique_path[unique_depth].pweight;
-    tfloat total = 0;
+    const T one_fraction = unique_path[path_index].one_fraction;
+    const T zero_fraction = unique_path[path_index].zero_fraction;
+    T next_one_portion = unique_path[unique_depth].pweight;
+    T total = 0;
 
     if (one_fraction != 0) {
         for (int i = unique_depth - 1; i >= 0; --i) {
-            const tfloat tmp = next_one_portion / static_cast<tfloat>((i + 1) * one_fraction);
+            const T tmp = next_one_portion / static_cast<T>((i + 1) * one_fraction);
             total += tmp;
             next_one_portion = unique_path[i].pweight - tmp * zero_fraction * (unique_depth - i);
         }
@@ -395,23 +588,26 @@ inline tfloat unwound_path_sum(const PathElement *unique_path, unsigned unique_d
 }
 
 // recursive computation of SHAP values for a decision tree
+template <typename T>
 inline void tree_shap_recursive(const unsigned num_outputs, const int *children_left,
                                 const int *children_right,
                                 const int *children_default, const int *features,
-                                const tfloat *thresholds, const tfloat *values,
-                                const tfloat *node_sample_weight,
-                                const tfloat *x, const bool *x_missing, tfloat *phi,
+                                const T *thresholds, const T *values,
+                                const T *node_sample_weight,
+                                const T *x, const bool *x_missing, T *phi,
                                 unsigned node_index, unsigned unique_depth,
-                                PathElement *parent_unique_path, tfloat parent_zero_fraction,
-                                tfloat parent_one_fraction, int parent_feature_index,
+                                PathElementT<T> *parent_unique_path, T parent_zero_fraction,
+                                T parent_one_fraction, int parent_feature_index,
                                 int condition, unsigned condition_feature,
-                                tfloat condition_fraction) {
+                                T condition_fraction, unsigned node_depth = 0,
+                                unsigned exact_depth = std::numeric_limits<unsigned>::max(),
+                                const int *cat_offsets = NULL, const unsigned *cat_bitsets = NULL) {
 
     // stop if we have no weight coming down to us
     if (condition_fraction == 0) return;
 
     // extend the unique path
-    PathElement *unique_path = parent_unique_path + unique_depth + 1;
+    PathElementT<T> *unique_path = parent_unique_path + unique_depth + 1;
     std::copy(parent_unique_path, parent_unique_path + unique_depth + 1, unique_path);
 
     if (condition == 0 || condition_feature != static_cast<unsigned>(parent_feature_index)) {
@@ -420,14 +616,14 @@ inline void tree_shap_recursive(const unsigned num_outputs, const int *children_
     }
     const unsigned split_index = features[node_index];
 
-    // leaf node
-    if (children_right[node_index] < 0) {
+    // leaf node (or the last level explained exactly, which then acts as a leaf with the expected value below it)
+    if (children_right[node_index] < 0 || node_depth >= exact_depth) {
         for (unsigned i = 1; i <= unique_depth; ++i) {
-            const tfloat w = unwound_path_sum(unique_path, unique_depth, i);
-            const PathElement &el = unique_path[i];
+            const T w = unwound_path_sum(unique_path, unique_depth, i);
+            const PathElementT<T> &el = unique_path[i];
             const unsigned phi_offset = el.feature_index * num_outputs;
             const unsigned values_offset = node_index * num_outputs;
-            const tfloat scale = w * (el.one_fraction - el.zero_fraction) * condition_fraction;
+            const T scale = w * (el.one_fraction - el.zero_fraction) * condition_fraction;
             for (unsigned j = 0; j < num_outputs; ++j) {
                 phi[phi_offset + j] += scale * values[values_offset + j];
             }
@@ -439,18 +635,18 @@ inline void tree_shap_recursive(const unsigned num_outputs, const int *children_
         unsigned hot_index = 0;
         if (x_missing[split_index]) {
             hot_index = children_default[node_index];
-        } else if (x[split_index] <= thresholds[node_index]) {
+        } else if (split_goes_left(x[split_index], thresholds[node_index], cat_offsets, cat_bitsets, node_index)) {
             hot_index = children_left[node_index];
         } else {
             hot_index = children_right[node_index];
         }
         const unsigned cold_index = (static_cast<int>(hot_index) == children_left[node_index] ?
                                         children_right[node_index] : children_left[node_index]);
-        const tfloat w = node_sample_weight[node_index];
-        const tfloat hot_zero_fraction = node_sample_weight[hot_index] / w;
-        const tfloat cold_zero_fraction = node_sample_weight[cold_index] / w;
-        tfloat incoming_zero_fraction = 1;
-        tfloat incoming_one_fraction = 1;
+        const T w = node_sample_weight[node_index];
+        const T hot_zero_fraction = node_sample_weight[hot_index] / w;
+        const T cold_zero_fraction = node_sample_weight[cold_index] / w;
+        T incoming_zero_fraction = 1;
+        T incoming_one_fraction = 1;
 
         // see if we have already split on this feature,
         // if so we undo that split so we can redo it for this node
@@ -466,8 +662,8 @@ inline void tree_shap_recursive(const unsigned num_outputs, const int *children_
         }
 
         // divide up the condition_fraction among the recursive calls
-        tfloat hot_condition_fraction = condition_fraction;
-        tfloat cold_condition_fraction = condition_fraction;
+        T hot_condition_fraction = condition_fraction;
+        T cold_condition_fraction = condition_fraction;
         if (condition > 0 && split_index == condition_feature) {
             cold_condition_fraction = 0;
             unique_depth -= 1;
@@ -477,18 +673,20 @@ inline void tree_shap_recursive(const unsigned num_outputs, const int *children_
             unique_depth -= 1;
         }
 
-        tree_shap_recursive(
+        tree_shap_recursive<T>(
             num_outputs, children_left, children_right, children_default, features, thresholds, values,
             node_sample_weight, x, x_missing, phi, hot_index, unique_depth + 1, unique_path,
             hot_zero_fraction * incoming_zero_fraction, incoming_one_fraction,
-            split_index, condition, condition_feature, hot_condition_fraction
+            split_index, condition, condition_feature, hot_condition_fraction, node_depth + 1, exact_depth,
+            cat_offsets, cat_bitsets
         );
 
-        tree_shap_recursive(
+        tree_shap_recursive<T>(
             num_outputs, children_left, children_right, children_default, features, thresholds, values,
             node_sample_weight, x, x_missing, phi, cold_index, unique_depth + 1, unique_path,
             cold_zero_fraction * incoming_zero_fraction, 0,
-            split_index, condition, condition_feature, cold_condition_fraction
+            split_index, condition, condition_feature, cold_condition_fraction, node_depth + 1, exact_depth,
+            cat_offsets, cat_bitsets
         );
     }
 }
@@ -522,8 +720,10 @@ inline int compute_expectations(TreeEnsemble &tree, int i = 0, int depth = 0) {
     return max_depth;
 }
 
-inline void tree_shap(const TreeEnsemble& tree, const ExplanationDataset &data,
-                      tfloat *out_contribs, int condition, unsigned condition_feature) {
+template <typename T>
+inline void tree_shap(const TreeEnsembleT<T>& tree, const ExplanationDatasetT<T> &data,
+                      T *out_contribs, int condition, unsigned condition_feature,
+                      const unsigned exact_depth = std::numeric_limits<unsigned>::max()) {
 
     // update the reference value with the expected value of the tree's predictions
     if (condition == 0) {
@@ -534,13 +734,13 @@ inline void tree_shap(const TreeEnsemble& tree, const ExplanationDataset &data,
 
     // Pre-allocate space for the unique path data
     const unsigned maxd = tree.max_depth + 2; // need a bit more space than the max depth
-    PathElement *unique_path_data = new PathElement[(maxd * (maxd + 1)) / 2];
+    PathElementT<T> *unique_path_data = new PathElementT<T>[(maxd * (maxd + 1)) / 2];
 
-    tree_shap_recursive(
+    tree_shap_recursive<T>(
         tree.num_outputs, tree.children_left, tree.children_right, tree.children_default,
         tree.features, tree.thresholds, tree.values, tree.node_sample_weights, data.X,
         data.X_missing, out_contribs, 0, 0, unique_path_data, 1, 1, -1, condition,
-        condition_feature, 1
+        condition_feature, 1, 0, exact_depth, tree.cat_offsets, tree.cat_bitsets
     );
 
     delete[] unique_path_data;
@@ -711,13 +911,24 @@ inline void build_merged_tree(TreeEnsemble &out_tree, const ExplanationDataset &
 struct Node {
     short cl, cr, cd, pnode, feat, pfeat; // uint_16
     float thres, value;
+    int cat_offset; // -1 for numerical splits, see split_goes_left
     char from_flag;
 };
 
+// whether a (non missing) value x goes to the left child of the node
+inline bool node_goes_left(const Node &node, const tfloat x, const unsigned *cat_bitsets) {
+    return split_goes_left<tfloat>(x, node.thres, &node.cat_offset, cat_bitsets, 0);
+}
+
 #define FROM_NEITHER 0
 #define FROM_X_NOT_R 1
 #define FROM_R_NOT_X 2
 
+// the precomputed direction a background sample takes at a node
+#define R_GOES_LEFT 0
+#define R_GOES_RIGHT 1
+#define R_GOES_DEFAULT 2
+
 // https://www.geeksforgeeks.org/space-and-time-efficient-binomial-coefficient/
 inline int bin_coeff(int n, int k) {
     int res = 1;
@@ -731,12 +942,15 @@ inline int bin_coeff(int n, int k) {
 }
 
 // note this only handles single output models, so multi-output models get explained using multiple passes
+// (when r_directions is given it holds the precomputed R_GOES_* direction of r at every node of the tree,
+// and cat_bitsets holds the category sets of the categorical splits)
 inline void tree_shap_indep(const unsigned max_depth, const unsigned num_feats,
                             const unsigned num_nodes, const tfloat *x,
                             const bool *x_missing, const tfloat *r,
                             const bool *r_missing, tfloat *out_contribs,
                             float *pos_lst, float *neg_lst, signed short *feat_hist,
-                            float *memoized_weights, int *node_stack, Node *mytree) {
+                            const float *memoized_weights, int *node_stack, Node *mytree,
+                            const unsigned char *r_directions = NULL, const unsigned *cat_bitsets = NULL) {
 
 //     const bool DEBUG = true;
 //     ofstream myfile;
@@ -749,13 +963,12 @@ inline void tree_shap_indep(const unsigned max_depth, const unsigned num_feats,
     short node = 0, feat, cl, cr, cd, pnode, pfeat = -1;
     short next_xnode = -1, next_rnode = -1;
     short next_node = -1, from_child = -1;
-    float thres, pos_x = 0, neg_x = 0, pos_r = 0, neg_r = 0;
+    float pos_x = 0, neg_x = 0, pos_r = 0, neg_r = 0;
     char from_flag;
     unsigned M = 0, N = 0;
 
     Node curr_node = mytree[node];
     feat = curr_node.feat;
-    thres = curr_node.thres;
     cl = curr_node.cl;
     cr = curr_node.cr;
     cd = curr_node.cd;
@@ -769,22 +982,24 @@ inline void tree_shap_indep(const unsigned max_depth, const unsigned num_feats,
 //     if (DEBUG) {
 //       myfile << "\nNode: " << node << "\n";
 //       myfile << "x[feat]: " << x[feat] << ", r[feat]: " << r[feat] << "\n";
-//       myfile << "thres: " << thres << "\n";
+//       myfile << "thres: " << curr_node.thres << "\n";
 //     }
 
     if (x_missing[feat]) {
         next_xnode = cd;
-    } else if (x[feat] > thres) {
+    } else if (!node_goes_left(curr_node, x[feat], cat_bitsets)) {
         next_xnode = cr;
-    } else if (x[feat] <= thres) {
+    } else {
         next_xnode = cl;
     }
 
-    if (r_missing[feat]) {
+    if (r_directions != NULL) {
+        next_rnode = r_directions[node] == R_GOES_RIGHT ? cr : (r_directions[node] == R_GOES_DEFAULT ? cd : cl);
+    } else if (r_missing[feat]) {
         next_rnode = cd;
-    } else if (r[feat] > thres) {
+    } else if (!node_goes_left(curr_node, r[feat], cat_bitsets)) {
         next_rnode = cr;
-    } else if (r[feat] <= thres) {
+    } else {
         next_rnode = cl;
     }
 
@@ -818,7 +1033,6 @@ inline void tree_shap_indep(const unsigned max_depth, const unsigned num_feats,
         node = next_node;
         curr_node = mytree[node];
         feat = curr_node.feat;
-        thres = curr_node.thres;
         cl = curr_node.cl;
         cr = curr_node.cr;
         cd = curr_node.cd;
@@ -881,8 +1095,7 @@ inline void tree_shap_indep(const unsigned max_depth, const unsigned num_feats,
             continue;
         }
 
-        const bool x_right = x[feat] > thres;
-        const bool r_right = r[feat] > thres;
+        const bool x_right = !node_goes_left(curr_node, x[feat], cat_bitsets);
 
         if (x_missing[feat]) {
             next_xnode = cd;
@@ -892,11 +1105,13 @@ inline void tree_shap_indep(const unsigned max_depth, const unsigned num_feats,
             next_xnode = cl;
         }
 
-        if (r_missing[feat]) {
+        if (r_directions != NULL) {
+            next_rnode = r_directions[node] == R_GOES_RIGHT ? cr : (r_directions[node] == R_GOES_DEFAULT ? cd : cl);
+        } else if (r_missing[feat]) {
             next_rnode = cd;
-        } else if (r_right) {
+        } else if (!node_goes_left(curr_node, r[feat], cat_bitsets)) {
             next_rnode = cr;
-        } else if (!r_right) {
+        } else {
             next_rnode = cl;
         }
 
@@ -1096,6 +1311,10 @@ inline void print_progress_bar(tfloat &last_print, tfloat start_time, unsigned i
         const double total_seconds = elapsed_seconds / fraction;
         last_print = elapsed_seconds;
 
+        // the C extension releases the GIL while the kernels run, so we need to grab it back
+        // before talking to Python
+        PyGILState_STATE gil_state = PyGILState_Ensure();
+
         PySys_WriteStderr(
             "\r%3.0f%%|%.*s%.*s| %d/%d [%02d:%02d<%02d:%02d]       ",
             fraction * 100, int(0.5 + fraction*20), "===================",
@@ -1111,17 +1330,15 @@ inline void print_progress_bar(tfloat &last_print, tfloat start_time, unsigned i
             PyObject *result = PyObject_CallMethod(pyStderr, "flush", NULL);
             Py_XDECREF(result);
         }
+
+        PyGILState_Release(gil_state);
     }
 }
 
 /**
- * Runs Tree SHAP with feature independence assumptions on dense data.
+ * Reformats the trees into the Node layout used by tree_shap_indep, with the values of output oind.
  */
-inline void dense_independent(const TreeEnsemble& trees, const ExplanationDataset &data,
-                       tfloat *out_contribs, tfloat transform(const tfloat, const tfloat)) {
-
-    // reformat the trees for faster access
-    Node *node_trees = new Node[trees.tree_limit * trees.max_nodes];
+inline void build_independent_node_trees(const TreeEnsemble& trees, const unsigned oind, Node *node_trees) {
     for (unsigned i = 0; i < trees.tree_limit; ++i) {
         Node *node_tree = node_trees + i * trees.max_nodes;
         for (unsigned j = 0; j < trees.max_nodes; ++j) {
@@ -1142,154 +1359,848 @@ inline void dense_independent(const TreeEnsemble& trees, const ExplanationDatase
             }
 
             node_tree[j].thres = trees.thresholds[en_ind];
+            node_tree[j].cat_offset = trees.cat_offsets == NULL ? -1 : trees.cat_offsets[en_ind];
             node_tree[j].feat = trees.features[en_ind];
+            node_tree[j].value = trees.values[en_ind * trees.num_outputs + oind];
         }
     }
+}
 
-    // preallocate arrays needed by the algorithm
-    float *pos_lst = new float[trees.max_nodes];
-    float *neg_lst = new float[trees.max_nodes];
-    int *node_stack = new int[(unsigned) trees.max_depth];
-    signed short *feat_hist = new signed short[data.M];
-    tfloat *tmp_out_contribs = new tfloat[(data.M + 1)];
+/**
+ * Precomputes the weight coefficients of tree_shap_indep, (max_depth+1)^2 entries.
+ */
+inline void compute_independent_weights(const unsigned max_depth, float *memoized_weights) {
+    for (unsigned n = 0; n <= max_depth; ++n) {
+        for (unsigned m = 0; m <= max_depth; ++m) {
+            memoized_weights[n + max_depth * m] = 1.0 / (n * bin_coeff(n-1, m));
+        }
+    }
+}
 
-    // precompute all the weight coefficients
-    float *memoized_weights = new float[(trees.max_depth+1) * (trees.max_depth+1)];
-    for (unsigned n = 0; n <= trees.max_depth; ++n) {
-        for (unsigned m = 0; m <= trees.max_depth; ++m) {
-            memoized_weights[n + trees.max_depth * m] = 1.0 / (n * bin_coeff(n-1, m));
+/**
+ * Computes the model's margin output for every background sample, num_R * num_outputs entries.
+ */
+inline void compute_background_margins(const TreeEnsemble& trees, const ExplanationDataset &data, tfloat *r_margins) {
+    for (unsigned j = 0; j < data.num_R; ++j) {
+        const tfloat *r = data.R + j * data.M;
+        const bool *r_missing = data.R_missing + j * data.M;
+        tfloat *margin = r_margins + j * trees.num_outputs;
+        for (unsigned oind = 0; oind < trees.num_outputs; ++oind) {
+            margin[oind] = trees.base_offset[oind];
+        }
+        for (unsigned k = 0; k < trees.tree_limit; ++k) {
+            const tfloat *leaf_value = tree_predict(k, trees, r, r_missing);
+            for (unsigned oind = 0; oind < trees.num_outputs; ++oind) {
+                margin[oind] += leaf_value[oind];
+            }
         }
     }
+}
 
-    // compute the explanations for each sample
-    tfloat *instance_out_contribs;
-    tfloat rescale_factor = 1.0;
-    tfloat margin_x = 0;
-    tfloat margin_r = 0;
-    time_t start_time = time(NULL);
-    tfloat last_print = 0;
-    for (unsigned oind = 0; oind < trees.num_outputs; ++oind) {
-        // set the values in the reformatted tree to the current output index
-        for (unsigned i = 0; i < trees.tree_limit; ++i) {
-            Node *node_tree = node_trees + i * trees.max_nodes;
-            for (unsigned j = 0; j < trees.max_nodes; ++j) {
-                const unsigned en_ind = i * trees.max_nodes + j;
-                node_tree[j].value = trees.values[en_ind * trees.num_outputs + oind];
+/**
+ * Records the R_GOES_* direction every background sample takes at every internal node, the output
+ * is laid out as tree_limit * num_R * max_nodes. The comparisons use the (single precision) Node
+ * thresholds so they match the ones tree_shap_indep would make.
+ */
+inline void compute_background_directions(const TreeEnsemble& trees, const ExplanationDataset &data,
+                                          const Node *node_trees, unsigned char *r_directions,
+                                          const unsigned num_threads = 1) {
+    parallel_for_chunks(trees.tree_limit, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        for (unsigned k = start; k < end; ++k) {
+            const Node *node_tree = node_trees + k * trees.max_nodes;
+            for (unsigned j = 0; j < data.num_R; ++j) {
+                const tfloat *r = data.R + j * data.M;
+                const bool *r_missing = data.R_missing + j * data.M;
+                unsigned char *directions = r_directions + (k * data.num_R + j) * trees.max_nodes;
+                for (unsigned n = 0; n < trees.max_nodes; ++n) {
+                    const short feat = node_tree[n].feat;
+                    if (node_tree[n].cl < 0) {
+                        directions[n] = R_GOES_LEFT;
+                    } else if (r_missing[feat]) {
+                        directions[n] = R_GOES_DEFAULT;
+                    } else if (!node_goes_left(node_tree[n], r[feat], trees.cat_bitsets)) {
+                        directions[n] = R_GOES_RIGHT;
+                    } else {
+                        directions[n] = R_GOES_LEFT;
+                    }
+                }
             }
         }
+    });
+}
 
-        // loop over all the samples
-        for (unsigned i = 0; i < data.num_X; ++i) {
-            const tfloat *x = data.X + i * data.M;
-            const bool *x_missing = data.X_missing + i * data.M;
-            instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
-            const tfloat y_i = data.y == NULL ? 0 : data.y[i];
+/**
+ * Everything about the background dataset that dense_independent can reuse between calls.
+ */
+struct IndependentBackgroundCache {
+    const Node *node_trees; // tree_limit * max_nodes nodes for each output, one output after the other
+    const float *memoized_weights; // (max_depth+1)^2 weights from compute_independent_weights
+    const unsigned char *r_directions; // tree_limit * num_R * max_nodes from compute_background_directions
+    const tfloat *r_margins; // num_R * num_outputs from compute_background_margins
+};
 
-            print_progress_bar(last_print, start_time, oind * data.num_X + i, data.num_X * trees.num_outputs);
+/**
+ * Runs Tree SHAP with feature independence assumptions on dense data.
+ *
+ * When a cache is given it must have been built for the same trees, tree_limit and background data.
+ */
+inline void dense_independent(const TreeEnsemble& trees, const ExplanationDataset &data,
+                       tfloat *out_contribs, tfloat transform(const tfloat, const tfloat),
+                       const unsigned num_threads = 1, const IndependentBackgroundCache *cache = NULL) {
 
-            // compute the model's margin output for x
-            if (transform != NULL) {
-                margin_x = trees.base_offset[oind];
-                for (unsigned k = 0; k < trees.tree_limit; ++k) {
-                    margin_x += tree_predict(k, trees, x, x_missing)[oind];
-                }
-            }
+    // precompute all the weight coefficients
+    float *own_weights = NULL;
+    const float *memoized_weights;
+    if (cache != NULL) {
+        memoized_weights = cache->memoized_weights;
+    } else {
+        own_weights = new float[(trees.max_depth+1) * (trees.max_depth+1)];
+        compute_independent_weights(trees.max_depth, own_weights);
+        memoized_weights = own_weights;
+    }
 
-            for (unsigned j = 0; j < data.num_R; ++j) {
-                const tfloat *r = data.R + j * data.M;
-                const bool *r_missing = data.R_missing + j * data.M;
-                std::fill_n(tmp_out_contribs, (data.M + 1), 0);
+    // the model's margin output for each reference only depends on the reference
+    tfloat *own_margins = NULL;
+    const tfloat *r_margins = NULL;
+    if (transform != NULL) {
+        if (cache != NULL) {
+            r_margins = cache->r_margins;
+        } else {
+            own_margins = new tfloat[data.num_R * trees.num_outputs];
+            compute_background_margins(trees, data, own_margins);
+            r_margins = own_margins;
+        }
+    }
 
-                // compute the model's margin output for r
-                if (transform != NULL) {
-                    margin_r = trees.base_offset[oind];
+    time_t start_time = time(NULL);
+    tfloat last_print = 0;
+
+    // each worker explains its own block of samples (tree_shap_indep writes into the node
+    // array, so every worker needs its own copy of the reformatted trees and scratch space)
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned thread_index) {
+
+        // space for the reformatted trees of one output
+        const unsigned num_tree_nodes = trees.tree_limit * trees.max_nodes;
+        Node *node_trees = new Node[num_tree_nodes];
+
+        // preallocate arrays needed by the algorithm
+        float *pos_lst = new float[trees.max_nodes];
+        float *neg_lst = new float[trees.max_nodes];
+        int *node_stack = new int[(unsigned) trees.max_depth];
+        signed short *feat_hist = new signed short[data.M];
+        tfloat *tmp_out_contribs = new tfloat[(data.M + 1)];
+
+        // compute the explanations for each sample
+        tfloat *instance_out_contribs;
+        tfloat rescale_factor = 1.0;
+        tfloat margin_x = 0;
+        tfloat margin_r = 0;
+        const unsigned num_block = end - start;
+        for (unsigned oind = 0; oind < trees.num_outputs; ++oind) {
+            // reformat the trees for faster access (with the values of the current output index)
+            if (cache != NULL) {
+                std::copy(cache->node_trees + oind * num_tree_nodes, cache->node_trees + (oind + 1) * num_tree_nodes, node_trees);
+            } else build_independent_node_trees(trees, oind, node_trees);
+
+            // loop over all the samples
+            for (unsigned i = start; i < end; ++i) {
+                const tfloat *x = data.X + i * data.M;
+                const bool *x_missing = data.X_missing + i * data.M;
+                instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
+                const tfloat y_i = data.y == NULL ? 0 : data.y[i];
+
+                // only the calling thread may report progress (the blocks are all the same size)
+                if (thread_index == 0) {
+                    print_progress_bar(last_print, start_time, oind * num_block + i - start, num_block * trees.num_outputs);
+                }
+
+                // compute the model's margin output for x
+                if (transform != NULL || data.out_predictions != NULL) {
+                    margin_x = trees.base_offset[oind];
                     for (unsigned k = 0; k < trees.tree_limit; ++k) {
-                        margin_r += tree_predict(k, trees, r, r_missing)[oind];
+                        margin_x += tree_predict(k, trees, x, x_missing)[oind];
+                    }
+                    if (data.out_predictions != NULL) {
+                        data.out_predictions[i * trees.num_outputs + oind] = transform == NULL ? margin_x : (*transform)(margin_x, y_i);
                     }
                 }
 
-                for (unsigned k = 0; k < trees.tree_limit; ++k) {
-                    tree_shap_indep(
-                        trees.max_depth, data.M, trees.max_nodes, x, x_missing, r, r_missing,
-                        tmp_out_contribs, pos_lst, neg_lst, feat_hist, memoized_weights,
-                        node_stack, node_trees + k * trees.max_nodes
-                    );
-                }
+                for (unsigned j = 0; j < data.num_R; ++j) {
+                    const tfloat *r = data.R + j * data.M;
+                    const bool *r_missing = data.R_missing + j * data.M;
+                    const tfloat r_weight = data.R_weights == NULL ? 1 : data.R_weights[j];
+                    std::fill_n(tmp_out_contribs, (data.M + 1), 0);
+
+                    for (unsigned k = 0; k < trees.tree_limit; ++k) {
+                        const unsigned char *r_directions = NULL;
+                        if (cache != NULL) r_directions = cache->r_directions + (k * data.num_R + j) * trees.max_nodes;
+                        tree_shap_indep(
+                            trees.max_depth, data.M, trees.max_nodes, x, x_missing, r, r_missing,
+                            tmp_out_contribs, pos_lst, neg_lst, feat_hist, memoized_weights,
+                            node_stack, node_trees + k * trees.max_nodes, r_directions, trees.cat_bitsets
+                        );
+                    }
 
-                // compute the rescale factor
-                if (transform != NULL) {
-                    if (margin_x == margin_r) {
-                        rescale_factor = 1.0;
+                    // compute the rescale factor
+                    if (transform != NULL) {
+                        margin_r = r_margins[j * trees.num_outputs + oind];
+                        if (margin_x == margin_r) {
+                            rescale_factor = 1.0;
+                        } else {
+                            rescale_factor = (*transform)(margin_x, y_i) - (*transform)(margin_r, y_i);
+                            rescale_factor /= margin_x - margin_r;
+                        }
+                    }
+
+                    // add the effect of the current reference to our running total
+                    // this is where we can do per reference scaling for non-linear transformations
+                    for (unsigned k = 0; k < data.M; ++k) {
+                        instance_out_contribs[k * trees.num_outputs + oind] += tmp_out_contribs[k] * rescale_factor * r_weight;
+                    }
+
+                    // Add the base offset
+                    if (transform != NULL) {
+                        instance_out_contribs[data.M * trees.num_outputs + oind] += (*transform)(trees.base_offset[oind] + tmp_out_contribs[data.M], 0) * r_weight;
                     } else {
-                        rescale_factor = (*transform)(margin_x, y_i) - (*transform)(margin_r, y_i);
-                        rescale_factor /= margin_x - margin_r;
+                        instance_out_contribs[data.M * trees.num_outputs + oind] += (trees.base_offset[oind] + tmp_out_contribs[data.M]) * r_weight;
                     }
                 }
 
-                // add the effect of the current reference to our running total
-                // this is where we can do per reference scaling for non-linear transformations
-                for (unsigned k = 0; k < data.M; ++k) {
-                    instance_out_contribs[k * trees.num_outputs + oind] += tmp_out_contribs[k] * rescale_factor;
+                // average the results over all the references (weighted references are already scaled)
+                if (data.R_weights == NULL) {
+                    for (unsigned j = 0; j < (data.M + 1); ++j) {
+                        instance_out_contribs[j * trees.num_outputs + oind] /= data.num_R;
+                    }
                 }
+            }
+        }
+
+        delete[] tmp_out_contribs;
+        delete[] node_trees;
+        delete[] pos_lst;
+        delete[] neg_lst;
+        delete[] node_stack;
+        delete[] feat_hist;
+    });
 
-                // Add the base offset
-                if (transform != NULL) {
-                    instance_out_contribs[data.M * trees.num_outputs + oind] += (*transform)(trees.base_offset[oind] + tmp_out_contribs[data.M], 0);
-                } else {
-                    instance_out_contribs[data.M * trees.num_outputs + oind] += trees.base_offset[oind] + tmp_out_contribs[data.M];
+    delete[] own_weights;
+    delete[] own_margins;
+}
+
+
+/**
+ * This runs Tree SHAP with a per tree path conditional dependence assumption.
+ *
+ * When num_stages > 0, out_contribs holds num_stages blocks of (num_X, M + 1, num_outputs) values and
+ * block s gets the explanation of the first stages[s] trees (stages must be in increasing order). Each
+ * sample still walks every tree only once, the running sum is just copied out at every stage.
+ */
+template <typename T>
+inline void dense_tree_path_dependent(const TreeEnsembleT<T>& trees, const ExplanationDatasetT<T> &data,
+                               T *out_contribs, tfloat transform(const tfloat, const tfloat),
+                               const unsigned num_threads = 1, const int *stages = NULL,
+                               const unsigned num_stages = 0) {
+    const unsigned row_size = (data.M + 1) * trees.num_outputs;
+    const unsigned num_trees = num_stages > 0 ? std::min(trees.tree_limit, (unsigned)stages[num_stages - 1]) : trees.tree_limit;
+
+    // build explanation for each sample (each sample only writes to its own slice of out_contribs)
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        T *instance_out_contribs;
+        TreeEnsembleT<T> tree;
+        ExplanationDatasetT<T> instance;
+        T *running_contribs = num_stages > 0 ? new T[row_size] : NULL;
+
+        for (unsigned i = start; i < end; ++i) {
+            if (num_stages > 0) {
+                instance_out_contribs = running_contribs;
+                std::fill_n(running_contribs, row_size, 0);
+            } else instance_out_contribs = out_contribs + i * row_size;
+            data.get_x_instance(instance, i);
+
+            // aggregate the effect of explaining each tree
+            // (this works because of the linearity property of Shapley values)
+            unsigned stage = 0;
+            for (unsigned j = 0; j <= num_trees; ++j) {
+
+                // copy the sum over the trees so far into every stage that ends here
+                for (; stage < num_stages && ((unsigned)stages[stage] <= j || j == num_trees); ++stage) {
+                    T *stage_out_contribs = out_contribs + (stage * data.num_X + i) * row_size;
+                    std::copy(running_contribs, running_contribs + row_size, stage_out_contribs);
+                    for (unsigned k = 0; k < trees.num_outputs; ++k) {
+                        stage_out_contribs[data.M * trees.num_outputs + k] += trees.base_offset[k];
+                    }
                 }
+                if (j == num_trees) break;
+
+                trees.get_tree(tree, j);
+                tree_shap(tree, instance, instance_out_contribs, 0, 0);
             }
 
-            // average the results over all the references.
-            for (unsigned j = 0; j < (data.M + 1); ++j) {
-                instance_out_contribs[j * trees.num_outputs + oind] /= data.num_R;
+            // apply the base offset to the bias term
+            if (num_stages == 0) {
+                for (unsigned j = 0; j < trees.num_outputs; ++j) {
+                    instance_out_contribs[data.M * trees.num_outputs + j] += trees.base_offset[j];
+                }
+                predict_instance(trees, data, i, transform);
+            }
+        }
+        delete[] running_contribs;
+    });
+}
+
+/**
+ * Approximate tree path dependent SHAP values: the first exact_depth levels of each tree are explained exactly
+ * (the nodes at exact_depth act as leaves holding the expected value below them), and the rest of the path of
+ * the sample is credited to its features as in Saabas. The values still add up to the model output. With
+ * exact_depth = 0 this is Saabas, and from the depth of the trees on it is exact.
+ *
+ * If out_error_bounds is given it gets an estimate of the L1 distance between the approximate and the exact
+ * SHAP values of each sample and output (num_X * num_outputs). When a split below exact_depth changes the
+ * expected value by delta and a fraction z of the training data reaches the split node, the exact values
+ * roughly credit delta * (1 + z) / 2 to the split feature and share the rest among the features of the
+ * splits above it, so Saabas is off by about |delta| * (1 - z) in L1. The estimate adds this up over the
+ * Saabas credited splits of all the trees. It is not a guarantee, but it shrinks with exact_depth and
+ * follows the actual error of each sample.
+ */
+template <typename T>
+inline void dense_tree_shap_truncated(const TreeEnsembleT<T>& trees, const ExplanationDatasetT<T> &data,
+                                      T *out_contribs, const unsigned exact_depth, T *out_error_bounds,
+                                      transform_f transform, const unsigned num_threads = 1) {
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        TreeEnsembleT<T> tree;
+        ExplanationDatasetT<T> instance;
+        for (unsigned i = start; i < end; ++i) {
+            T *instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
+            T *error_bound = out_error_bounds == NULL ? NULL : out_error_bounds + i * trees.num_outputs;
+            if (error_bound != NULL) std::fill_n(error_bound, trees.num_outputs, 0);
+            data.get_x_instance(instance, i);
+
+            for (unsigned j = 0; j < trees.tree_limit; ++j) {
+                trees.get_tree(tree, j);
+                tree_shap(tree, instance, instance_out_contribs, 0, 0, exact_depth);
+                tree_saabas(instance_out_contribs, tree, instance, exact_depth, error_bound);
             }
 
             // apply the base offset to the bias term
-            // for (unsigned j = 0; j < trees.num_outputs; ++j) {
-            //     instance_out_contribs[data.M * trees.num_outputs + j] += (*transform)(trees.base_offset[j], 0);
-            // }
+            for (unsigned j = 0; j < trees.num_outputs; ++j) {
+                instance_out_contribs[data.M * trees.num_outputs + j] += trees.base_offset[j];
+            }
+            predict_instance(trees, data, i, transform);
         }
+    });
+}
+
+/**
+ * Precomputed leaf path tables for the tree path dependent algorithm (in the spirit of Fast TreeSHAP v2).
+ *
+ * If the path to a leaf splits on the d unique features D (with zero fractions z_j) and a sample
+ * follows the path for the features in U (a subset of D), then the leaf adds
+ *
+ *     v * (o_i - z_i) * R(U \ {i}) * prod_{j in D \ U, j != i} z_j
+ *
+ * to the SHAP value of feature i, where R(A) = sum_{S in A} |S|!(d - |S| - 1)!/d! prod_{j in A \ S} z_j.
+ * R only depends on the model, so we tabulate it once for all 2^d subsets of each leaf. Explaining a
+ * sample then costs O(depth) per leaf instead of the O(depth^2) path extensions of tree_shap_recursive.
+ */
+struct PathTables {
+    int *tree_leaf_offsets; // first leaf of each tree (num_trees + 1 entries)
+    int *leaf_nodes; // the node index of each leaf in its tree (in depth first order)
+    int *leaf_feature_offsets; // first unique path feature of each leaf (num_leaves + 1 entries)
+    int *features; // the unique features on the path of each leaf
+    tfloat *zero_fractions; // the fraction of the training data that follows the path, for each unique feature
+    int *node_positions; // the index of each internal node's feature among the unique features of the paths below it
+    long long *table_offsets; // first R table entry of each leaf (num_leaves + 1 entries)
+    tfloat *tables; // R(A) for every subset A of the unique features of each leaf
+
+    PathTables() {}
+    PathTables(int *tree_leaf_offsets, int *leaf_nodes, int *leaf_feature_offsets, int *features,
+               tfloat *zero_fractions, int *node_positions, long long *table_offsets, tfloat *tables) :
+        tree_leaf_offsets(tree_leaf_offsets), leaf_nodes(leaf_nodes), leaf_feature_offsets(leaf_feature_offsets),
+        features(features), zero_fractions(zero_fractions), node_positions(node_positions),
+        table_offsets(table_offsets), tables(tables) {}
+};
+
+// the growable storage used while building the path tables of an ensemble
+struct PathTablesStorage {
+    std::vector<int> tree_leaf_offsets;
+    std::vector<int> leaf_nodes;
+    std::vector<int> leaf_feature_offsets;
+    std::vector<int> features;
+    std::vector<tfloat> zero_fractions;
+    std::vector<int> node_positions;
+    std::vector<long long> table_offsets;
+    std::vector<tfloat> tables;
+};
+
+// the number of unique features we allow on a path (the subsets of a leaf are indexed by a bit mask)
+const unsigned MAX_PATH_TABLE_FEATURES = 30;
+
+// fills table[A] = R(A) for all subsets A of the d unique features of a leaf,
+// poly holds the coefficients of prod_{j in subset} (z_j + t) for the current and deeper levels
+inline void fill_path_table(const unsigned d, const tfloat *zero_fractions, const tfloat *weights,
+                            tfloat *table, tfloat *poly, const unsigned k, const unsigned subset,
+                            const unsigned size) {
+    if (k == d) {
+        tfloat total = 0;
+        for (unsigned s = 0; s <= size && s < d; ++s) total += weights[s] * poly[s];
+        table[subset] = total;
+        return;
     }
 
-    delete[] tmp_out_contribs;
-    delete[] node_trees;
-    delete[] pos_lst;
-    delete[] neg_lst;
-    delete[] node_stack;
-    delete[] feat_hist;
-    delete[] memoized_weights;
+    // feature k is not in the subset
+    fill_path_table(d, zero_fractions, weights, table, poly, k + 1, subset, size);
+
+    // feature k is in the subset, so multiply the polynomial by (z_k + t)
+    tfloat *next_poly = poly + d + 1;
+    std::fill(next_poly, next_poly + d + 1, 0);
+    for (unsigned s = 0; s <= size; ++s) {
+        next_poly[s] += poly[s] * zero_fractions[k];
+        next_poly[s + 1] += poly[s];
+    }
+    fill_path_table(d, zero_fractions, weights, table, next_poly, k + 1, subset | (1u << k), size + 1);
 }
 
+// the unique features (and their zero fractions) of the current path are kept in path_features and
+// path_zero_fractions, in the order they first appear, so every node below a split sees the same position
+inline void build_path_tables_recursive(const TreeEnsemble &tree, PathTablesStorage &out, int *node_positions,
+                                        std::vector<int> &path_features, std::vector<tfloat> &path_zero_fractions,
+                                        const unsigned node) {
+
+    // leaf node, so record its path
+    if (tree.children_right[node] < 0) {
+        out.leaf_nodes.push_back(node);
+        out.features.insert(out.features.end(), path_features.begin(), path_features.end());
+        out.zero_fractions.insert(out.zero_fractions.end(), path_zero_fractions.begin(), path_zero_fractions.end());
+        out.leaf_feature_offsets.push_back(out.features.size());
+        out.table_offsets.push_back(out.table_offsets.back() + (1ll << path_features.size()));
+        return;
+    }
+
+    // find the feature in the path (or add it)
+    const int feature = tree.features[node];
+    unsigned pos = 0;
+    while (pos < path_features.size() && path_features[pos] != feature) ++pos;
+    const bool new_feature = pos == path_features.size();
+    if (new_feature) {
+        path_features.push_back(feature);
+        path_zero_fractions.push_back(1);
+    }
+    node_positions[node] = pos;
+
+    // follow both children, scaling the zero fraction of the feature by the fraction of data going each way
+    const tfloat incoming_zero_fraction = path_zero_fractions[pos];
+    const int children[2] = {tree.children_left[node], tree.children_right[node]};
+    for (unsigned i = 0; i < 2; ++i) {
+        path_zero_fractions[pos] = incoming_zero_fraction * tree.node_sample_weights[children[i]] / tree.node_sample_weights[node];
+        build_path_tables_recursive(tree, out, node_positions, path_features, path_zero_fractions, children[i]);
+    }
+    path_zero_fractions[pos] = incoming_zero_fraction;
+
+    if (new_feature) {
+        path_features.pop_back();
+        path_zero_fractions.pop_back();
+    }
+}
 
 /**
- * This runs Tree SHAP with a per tree path conditional dependence assumption.
+ * Builds the path tables of all the trees in the ensemble. Returns false (and leaves the tables
+ * incomplete) if a path has too many unique features or the tables would exceed max_table_size entries.
  */
-inline void dense_tree_path_dependent(const TreeEnsemble& trees, const ExplanationDataset &data,
-                               tfloat *out_contribs, tfloat transform(const tfloat, const tfloat)) {
-    tfloat *instance_out_contribs;
+inline bool build_path_tables(const TreeEnsemble &trees, PathTablesStorage &out, const long long max_table_size) {
     TreeEnsemble tree;
-    ExplanationDataset instance;
+    std::vector<int> path_features;
+    std::vector<tfloat> path_zero_fractions;
+
+    // collect the unique path features of every leaf (in depth first order)
+    out.tree_leaf_offsets.assign(1, 0);
+    out.leaf_feature_offsets.assign(1, 0);
+    out.table_offsets.assign(1, 0);
+    out.node_positions.assign(trees.tree_limit * trees.max_nodes, -1);
+    for (unsigned i = 0; i < trees.tree_limit; ++i) {
+        trees.get_tree(tree, i);
+        build_path_tables_recursive(
+            tree, out, out.node_positions.data() + i * trees.max_nodes, path_features, path_zero_fractions, 0
+        );
+        out.tree_leaf_offsets.push_back(out.leaf_nodes.size());
+    }
+    for (unsigned i = 0; i < out.leaf_nodes.size(); ++i) {
+        if (out.leaf_feature_offsets[i + 1] - out.leaf_feature_offsets[i] > static_cast<int>(MAX_PATH_TABLE_FEATURES)) return false;
+    }
+    if (out.table_offsets.back() > max_table_size) return false;
+
+    // tabulate R for every leaf
+    out.tables.resize(out.table_offsets.back());
+    std::vector<tfloat> weights(MAX_PATH_TABLE_FEATURES);
+    std::vector<tfloat> poly((MAX_PATH_TABLE_FEATURES + 1) * (MAX_PATH_TABLE_FEATURES + 1));
+    for (unsigned i = 0; i < out.leaf_nodes.size(); ++i) {
+        const unsigned d = out.leaf_feature_offsets[i + 1] - out.leaf_feature_offsets[i];
+
+        // the Shapley weights s!(d - s - 1)!/d! for d players
+        if (d > 0) weights[0] = 1.0 / d;
+        for (unsigned s = 1; s < d; ++s) weights[s] = weights[s - 1] * s / (d - s);
+
+        std::fill(poly.begin(), poly.begin() + d + 1, 0);
+        poly[0] = 1;
+        fill_path_table(
+            d, out.zero_fractions.data() + out.leaf_feature_offsets[i], weights.data(),
+            out.tables.data() + out.table_offsets[i], poly.data(), 0, 0, 0
+        );
+    }
+    return true;
+}
 
-    // build explanation for each sample
-    for (unsigned i = 0; i < data.num_X; ++i) {
-        instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
-        data.get_x_instance(instance, i);
+/**
+ * This runs Tree SHAP with a per tree path conditional dependence assumption using precomputed path tables.
+ */
+inline void dense_tree_path_tables(const TreeEnsemble& trees, const PathTables &tables,
+                                   const ExplanationDataset &data, tfloat *out_contribs,
+                                   const unsigned num_threads = 1) {
+
+    // samples are explained in blocks so the table of a leaf stays in cache while it is used for the whole block
+    const unsigned block_size = 64;
+
+    // build explanation for each sample (each sample only writes to its own slice of out_contribs)
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        TreeEnsemble tree;
+        tfloat prefix[MAX_PATH_TABLE_FEATURES + 1];
+        tfloat suffix[MAX_PATH_TABLE_FEATURES + 1];
+        std::vector<unsigned> subsets;
+        std::vector<std::pair<int, unsigned> > stack;
+
+        for (unsigned block_start = start; block_start < end; block_start += block_size) {
+            const unsigned block_end = std::min(block_start + block_size, end);
+
+            for (unsigned j = 0; j < trees.tree_limit; ++j) {
+                trees.get_tree(tree, j);
+                const int *node_positions = tables.node_positions + j * trees.max_nodes;
+                const int first_leaf = tables.tree_leaf_offsets[j];
+                const unsigned num_leaves = tables.tree_leaf_offsets[j + 1] - first_leaf;
+                subsets.resize(num_leaves * block_size);
+
+                // walk the tree once per sample to find which unique path features it agrees with at every leaf
+                for (unsigned i = block_start; i < block_end; ++i) {
+                    const tfloat *x = data.X + i * data.M;
+                    const bool *x_missing = data.X_missing + i * data.M;
+                    unsigned *sample_subsets = subsets.data() + (i - block_start) * num_leaves;
+                    unsigned leaf = 0;
+                    stack.assign(1, std::make_pair(0, ~0u));
+                    while (!stack.empty()) {
+                        const int node = stack.back().first;
+                        const unsigned subset = stack.back().second;
+                        stack.pop_back();
+                        if (tree.children_right[node] < 0) {
+                            sample_subsets[leaf++] = subset;
+                            continue;
+                        }
+                        const int split_index = tree.features[node];
+                        int hot_index;
+                        if (x_missing[split_index]) {
+                            hot_index = tree.children_default[node];
+                        } else if (x[split_index] <= tree.thresholds[node]) {
+                            hot_index = tree.children_left[node];
+                        } else {
+                            hot_index = tree.children_right[node];
+                        }
+                        const unsigned cold_subset = subset & ~(1u << node_positions[node]);
+                        const int left = tree.children_left[node];
+                        const int right = tree.children_right[node];
+                        stack.push_back(std::make_pair(right, hot_index == right ? subset : cold_subset));
+                        stack.push_back(std::make_pair(left, hot_index == left ? subset : cold_subset));
+                    }
+                }
 
-        // aggregate the effect of explaining each tree
-        // (this works because of the linearity property of Shapley values)
-        for (unsigned j = 0; j < trees.tree_limit; ++j) {
-            trees.get_tree(tree, j);
-            tree_shap(tree, instance, instance_out_contribs, 0, 0);
+                for (unsigned leaf = 0; leaf < num_leaves; ++leaf) {
+                    const int l = first_leaf + leaf;
+                    const unsigned d = tables.leaf_feature_offsets[l + 1] - tables.leaf_feature_offsets[l];
+                    const int *features = tables.features + tables.leaf_feature_offsets[l];
+                    const tfloat *zero_fractions = tables.zero_fractions + tables.leaf_feature_offsets[l];
+                    const tfloat *table = tables.tables + tables.table_offsets[l];
+                    const tfloat *values = tree.values + tables.leaf_nodes[l] * trees.num_outputs;
+                    const unsigned mask = (1u << d) - 1;
+
+                    for (unsigned i = block_start; i < block_end; ++i) {
+                        tfloat *phi = out_contribs + i * (data.M + 1) * trees.num_outputs;
+                        const unsigned subset = subsets[(i - block_start) * num_leaves + leaf] & mask;
+
+                        // products of the zero fractions of the features the sample does not agree with
+                        prefix[0] = 1;
+                        for (unsigned k = 0; k < d; ++k) {
+                            prefix[k + 1] = prefix[k] * ((subset >> k) & 1 ? 1 : zero_fractions[k]);
+                        }
+                        suffix[d] = 1;
+                        for (unsigned k = d; k > 0; --k) {
+                            suffix[k - 1] = suffix[k] * ((subset >> (k - 1)) & 1 ? 1 : zero_fractions[k - 1]);
+                        }
+
+                        for (unsigned k = 0; k < d; ++k) {
+                            tfloat scale;
+                            if ((subset >> k) & 1) {
+                                scale = (1 - zero_fractions[k]) * table[subset & ~(1u << k)] * prefix[d];
+                            } else {
+                                scale = -zero_fractions[k] * table[subset] * prefix[k] * suffix[k + 1];
+                            }
+                            const unsigned phi_offset = features[k] * trees.num_outputs;
+                            for (unsigned o = 0; o < trees.num_outputs; ++o) {
+                                phi[phi_offset + o] += scale * values[o];
+                            }
+                        }
+                    }
+                }
+
+                // the expected value of the tree goes to the bias term
+                for (unsigned i = block_start; i < block_end; ++i) {
+                    tfloat *phi = out_contribs + i * (data.M + 1) * trees.num_outputs;
+                    for (unsigned k = 0; k < trees.num_outputs; ++k) {
+                        phi[data.M * trees.num_outputs + k] += tree.values[k];
+                    }
+                }
+            }
+
+            // apply the base offset to the bias term
+            for (unsigned i = block_start; i < block_end; ++i) {
+                tfloat *phi = out_contribs + i * (data.M + 1) * trees.num_outputs;
+                for (unsigned j = 0; j < trees.num_outputs; ++j) {
+                    phi[data.M * trees.num_outputs + j] += trees.base_offset[j];
+                }
+            }
         }
+    });
+}
 
-        // apply the base offset to the bias term
-        for (unsigned j = 0; j < trees.num_outputs; ++j) {
-            instance_out_contribs[data.M * trees.num_outputs + j] += trees.base_offset[j];
+/**
+ * The root to leaf paths of an ensemble, in the layout GPUTreeShap uses (see gpu_treeshap.h).
+ *
+ * Each path is a list of unique features. Splits on the same feature are merged, so every path element
+ * holds the range of feature values (lower_bound, upper_bound] that follows the path, whether missing
+ * values follow it, and the fraction of the training data that follows it. Explaining a block of
+ * samples against one path is then a set of short loops over the samples, which compilers vectorize well.
+ */
+struct TreePaths {
+    int *tree_path_offsets; // first path of each tree (num_trees + 1 entries)
+    int *path_leaves; // the leaf node (in its tree) at the end of each path
+    int *path_offsets; // first element of each path (num_paths + 1 entries)
+    int *features;
+    tfloat *lower_bounds;
+    tfloat *upper_bounds;
+    bool *missing_branches;
+    tfloat *zero_fractions;
+
+    TreePaths() {}
+    TreePaths(int *tree_path_offsets, int *path_leaves, int *path_offsets, int *features,
+              tfloat *lower_bounds, tfloat *upper_bounds, bool *missing_branches, tfloat *zero_fractions) :
+        tree_path_offsets(tree_path_offsets), path_leaves(path_leaves), path_offsets(path_offsets),
+        features(features), lower_bounds(lower_bounds), upper_bounds(upper_bounds),
+        missing_branches(missing_branches), zero_fractions(zero_fractions) {}
+};
+
+// the growable storage used while extracting the paths of an ensemble
+struct TreePathsStorage {
+    std::vector<int> tree_path_offsets;
+    std::vector<int> path_leaves;
+    std::vector<int> path_offsets;
+    std::vector<int> features;
+    std::vector<tfloat> lower_bounds;
+    std::vector<tfloat> upper_bounds;
+    std::vector<bool> missing_branches;
+    std::vector<tfloat> zero_fractions;
+};
+
+// a single (not yet merged) split on the way to a leaf
+struct PathSplit {
+    int feature;
+    tfloat lower_bound;
+    tfloat upper_bound;
+    bool missing_branch;
+    tfloat zero_fraction;
+    PathSplit(int feature, tfloat lower_bound, tfloat upper_bound, bool missing_branch, tfloat zero_fraction) :
+        feature(feature), lower_bound(lower_bound), upper_bound(upper_bound),
+        missing_branch(missing_branch), zero_fraction(zero_fraction) {}
+};
+
+inline void extract_paths_recursive(const TreeEnsemble &tree, TreePathsStorage &out,
+                                    std::vector<PathSplit> &splits, const unsigned node) {
+
+    // leaf node, so merge the splits on duplicate features and record the path
+    if (tree.children_right[node] < 0) {
+        const unsigned path_start = out.features.size();
+        for (unsigned i = 0; i < splits.size(); ++i) {
+            const PathSplit &s = splits[i];
+            unsigned pos = path_start;
+            while (pos < out.features.size() && out.features[pos] != s.feature) ++pos;
+            if (pos == out.features.size()) {
+                out.features.push_back(s.feature);
+                out.lower_bounds.push_back(s.lower_bound);
+                out.upper_bounds.push_back(s.upper_bound);
+                out.missing_branches.push_back(s.missing_branch);
+                out.zero_fractions.push_back(s.zero_fraction);
+            } else {
+                out.lower_bounds[pos] = std::max(out.lower_bounds[pos], s.lower_bound);
+                out.upper_bounds[pos] = std::min(out.upper_bounds[pos], s.upper_bound);
+                out.missing_branches[pos] = out.missing_branches[pos] && s.missing_branch;
+                out.zero_fractions[pos] *= s.zero_fraction;
+            }
         }
+        out.path_leaves.push_back(node);
+        out.path_offsets.push_back(out.features.size());
+        return;
+    }
+
+    // values <= threshold go left and the rest go right
+    const tfloat inf = std::numeric_limits<tfloat>::infinity();
+    const int left = tree.children_left[node];
+    const int right = tree.children_right[node];
+    const tfloat w = tree.node_sample_weights[node];
+    splits.push_back(PathSplit(
+        tree.features[node], -inf, tree.thresholds[node], tree.children_default[node] == left,
+        tree.node_sample_weights[left] / w
+    ));
+    extract_paths_recursive(tree, out, splits, left);
+    splits.back() = PathSplit(
+        tree.features[node], tree.thresholds[node], inf, tree.children_default[node] == right,
+        tree.node_sample_weights[right] / w
+    );
+    extract_paths_recursive(tree, out, splits, right);
+    splits.pop_back();
+}
+
+/**
+ * Extracts the root to leaf paths of all the trees in the ensemble.
+ */
+inline void extract_paths(const TreeEnsemble &trees, TreePathsStorage &out) {
+    TreeEnsemble tree;
+    std::vector<PathSplit> splits;
+
+    out.tree_path_offsets.assign(1, 0);
+    out.path_offsets.assign(1, 0);
+    for (unsigned i = 0; i < trees.tree_limit; ++i) {
+        trees.get_tree(tree, i);
+        extract_paths_recursive(tree, out, splits, 0);
+        out.tree_path_offsets.push_back(out.path_leaves.size());
     }
 }
 
+/**
+ * This runs Tree SHAP with a per tree path conditional dependence assumption one path at a time.
+ *
+ * This is the same computation as tree_shap_recursive (extending the unique path with every element
+ * and then unwinding each one), but it is done for a whole block of samples at once, with the samples
+ * in the innermost loops.
+ */
+inline void dense_tree_paths(const TreeEnsemble& trees, const TreePaths &paths,
+                             const ExplanationDataset &data, tfloat *out_contribs,
+                             const unsigned num_threads = 1) {
+    const unsigned block_size = 64;
+
+    // build explanation for each sample (each sample only writes to its own slice of out_contribs)
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        std::vector<tfloat> one_fractions;
+        std::vector<tfloat> pweights;
+        tfloat next_one_portion[block_size];
+        tfloat one_total[block_size];
+        tfloat zero_total[block_size];
+        const unsigned row_size = (data.M + 1) * trees.num_outputs;
+
+        for (unsigned block_start = start; block_start < end; block_start += block_size) {
+            const unsigned n = std::min(block_size, end - block_start);
+            tfloat *block_out_contribs = out_contribs + block_start * row_size;
+
+            for (unsigned j = 0; j < trees.tree_limit; ++j) {
+                const tfloat *tree_values = trees.values + j * trees.max_nodes * trees.num_outputs;
+
+                // the expected value of the tree goes to the bias term
+                for (unsigned r = 0; r < n; ++r) {
+                    for (unsigned k = 0; k < trees.num_outputs; ++k) {
+                        block_out_contribs[r * row_size + data.M * trees.num_outputs + k] += tree_values[k];
+                    }
+                }
+
+                for (int p = paths.tree_path_offsets[j]; p < paths.tree_path_offsets[j + 1]; ++p) {
+                    const unsigned first = paths.path_offsets[p];
+                    const unsigned d = paths.path_offsets[p + 1] - first;
+                    const tfloat *values = tree_values + paths.path_leaves[p] * trees.num_outputs;
+                    if (d == 0) continue;
+                    one_fractions.resize(d * block_size);
+                    pweights.resize((d + 1) * block_size);
+
+                    // does each sample follow the path for each unique feature
+                    for (unsigned k = 0; k < d; ++k) {
+                        const unsigned feature = paths.features[first + k];
+                        const tfloat lower_bound = paths.lower_bounds[first + k];
+                        const tfloat upper_bound = paths.upper_bounds[first + k];
+                        const bool missing_branch = paths.missing_branches[first + k];
+                        tfloat *o = one_fractions.data() + k * block_size;
+                        for (unsigned r = 0; r < n; ++r) {
+                            const unsigned idx = (block_start + r) * data.M + feature;
+                            const tfloat x = data.X[idx];
+                            o[r] = data.X_missing[idx] ? missing_branch : (x > lower_bound && x <= upper_bound);
+                        }
+                    }
+
+                    // extend the path with the bias element and then every unique feature
+                    std::fill(pweights.begin(), pweights.begin() + block_size, 1);
+                    for (unsigned depth = 1; depth <= d; ++depth) {
+                        const tfloat z = paths.zero_fractions[first + depth - 1];
+                        const tfloat *o = one_fractions.data() + (depth - 1) * block_size;
+                        tfloat *pw_depth = pweights.data() + depth * block_size;
+                        std::fill(pw_depth, pw_depth + block_size, 0);
+                        for (int i = depth - 1; i >= 0; --i) {
+                            tfloat *pw = pweights.data() + i * block_size;
+                            tfloat *pw_next = pw + block_size;
+                            const tfloat one_scale = (i + 1) / static_cast<tfloat>(depth + 1);
+                            const tfloat zero_scale = z * (depth - i) / static_cast<tfloat>(depth + 1);
+                            for (unsigned r = 0; r < n; ++r) {
+                                pw_next[r] += o[r] * pw[r] * one_scale;
+                                pw[r] *= zero_scale;
+                            }
+                        }
+                    }
+
+                    // unwind each unique feature to get its SHAP value
+                    for (unsigned k = 0; k < d; ++k) {
+                        const tfloat z = paths.zero_fractions[first + k];
+                        const tfloat *o = one_fractions.data() + k * block_size;
+                        const tfloat *pw_d = pweights.data() + d * block_size;
+                        for (unsigned r = 0; r < n; ++r) {
+                            next_one_portion[r] = pw_d[r];
+                            one_total[r] = 0;
+                            zero_total[r] = 0;
+                        }
+                        for (int i = d - 1; i >= 0; --i) {
+                            const tfloat *pw = pweights.data() + i * block_size;
+                            const tfloat inv_one = 1 / static_cast<tfloat>(i + 1);
+                            const tfloat zero_scale = z * (d - i);
+                            const tfloat inv_zero = 1 / static_cast<tfloat>(d - i);
+                            for (unsigned r = 0; r < n; ++r) {
+                                const tfloat tmp = next_one_portion[r] * inv_one;
+                                one_total[r] += tmp;
+                                next_one_portion[r] = pw[r] - tmp * zero_scale;
+                                zero_total[r] += pw[r] * inv_zero;
+                            }
+                        }
+
+                        const unsigned phi_offset = paths.features[first + k] * trees.num_outputs;
+                        for (unsigned r = 0; r < n; ++r) {
+                            tfloat total = o[r] != 0 ? one_total[r] : (z != 0 ? zero_total[r] / z : 0);
+                            const tfloat scale = total * (d + 1) * (o[r] - z);
+                            tfloat *phi = block_out_contribs + r * row_size + phi_offset;
+                            for (unsigned l = 0; l < trees.num_outputs; ++l) {
+                                phi[l] += scale * values[l];
+                            }
+                        }
+                    }
+                }
+            }
+
+            // apply the base offset to the bias term
+            for (unsigned r = 0; r < n; ++r) {
+                for (unsigned k = 0; k < trees.num_outputs; ++k) {
+                    block_out_contribs[r * row_size + data.M * trees.num_outputs + k] += trees.base_offset[k];
+                }
+            }
+        }
+    });
+}
+
 // phi = np.zeros((self._current_X.shape[1] + 1, self._current_X.shape[1] + 1, self.n_outputs))
 //         phi_diag = np.zeros((self._current_X.shape[1] + 1, self.n_outputs))
 //         for t in range(self.tree_limit):
@@ -1308,84 +2219,97 @@ inline void dense_tree_path_dependent(const TreeEnsemble& trees, const Explanati
 
 inline void dense_tree_interactions_path_dependent(const TreeEnsemble& trees, const ExplanationDataset &data,
                                             tfloat *out_contribs,
-                                            tfloat transform(const tfloat, const tfloat)) {
-
-    // build a list of all the unique features in each tree
-    int amount_of_unique_features = min(data.M, trees.max_nodes);
-    int *unique_features = new int[trees.tree_limit * amount_of_unique_features];
-    std::fill(unique_features, unique_features + trees.tree_limit * amount_of_unique_features, -1);
-    for (unsigned j = 0; j < trees.tree_limit; ++j) {
-        const int *features_row = trees.features + j * trees.max_nodes;
-        int *unique_features_row = unique_features + j * amount_of_unique_features;
-        for (unsigned k = 0; k < trees.max_nodes; ++k) {
-            for (unsigned l = 0; l < amount_of_unique_features; ++l) {
-                if (features_row[k] == unique_features_row[l]) break;
-                if (unique_features_row[l] < 0) {
-                    unique_features_row[l] = features_row[k];
-                    break;
+                                            tfloat transform(const tfloat, const tfloat),
+                                            const unsigned num_threads = 1,
+                                            const int *unique_features = NULL,
+                                            const unsigned unique_features_width = 0) {
+
+    // build a list of all the unique features in each tree (unless the caller cached them, one row
+    // of unique_features_width entries per tree, padded with -1)
+    int *own_unique_features = NULL;
+    unsigned amount_of_unique_features = unique_features_width;
+    if (unique_features == NULL) {
+        amount_of_unique_features = min(data.M, trees.max_nodes);
+        own_unique_features = new int[trees.tree_limit * amount_of_unique_features];
+        std::fill(own_unique_features, own_unique_features + trees.tree_limit * amount_of_unique_features, -1);
+        for (unsigned j = 0; j < trees.tree_limit; ++j) {
+            const int *features_row = trees.features + j * trees.max_nodes;
+            int *unique_features_row = own_unique_features + j * amount_of_unique_features;
+            for (unsigned k = 0; k < trees.max_nodes; ++k) {
+                for (unsigned l = 0; l < amount_of_unique_features; ++l) {
+                    if (features_row[k] == unique_features_row[l]) break;
+                    if (unique_features_row[l] < 0) {
+                        unique_features_row[l] = features_row[k];
+                        break;
+                    }
                 }
             }
         }
+        unique_features = own_unique_features;
     }
 
-    // build an interaction explanation for each sample
-    tfloat *instance_out_contribs;
-    TreeEnsemble tree;
-    ExplanationDataset instance;
+    // build an interaction explanation for each sample, each worker explains its own block of
+    // samples (and so writes to its own rows of out_contribs) with its own scratch space
     const unsigned contrib_row_size = (data.M + 1) * trees.num_outputs;
-    tfloat *diag_contribs = new tfloat[contrib_row_size];
-    tfloat *on_contribs = new tfloat[contrib_row_size];
-    tfloat *off_contribs = new tfloat[contrib_row_size];
-    for (unsigned i = 0; i < data.num_X; ++i) {
-        instance_out_contribs = out_contribs + i * (data.M + 1) * contrib_row_size;
-        data.get_x_instance(instance, i);
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        tfloat *instance_out_contribs;
+        TreeEnsemble tree;
+        ExplanationDataset instance;
+        tfloat *diag_contribs = new tfloat[contrib_row_size];
+        tfloat *on_contribs = new tfloat[contrib_row_size];
+        tfloat *off_contribs = new tfloat[contrib_row_size];
+        for (unsigned i = start; i < end; ++i) {
+            instance_out_contribs = out_contribs + i * (data.M + 1) * contrib_row_size;
+            data.get_x_instance(instance, i);
+
+            // aggregate the effect of explaining each tree
+            // (this works because of the linearity property of Shapley values)
+            std::fill(diag_contribs, diag_contribs + contrib_row_size, 0);
+            for (unsigned j = 0; j < trees.tree_limit; ++j) {
+                trees.get_tree(tree, j);
+                tree_shap(tree, instance, diag_contribs, 0, 0);
+
+                const int *unique_features_row = unique_features + j * amount_of_unique_features;
+                for (unsigned k = 0; k < amount_of_unique_features; ++k) {
+                    const int ind = unique_features_row[k];
+                    if (ind < 0) break; // < 0 means we have seen all the features for this tree
+
+                    // compute the shap value with this feature held on and off
+                    std::fill(on_contribs, on_contribs + contrib_row_size, 0);
+                    std::fill(off_contribs, off_contribs + contrib_row_size, 0);
+                    tree_shap(tree, instance, on_contribs, 1, ind);
+                    tree_shap(tree, instance, off_contribs, -1, ind);
+
+                    // save the difference between on and off as the interaction value
+                    for (unsigned l = 0; l < contrib_row_size; ++l) {
+                        const tfloat val = (on_contribs[l] - off_contribs[l]) / 2;
+                        instance_out_contribs[ind * contrib_row_size + l] += val;
+                        diag_contribs[l] -= val;
+                    }
+                }
+            }
 
-        // aggregate the effect of explaining each tree
-        // (this works because of the linearity property of Shapley values)
-        std::fill(diag_contribs, diag_contribs + contrib_row_size, 0);
-        for (unsigned j = 0; j < trees.tree_limit; ++j) {
-            trees.get_tree(tree, j);
-            tree_shap(tree, instance, diag_contribs, 0, 0);
-
-            const int *unique_features_row = unique_features + j * amount_of_unique_features;
-            for (unsigned k = 0; k < amount_of_unique_features; ++k) {
-                const int ind = unique_features_row[k];
-                if (ind < 0) break; // < 0 means we have seen all the features for this tree
-
-                // compute the shap value with this feature held on and off
-                std::fill(on_contribs, on_contribs + contrib_row_size, 0);
-                std::fill(off_contribs, off_contribs + contrib_row_size, 0);
-                tree_shap(tree, instance, on_contribs, 1, ind);
-                tree_shap(tree, instance, off_contribs, -1, ind);
-
-                // save the difference between on and off as the interaction value
-                for (unsigned l = 0; l < contrib_row_size; ++l) {
-                    const tfloat val = (on_contribs[l] - off_contribs[l]) / 2;
-                    instance_out_contribs[ind * contrib_row_size + l] += val;
-                    diag_contribs[l] -= val;
+            // set the diagonal
+            for (unsigned j = 0; j < data.M + 1; ++j) {
+                const unsigned offset = j * contrib_row_size + j * trees.num_outputs;
+                for (unsigned k = 0; k < trees.num_outputs; ++k) {
+                    instance_out_contribs[offset + k] = diag_contribs[j * trees.num_outputs + k];
                 }
             }
-        }
 
-        // set the diagonal
-        for (unsigned j = 0; j < data.M + 1; ++j) {
-            const unsigned offset = j * contrib_row_size + j * trees.num_outputs;
-            for (unsigned k = 0; k < trees.num_outputs; ++k) {
-                instance_out_contribs[offset + k] = diag_contribs[j * trees.num_outputs + k];
+            // apply the base offset to the bias term
+            const unsigned last_ind = (data.M * (data.M + 1) + data.M) * trees.num_outputs;
+            for (unsigned j = 0; j < trees.num_outputs; ++j) {
+                instance_out_contribs[last_ind + j] += trees.base_offset[j];
             }
         }
 
-        // apply the base offset to the bias term
-        const unsigned last_ind = (data.M * (data.M + 1) + data.M) * trees.num_outputs;
-        for (unsigned j = 0; j < trees.num_outputs; ++j) {
-            instance_out_contribs[last_ind + j] += trees.base_offset[j];
-        }
-    }
+        delete[] diag_contribs;
+        delete[] on_contribs;
+        delete[] off_contribs;
+    });
 
-    delete[] diag_contribs;
-    delete[] on_contribs;
-    delete[] off_contribs;
-    delete[] unique_features;
+    delete[] own_unique_features;
 }
 
 /**
@@ -1396,7 +2320,8 @@ inline void dense_tree_interactions_path_dependent(const TreeEnsemble& trees, co
  * evaluations of the model are consistent with some training data point.
  */
 inline void dense_global_path_dependent(const TreeEnsemble& trees, const ExplanationDataset &data,
-                                 tfloat *out_contribs, tfloat transform(const tfloat, const tfloat)) {
+                                 tfloat *out_contribs, tfloat transform(const tfloat, const tfloat),
+                                 const unsigned num_threads = 1) {
 
     // allocate space for our new merged tree (we save enough room to totally split all samples if need be)
     TreeEnsemble merged_tree;
@@ -1410,20 +2335,22 @@ inline void dense_global_path_dependent(const TreeEnsemble& trees, const Explana
     compute_expectations(merged_tree);
 
     // explain each sample using our new merged tree
-    ExplanationDataset instance;
-    tfloat *instance_out_contribs;
-    for (unsigned i = 0; i < data.num_X; ++i) {
-        instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
-        data.get_x_instance(instance, i);
+    parallel_for_chunks(data.num_X, num_threads, [&](const unsigned start, const unsigned end, const unsigned) {
+        ExplanationDataset instance;
+        tfloat *instance_out_contribs;
+        for (unsigned i = start; i < end; ++i) {
+            instance_out_contribs = out_contribs + i * (data.M + 1) * trees.num_outputs;
+            data.get_x_instance(instance, i);
 
-        // since we now just have a single merged tree we can just use the tree_path_dependent algorithm
-        tree_shap(merged_tree, instance, instance_out_contribs, 0, 0);
+            // since we now just have a single merged tree we can just use the tree_path_dependent algorithm
+            tree_shap(merged_tree, instance, instance_out_contribs, 0, 0);
 
-        // apply the base offset to the bias term
-        for (unsigned j = 0; j < trees.num_outputs; ++j) {
-            instance_out_contribs[data.M * trees.num_outputs + j] += trees.base_offset[j];
+            // apply the base offset to the bias term
+            for (unsigned j = 0; j < trees.num_outputs; ++j) {
+                instance_out_contribs[data.M * trees.num_outputs + j] += trees.base_offset[j];
+            }
         }
-    }
+    });
 
     merged_tree.free();
 }
@@ -1433,7 +2360,8 @@ inline void dense_global_path_dependent(const TreeEnsemble& trees, const Explana
  * The main method for computing Tree SHAP on models using dense data.
  */
 inline void dense_tree_shap(const TreeEnsemble& trees, const ExplanationDataset &data, tfloat *out_contribs,
-                     const int feature_dependence, unsigned model_transform, bool interactions) {
+                     const int feature_dependence, unsigned model_transform, bool interactions,
+                     const unsigned num_threads = 1) {
 
     // see what transform (if any) we have
     transform_f transform = get_transform(model_transform);
@@ -1443,18 +2371,18 @@ inline void dense_tree_shap(const TreeEnsemble& trees, const ExplanationDataset
         case FEATURE_DEPENDENCE::independent:
             if (interactions) {
                 std::cerr << "FEATURE_DEPENDENCE::independent does not support interactions!\n";
-            } else dense_independent(trees, data, out_contribs, transform);
+            } else dense_independent(trees, data, out_contribs, transform, num_threads);
             return;
 
         case FEATURE_DEPENDENCE::tree_path_dependent:
-            if (interactions) dense_tree_interactions_path_dependent(trees, data, out_contribs, transform);
-            else dense_tree_path_dependent(trees, data, out_contribs, transform);
+            if (interactions) dense_tree_interactions_path_dependent(trees, data, out_contribs, transform, num_threads);
+            else dense_tree_path_dependent(trees, data, out_contribs, transform, num_threads);
             return;
 
         case FEATURE_DEPENDENCE::global_path_dependent:
             if (interactions) {
                 std::cerr << "FEATURE_DEPENDENCE::global_path_dependent does not support interactions!\n";
-            } else dense_global_path_dependent(trees, data, out_contribs, transform);
+            } else dense_global_path_dependent(trees, data, out_contribs, transform, num_threads);
             return;
     }
 }
@@ -27,7 +27,7 @@ class ExactExplainer(Explainer):
     and a greedy sorting method for hclustering structured maskers.
     """
 
-    def __init__(self, model, masker, link=links.identity, linearize_link=True, feature_names=None):
+    def __init__(self, model, masker, link=links.identity, linearize_link=True, feature_names=None, output_cache=None):
         """Build an explainers.Exact object for the given model using the given masker object.
 
         Parameters
@@ -57,6 +57,10 @@ class ExactExplainer(Explainer):
             that arise from the non-linear changes in expectation averaging. To retain the additively of the model with
             still respecting the link function we linearize the link function by default.
 
+        output_cache : None or shap.utils.OutputCache
+            A cache of model outputs shared by all the explained samples, so masked inputs that were
+            already evaluated (for example the all background coalition) are not sent to the model again.
+
         """ # TODO link to the link linearization paper when done
         super().__init__(model, masker, link=link, linearize_link=linearize_link, feature_names=feature_names)
 
@@ -67,14 +71,17 @@ class ExactExplainer(Explainer):
             self._partition_delta_indexes = partition_delta_indexes(masker.clustering, self._partition_masks)
 
         self._gray_code_cache = {} # used to avoid regenerating the same gray code patterns
+        self.output_cache = output_cache
 
-    def __call__(self, *args, max_evals=100000, main_effects=False, error_bounds=False, batch_size="auto", interactions=1, silent=False):
+    def __call__(self, *args, max_evals=100000, main_effects=False, error_bounds=False, batch_size="auto", interactions=1, silent=False,
+                 pack_size=None, n_jobs=None, backend="threads"):
         """Explains the output of model(*args), where args represents one or more parallel iterators."""
         # we entirely rely on the general call implementation, we override just to remove **kwargs
         # from the function signature
         return super().__call__(
             *args, max_evals=max_evals, main_effects=main_effects, error_bounds=error_bounds,
-            batch_size=batch_size, interactions=interactions, silent=silent
+            batch_size=batch_size, interactions=interactions, silent=silent, pack_size=pack_size, n_jobs=n_jobs,
+            backend=backend
         )
 
     def _cached_gray_codes(self, n):
@@ -85,7 +92,7 @@ class ExactExplainer(Explainer):
     def explain_row(self, *row_args, max_evals, main_effects, error_bounds, batch_size, outputs, interactions, silent):
         """Explains a single row and returns the tuple (row_values, row_expected_values, row_mask_shapes)."""
         # build a masked version of the model for the current input sample
-        fm = MaskedModel(self.model, self.masker, self.link, self.linearize_link, *row_args)
+        fm = MaskedModel(self.model, self.masker, self.link, self.linearize_link, *row_args, output_cache=self.output_cache)
 
         # do the standard Shapley values
         inds = None
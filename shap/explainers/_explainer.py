@@ -1,10 +1,15 @@
 import copy
+import os
+import queue
+import threading
 import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 import pandas as pd
 import scipy.sparse
+from numba import njit
 
 from .. import explainers, links, maskers, models
 from .._explanation import Explanation
@@ -24,6 +29,9 @@ class Explainer(Serializable):
     the particular estimation algorithm that was chosen.
     """
 
+    # the random number generator explain_row draws from, replaced by a per row one for seeded explainers
+    _random_state = np.random
+
     def __init__(self, model, masker=None, link=links.identity, algorithm="auto", output_names=None, feature_names=None, linearize_link=True,
                  seed=None, **kwargs):
         """Build a new explainer for the passed model.
@@ -182,7 +190,7 @@ class Explainer(Serializable):
                 explainers.PermutationExplainer.__init__(self, self.model, self.masker, link=self.link, feature_names=self.feature_names, linearize_link=linearize_link, seed=seed, **kwargs)
             elif algorithm == "partition":
                 self.__class__ = explainers.PartitionExplainer
-                explainers.PartitionExplainer.__init__(self, self.model, self.masker, link=self.link, feature_names=self.feature_names, linearize_link=linearize_link, output_names=self.output_names, **kwargs)
+                explainers.PartitionExplainer.__init__(self, self.model, self.masker, link=self.link, feature_names=self.feature_names, linearize_link=linearize_link, output_names=self.output_names, seed=seed, **kwargs)
             elif algorithm == "tree":
                 self.__class__ = explainers.TreeExplainer
                 explainers.TreeExplainer.__init__(self, self.model, self.masker, link=self.link, feature_names=self.feature_names, linearize_link=linearize_link, **kwargs)
@@ -200,12 +208,24 @@ class Explainer(Serializable):
 
 
     def __call__(self, *args, max_evals="auto", main_effects=False, error_bounds=False, batch_size="auto",
-                 outputs=None, silent=False, **kwargs):
+                 outputs=None, silent=False, pack_size=None, n_jobs=None, backend="threads", **kwargs):
         """Explains the output of model(*args), where args is a list of parallel iterable datasets.
 
         Note this default version could be an abstract method that is implemented by each algorithm-specific
         subclass of Explainer. Descriptions of each subclasses' __call__ arguments
         are available in their respective doc-strings.
+
+        When ``pack_size`` is given, several rows are explained concurrently (in threads) and the masked
+        inputs their model evaluations need are packed into shared model calls of about ``pack_size``
+        input rows, which helps models with a high per call overhead.
+
+        ``n_jobs`` splits the rows across that many workers (``-1`` means all CPUs), which are
+        threads or processes depending on ``backend`` (``"threads"`` or ``"processes"``). The
+        processes backend needs an explainer that can be sent to the worker processes.
+
+        When the explainer was built with a ``seed``, the random draws of every row are seeded from
+        that seed and the row index, so packed and parallel runs match serial runs exactly. Otherwise
+        they use the global numpy random state and may differ between runs.
         """
         # if max_evals == "auto":
         #     self._brute_force_fallback
@@ -262,11 +282,24 @@ class Explainer(Serializable):
         error_std = []
         if callable(getattr(self.masker, "feature_names", None)):
             feature_names = [[] for _ in range(len(args))]
-        for row_args in show_progress(zip(*args), num_rows, self.__class__.__name__+" explainer", silent):
-            row_result = self.explain_row(
-                *row_args, max_evals=max_evals, main_effects=main_effects, error_bounds=error_bounds,
-                batch_size=batch_size, outputs=outputs, silent=silent, **kwargs
-            )
+        row_kwargs = dict(
+            max_evals=max_evals, main_effects=main_effects, error_bounds=error_bounds, batch_size=batch_size,
+            outputs=outputs, silent=silent, **kwargs
+        )
+        num_workers = _get_num_threads(n_jobs)
+        if backend not in ("threads", "processes"):
+            raise ValueError(f"Unknown backend \"{backend}\", it must be \"threads\" or \"processes\"!")
+        if pack_size is not None and num_workers > 1:
+            raise ValueError("pack_size and n_jobs cannot be combined, packing already explains several rows at once!")
+        if pack_size is not None:
+            row_results = self._threaded_explain_rows(list(zip(*args)), _MAX_PACKED_ROWS, silent, row_kwargs, pack_size)
+        elif num_workers > 1 and backend == "threads":
+            row_results = self._threaded_explain_rows(list(zip(*args)), num_workers, silent, row_kwargs)
+        elif num_workers > 1:
+            row_results = self._process_explain_rows(list(zip(*args)), num_workers, silent, row_kwargs)
+        else:
+            row_results = self._serial_explain_rows(args, num_rows, silent, row_kwargs)
+        for row_args, row_result in row_results:
             values.append(row_result.get("values", None))
             output_indices.append(row_result.get("output_indices", None))
             expected_values.append(row_result.get("expected_values", None))
@@ -362,6 +395,93 @@ class Explainer(Serializable):
             ))
         return out[0] if len(out) == 1 else out
 
+    def _seed_row(self, row_index):
+        """Seed the random draws of a row from the explainer seed and the row index (if we have a seed)."""
+        seed = getattr(self, "seed", None)
+        if seed is not None:
+            row_seed = int(np.random.SeedSequence([seed, row_index]).generate_state(1)[0])
+            self._random_state = np.random.RandomState(row_seed)
+            _seed_numba_random(row_seed)
+
+    def _serial_explain_rows(self, args, num_rows, silent, row_kwargs):
+        """Explain the rows one at a time, yielding (row_args, row_result).
+
+        The random state of the explainer is restored afterwards, so later calls do not depend on the
+        row generators seeded here.
+        """
+        had_random_state = "_random_state" in self.__dict__
+        random_state = self._random_state
+        try:
+            for i, row_args in enumerate(show_progress(zip(*args), num_rows, self.__class__.__name__+" explainer", silent)):
+                self._seed_row(i)
+                yield row_args, self.explain_row(*row_args, **row_kwargs)
+        finally:
+            if had_random_state:
+                self._random_state = random_state
+            else:
+                self.__dict__.pop("_random_state", None)
+
+    def _threaded_explain_rows(self, rows, num_workers, silent, row_kwargs, pack_size=None):
+        """Explain the rows in worker threads, yielding (row_args, row_result) in order.
+
+        With a ``pack_size`` the workers share their model calls through a ``_PackedModel``.
+        """
+        num_workers = min(len(rows), num_workers)
+        model = self.model if pack_size is None else _PackedModel(self.model, pack_size, num_workers)
+        results = [None] * len(rows)
+        finished = queue.Queue()
+        lock = threading.Lock()
+        next_row = [0]
+
+        def worker(explainer):
+            try:
+                while True:
+                    with lock:
+                        if next_row[0] >= len(rows):
+                            return
+                        i = next_row[0]
+                        next_row[0] += 1
+                    try:
+                        explainer._seed_row(i)
+                        results[i] = explainer.explain_row(*rows[i], **row_kwargs)
+                    except BaseException as e:
+                        with lock:
+                            next_row[0] = len(rows)
+                        finished.put(e)
+                        return
+                    finished.put(i)
+            finally:
+                if pack_size is not None:
+                    model.finish_worker()
+
+        # explainers and maskers keep the state of the current row on themselves, so every worker gets its own
+        threads = []
+        for _ in range(num_workers):
+            explainer = copy.copy(self)
+            explainer.masker = copy.deepcopy(self.masker)
+            explainer.model = model
+            threads.append(threading.Thread(target=worker, args=(explainer,), daemon=True))
+        for thread in threads:
+            thread.start()
+        for _ in show_progress(range(len(rows)), len(rows), self.__class__.__name__+" explainer", silent):
+            item = finished.get()
+            if isinstance(item, BaseException):
+                raise item
+        for thread in threads:
+            thread.join()
+        return zip(rows, results)
+
+    def _process_explain_rows(self, rows, num_workers, silent, row_kwargs):
+        """Explain the rows in worker processes, yielding (row_args, row_result) in order."""
+        results = [None] * len(rows)
+        with ProcessPoolExecutor(
+            max_workers=min(len(rows), num_workers), initializer=_init_row_process, initargs=(self, row_kwargs)
+        ) as executor:
+            futures = {executor.submit(_explain_row_in_process, i, row_args): i for i, row_args in enumerate(rows)}
+            for future in show_progress(as_completed(futures), len(rows), self.__class__.__name__+" explainer", silent):
+                results[futures[future]] = future.result()
+        return zip(rows, results)
+
     def explain_row(self, *row_args, max_evals, main_effects, error_bounds, outputs, silent, **kwargs):
         """Explains a single row and returns the tuple (row_values, row_expected_values, row_mask_shapes, main_effects).
 
@@ -442,6 +562,109 @@ class Explainer(Serializable):
             kwargs["link"] = s.load("link")
         return kwargs
 
+
+def _get_num_threads(n_jobs) -> int:
+    """Convert a scikit-learn style ``n_jobs`` value into a number of threads (or processes)."""
+    if n_jobs is None:
+        return 1
+    if n_jobs == 0:
+        raise ValueError("n_jobs == 0 is not a valid number of jobs! Use None, a positive number or -1.")
+    if n_jobs < 0:
+        # like joblib, -1 means all CPUs, -2 all CPUs but one, etc.
+        return max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+    return int(n_jobs)
+
+
+_MAX_PACKED_ROWS = 32 # the most rows explained concurrently when packing model calls
+
+
+@njit
+def _seed_numba_random(seed):
+    # numba keeps its own (per thread) random state, used for example by partition_tree_shuffle
+    np.random.seed(seed)
+
+
+_process_explainer = None
+_process_row_kwargs = None
+
+
+def _init_row_process(explainer, row_kwargs):
+    global _process_explainer, _process_row_kwargs
+    _process_explainer = explainer
+    _process_row_kwargs = row_kwargs
+
+
+def _explain_row_in_process(row_index, row_args):
+    _process_explainer._seed_row(row_index)
+    return _process_explainer.explain_row(*row_args, **_process_row_kwargs)
+
+
+class _PackedModel:
+    """Gathers the model calls of several rows explained in parallel threads into shared model calls.
+
+    Each calling thread waits until either ``pack_size`` input rows are pending or every worker that
+    is still running is waiting on a call, then one of them evaluates the model on all the pending
+    inputs and hands every caller its slice of the outputs.
+    """
+
+    def __init__(self, model, pack_size, num_workers):
+        self.model = model
+        self.pack_size = pack_size
+        self.condition = threading.Condition()
+        self._num_workers = num_workers
+        self._pending = []
+        self._pending_rows = 0
+
+    def __getattr__(self, name):
+        # the explainers read attributes such as output_names from their model
+        return getattr(self.model, name)
+
+    def __call__(self, *args):
+        request = [args, None]
+        with self.condition:
+            self._pending.append(request)
+            self._pending_rows += len(args[0])
+            while request[1] is None:
+                if self._pending_rows >= self.pack_size or len(self._pending) >= self._num_workers:
+                    self._run_pending()
+                else:
+                    self.condition.wait()
+        if isinstance(request[1], BaseException):
+            raise request[1]
+        return request[1]
+
+    def finish_worker(self):
+        """Mark a worker as done, so the others no longer wait for its model calls."""
+        with self.condition:
+            self._num_workers -= 1
+            self.condition.notify_all()
+
+    def _run_pending(self):
+        requests, self._pending, self._pending_rows = self._pending, [], 0
+        try:
+            joined_args = [_concatenate([r[0][i] for r in requests]) for i in range(len(requests[0][0]))]
+            outputs = self.model(*joined_args)
+            pos = 0
+            for r in requests:
+                r[1] = outputs[pos:pos + len(r[0][0])]
+                pos += len(r[0][0])
+        except BaseException as e:
+            for r in requests:
+                r[1] = e
+        self.condition.notify_all()
+
+
+def _concatenate(parts):
+    """Join the model inputs of several calls along their first axis."""
+    if len(parts) == 1:
+        return parts[0]
+    if isinstance(parts[0], pd.DataFrame):
+        return pd.concat(parts)
+    if isinstance(parts[0], np.ndarray):
+        return np.concatenate(parts)
+    return [v for part in parts for v in part]
+
+
 def pack_values(values):
     """Used the clean up arrays before putting them into an Explanation object."""
     if not hasattr(values, "__len__"):
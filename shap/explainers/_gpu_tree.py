@@ -4,7 +4,7 @@ import numpy as np
 from ..utils import assert_import, record_import_error
 from ._tree import (
     TreeExplainer,
-    _xgboost_cat_unsupported,
+    _categorical_splits_unsupported,
     feature_perturbation_codes,
     output_transform_codes,
 )
@@ -26,7 +26,7 @@ class GPUTreeExplainer(TreeExplainer):
     """
 
     def shap_values(self, X, y=None, tree_limit=None, approximate=False, check_additivity=True,
-                    from_call=False):
+                    from_call=False, n_jobs=None):
         """Estimate the SHAP values for a set of samples.
 
         Parameters
@@ -51,6 +51,9 @@ class GPUTreeExplainer(TreeExplainer):
             check takes only a small amount of time, and will catch potential unforeseen errors.
             Note that this check only runs right now when explaining the margin of the model.
 
+        n_jobs : None or int
+            Not used, the GPU kernels handle their own parallelism.
+
         Returns
         -------
         array or list
@@ -69,7 +72,7 @@ class GPUTreeExplainer(TreeExplainer):
             self._validate_inputs(X, y, tree_limit, check_additivity)
 
         model = self.model
-        _xgboost_cat_unsupported(model)
+        _categorical_splits_unsupported(model, "GPUTreeExplainer")
         transform = model.get_transform()
 
         # run the core algorithm using the C extension
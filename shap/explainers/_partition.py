@@ -33,7 +33,7 @@ class PartitionExplainer(Explainer):
     """
 
     def __init__(self, model, masker, *, output_names=None, link=links.identity, linearize_link=True,
-                 feature_names=None, **call_args):
+                 feature_names=None, output_cache=None, seed=None, **call_args):
         """Build a PartitionExplainer for the given model with the given masker.
 
         Parameters
@@ -59,6 +59,15 @@ class PartitionExplainer(Explainer):
             to use that masker's built-in clustering of the features, or if partition_tree is None then
             masker.clustering will be used by default.
 
+        output_cache : None or shap.utils.OutputCache
+            An optional cache of model outputs, keyed by the masked input rows. It is kept across the
+            explained samples, which helps most when the same or near duplicate samples are explained.
+
+        seed : None or int
+            Seed for reproducibility. The random tie-breakers between equally important partitions
+            of every explained row are then drawn from a random state seeded by this seed and the
+            index of the row.
+
         Examples
         --------
         See `Partition explainer examples <https://shap.readthedocs.io/en/latest/api_examples/explainers/PartitionExplainer.html>`_
@@ -84,6 +93,8 @@ class PartitionExplainer(Explainer):
             self.model = Model(self.model)#lambda *args: np.array(model(*args))
         self.expected_value = None
         self._curr_base_value = None
+        self.output_cache = output_cache
+        self.seed = seed
         if getattr(self.masker, "clustering", None) is None:
             raise ValueError("The passed masker must have a .clustering attribute defined! Try shap.maskers.Partition(data) for example.")
         # if partition_tree is None:
@@ -111,10 +122,10 @@ class PartitionExplainer(Explainer):
             class PartitionExplainer(self.__class__):
                 # this signature should match the __call__ signature of the class defined below
                 def __call__(self, *args, max_evals=500, fixed_context=None, main_effects=False, error_bounds=False, batch_size="auto",
-                             outputs=None, silent=False):
+                             outputs=None, silent=False, pack_size=None, n_jobs=None, backend="threads"):
                     return super().__call__(
                         *args, max_evals=max_evals, fixed_context=fixed_context, main_effects=main_effects, error_bounds=error_bounds,
-                        batch_size=batch_size, outputs=outputs, silent=silent
+                        batch_size=batch_size, outputs=outputs, silent=silent, pack_size=pack_size, n_jobs=n_jobs, backend=backend
                     )
             PartitionExplainer.__call__.__doc__ = self.__class__.__call__.__doc__
             self.__class__ = PartitionExplainer
@@ -123,11 +134,11 @@ class PartitionExplainer(Explainer):
 
     # note that changes to this function signature should be copied to the default call argument wrapper above
     def __call__(self, *args, max_evals=500, fixed_context=None, main_effects=False, error_bounds=False, batch_size="auto",
-                 outputs=None, silent=False):
+                 outputs=None, silent=False, pack_size=None, n_jobs=None, backend="threads"):
         """Explain the output of the model on the given arguments."""
         return super().__call__(
             *args, max_evals=max_evals, fixed_context=fixed_context, main_effects=main_effects, error_bounds=error_bounds, batch_size=batch_size,
-            outputs=outputs, silent=silent
+            outputs=outputs, silent=silent, pack_size=pack_size, n_jobs=n_jobs, backend=backend
         )
 
     def explain_row(self, *row_args, max_evals, main_effects, error_bounds, batch_size, outputs, silent, fixed_context = "auto"):
@@ -141,7 +152,7 @@ class PartitionExplainer(Explainer):
             raise ValueError("Unknown fixed_context value passed (must be 0, 1 or None): %s" %fixed_context)
 
         # build a masked version of the model for the current input sample
-        fm = MaskedModel(self.model, self.masker, self.link, self.linearize_link, *row_args)
+        fm = MaskedModel(self.model, self.masker, self.link, self.linearize_link, *row_args, output_cache=self.output_cache)
 
         # make sure we have the base value and current value outputs
         M = len(fm)
@@ -313,20 +324,20 @@ class PartitionExplainer(Explainer):
                 if fixed_context is None or fixed_context == 0:
                     # recurse on the left node with zero context
                     args = (m00, f00, f10, lind, new_weight)
-                    q.put((-np.max(np.abs(f10 - f00)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f10 - f00)) * new_weight, self._random_state.randn(), args))
 
                     # recurse on the right node with zero context
                     args = (m00, f00, f01, rind, new_weight)
-                    q.put((-np.max(np.abs(f01 - f00)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f01 - f00)) * new_weight, self._random_state.randn(), args))
 
                 if fixed_context is None or fixed_context == 1:
                     # recurse on the left node with one context
                     args = (m01, f01, f11, lind, new_weight)
-                    q.put((-np.max(np.abs(f11 - f01)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f11 - f01)) * new_weight, self._random_state.randn(), args))
 
                     # recurse on the right node with one context
                     args = (m10, f10, f11, rind, new_weight)
-                    q.put((-np.max(np.abs(f11 - f10)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f11 - f10)) * new_weight, self._random_state.randn(), args))
 
         if pbar is not None:
             pbar.close()
@@ -461,22 +472,22 @@ class PartitionExplainer(Explainer):
 
                     # recurse on the left node with zero context, flip the context for all descendents if we are ignoring it
                     args = (m00, f00, f10, lind, new_weight, 0 if context == 1 else context)
-                    q.put((-np.max(np.abs(f10 - f00)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f10 - f00)) * new_weight, self._random_state.randn(), args))
 
                     # recurse on the right node with zero context, flip the context for all descendents if we are ignoring it
                     args = (m00, f00, f01, rind, new_weight, 0 if context == 1 else context)
-                    q.put((-np.max(np.abs(f01 - f00)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f01 - f00)) * new_weight, self._random_state.randn(), args))
 
                 if context is None or context == 1 or ignore_context:
                     self.dvalues[ind] -= (f11 - f10 - f01 + f00) * weight # leave the interaction effect on the internal node
 
                     # recurse on the left node with one context, flip the context for all descendents if we are ignoring it
                     args = (m01, f01, f11, lind, new_weight, 1 if context == 0 else context)
-                    q.put((-np.max(np.abs(f11 - f01)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f11 - f01)) * new_weight, self._random_state.randn(), args))
 
                     # recurse on the right node with one context, flip the context for all descendents if we are ignoring it
                     args = (m10, f10, f11, rind, new_weight, 1 if context == 0 else context)
-                    q.put((-np.max(np.abs(f11 - f10)) * new_weight, np.random.randn(), args))
+                    q.put((-np.max(np.abs(f11 - f10)) * new_weight, self._random_state.randn(), args))
 
         if pbar is not None:
             pbar.close()
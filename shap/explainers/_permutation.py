@@ -20,7 +20,8 @@ class PermutationExplainer(Explainer):
     structures with partition trees, something not currently implemented for KernalExplainer or SamplingExplainer.
     """
 
-    def __init__(self, model, masker, link=links.identity, feature_names=None, linearize_link=True, seed=None, **call_args):
+    def __init__(self, model, masker, link=links.identity, feature_names=None, linearize_link=True, seed=None,
+                 output_cache=None, **call_args):
         """Build an explainers.Permutation object for the given model using the given masker object.
 
         Parameters
@@ -37,15 +38,17 @@ class PermutationExplainer(Explainer):
             game structure you can pass a ``shap.maskers.Tabular(data, clustering="correlation")`` object.
 
         seed: None or int
-            Seed for reproducibility
+            Seed for reproducibility. The permutations of every explained row are then drawn from a
+            random state seeded by this seed and the index of the row.
+
+        output_cache : None or shap.utils.OutputCache
+            An optional cache of model outputs. Masked inputs that any permutation of any explained
+            sample already evaluated are then looked up instead of being passed to the model.
 
         **call_args : valid argument to the __call__ method
             These arguments are saved and passed to the __call__ method as the new default values for these arguments.
 
         """
-        # setting seed for random generation: if seed is not None, then shap values computation should be reproducible
-        np.random.seed(seed)
-
         if masker is None:
             raise ValueError("masker cannot be None.")
 
@@ -53,6 +56,8 @@ class PermutationExplainer(Explainer):
 
         if not isinstance(self.model, Model):
             self.model = Model(self.model)
+        self.output_cache = output_cache
+        self.seed = seed
 
         # if we have gotten default arguments for the call function we need to wrap ourselves in a new class that
         # has a call function with those new default arguments
@@ -60,10 +65,11 @@ class PermutationExplainer(Explainer):
             # this signature should match the __call__ signature of the class defined below
             class PermutationExplainer(self.__class__):
                 def __call__(self, *args, max_evals=500, main_effects=False, error_bounds=False, batch_size="auto",
-                             outputs=None, silent=False):
+                             outputs=None, silent=False, pack_size=None, n_jobs=None, backend="threads"):
                     return super().__call__(
                         *args, max_evals=max_evals, main_effects=main_effects, error_bounds=error_bounds,
-                        batch_size=batch_size, outputs=outputs, silent=silent
+                        batch_size=batch_size, outputs=outputs, silent=silent, pack_size=pack_size, n_jobs=n_jobs,
+                        backend=backend
                     )
             PermutationExplainer.__call__.__doc__ = self.__class__.__call__.__doc__
             self.__class__ = PermutationExplainer
@@ -72,17 +78,17 @@ class PermutationExplainer(Explainer):
 
     # note that changes to this function signature should be copied to the default call argument wrapper above
     def __call__(self, *args, max_evals=500, main_effects=False, error_bounds=False, batch_size="auto",
-                 outputs=None, silent=False):
+                 outputs=None, silent=False, pack_size=None, n_jobs=None, backend="threads"):
         """Explain the output of the model on the given arguments."""
         return super().__call__(
             *args, max_evals=max_evals, main_effects=main_effects, error_bounds=error_bounds, batch_size=batch_size,
-            outputs=outputs, silent=silent
+            outputs=outputs, silent=silent, pack_size=pack_size, n_jobs=n_jobs, backend=backend
         )
 
     def explain_row(self, *row_args, max_evals, main_effects, error_bounds, batch_size, outputs, silent):
         """Explains a single row and returns the tuple (row_values, row_expected_values, row_mask_shapes)."""
         # build a masked version of the model for the current input sample
-        fm = MaskedModel(self.model, self.masker, self.link, self.linearize_link, *row_args)
+        fm = MaskedModel(self.model, self.masker, self.link, self.linearize_link, *row_args, output_cache=self.output_cache)
 
         # by default we run 10 permutations forward and backward
         if max_evals == "auto":
@@ -118,7 +124,7 @@ class PermutationExplainer(Explainer):
                     #assert len(inds) == len(fm), "Need to support partition shuffle when not all the inds vary!!"
                     partition_tree_shuffle(inds, inds_mask, row_clustering)
                 else:
-                    np.random.shuffle(inds)
+                    self._random_state.shuffle(inds)
 
                 # create a large batch of masks to evaluate
                 i = 1
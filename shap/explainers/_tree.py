@@ -1,6 +1,7 @@
 import io
 import json
 import os
+import threading
 import time
 import warnings
 from typing import Optional
@@ -22,13 +23,16 @@ from ..utils._exceptions import (
     InvalidModelError,
 )
 from ..utils._legacy import DenseData
-from ._explainer import Explainer
+from ._explainer import Explainer, _get_num_threads
 from .other._ubjson import decode_ubjson_buffer
 
 try:
     from .. import _cext
-except ImportError as e:
-    record_import_error("cext", "C extension was not built during install!", e)
+    _HAS_CEXT = True
+except ImportError:
+    # the numba versions of the kernels take the same arguments, but only cover algorithm="recursive"
+    from . import _tree_numba as _cext
+    _HAS_CEXT = False
 
 try:
     import pyspark  # noqa
@@ -46,8 +50,37 @@ feature_perturbation_codes = {
     "interventional": 0,
     "tree_path_dependent": 1,
     "global_path_dependent": 2,
+    # the tree_path_dependent algorithm run on node weights counted from the background data
+    "background_path_dependent": 1,
 }
 
+# the feature_perturbation options that run the tree_path_dependent algorithm on the node weights
+_PATH_DEPENDENT_PERTURBATIONS = ("tree_path_dependent", "background_path_dependent")
+
+# the weight (relative to a single background sample) of the model's own node weights that are blended into
+# the background node weights of feature_perturbation="background_path_dependent"
+_BACKGROUND_PRIOR_WEIGHT = 1e-6
+
+# the number of rows of a sparse input densified at a time by TreeEnsemble.predict_leaves
+_SPARSE_LEAVES_BLOCK_SIZE = 1024
+
+# the largest number of path table entries (8 bytes each) built for algorithm="path_tables"
+_MAX_PATH_TABLE_SIZE = 2**27
+
+# layout of the files written by TreeEnsemble.save_compiled: the magic bytes, the header length as
+# a little endian uint64, a JSON header, and then the raw arrays, each starting on an aligned offset
+_COMPILED_MAGIC = b"SHAPTREE"
+_COMPILED_VERSION = 1
+_COMPILED_ALIGNMENT = 64
+_COMPILED_ARRAYS = (
+    "children_left", "children_right", "children_default", "features", "thresholds",
+    "values", "node_sample_weight", "num_nodes", "base_offset",
+)
+_COMPILED_ATTRIBUTES = (
+    "model_output", "objective", "tree_output", "tree_limit", "num_stacked_models",
+    "fully_defined_weighting", "max_depth",
+)
+
 
 def _check_xgboost_version(v: str):
     if version.parse(v) < version.parse("1.6"):
@@ -65,11 +98,75 @@ def _xgboost_n_iterations(tree_limit: int, num_stacked_models: int) -> int:
     return n_iterations
 
 
-def _xgboost_cat_unsupported(model):
-    if model.model_type == "xgboost" and model.cat_feature_indices is not None:
+def _check_exact_depth(exact_depth):
+    """Check that ``exact_depth`` is None or a non-negative number of tree levels."""
+    if exact_depth is None:
+        return None
+    if isinstance(exact_depth, (bool, np.bool_)) or not isinstance(exact_depth, (int, np.integer)) or exact_depth < 0:
+        raise ValueError(f"exact_depth must be None or a non-negative number of tree levels, got {exact_depth!r}!")
+    return int(exact_depth)
+
+
+def _split_weighted_background(data):
+    """Split a weighted background dataset into its samples and their weights.
+
+    A weighted background is either a ``DenseData`` object (such as the output of ``shap.kmeans``)
+    or a dict with "data" and "weights" entries. The weights are normalized to sum to one, and
+    are ``None`` for any other (unweighted) background.
+    """
+    if isinstance(data, DenseData):
+        if data.transposed:
+            raise ValueError("Transposed DenseData objects are not supported as background data!")
+        background, weights = data.data, data.weights
+    elif isinstance(data, dict) and "weights" in data:
+        if "data" not in data:
+            raise ValueError("A weighted background dict needs both a \"data\" and a \"weights\" entry!")
+        background, weights = data["data"], data["weights"]
+    else:
+        return data, None
+
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+    if weights.shape[0] != background.shape[0]:
+        raise ValueError(
+            f"The background has {background.shape[0]} samples but {weights.shape[0]} weights were given!"
+        )
+    if np.any(weights < 0) or not weights.sum() > 0:
+        raise ValueError("The background weights must be non-negative and sum to a positive number!")
+    return background, weights / weights.sum()
+
+
+def _categorical_splits(trees, max_nodes):
+    """Pack the category sets of the categorical splits of ``trees`` for the C extension, or return None.
+
+    The result is the ``(cat_offsets, cat_bitsets)`` tuple taken by the tree kernels (see ``split_goes_left``
+    in tree_shap.h): ``cat_offsets`` is a ``(# trees, max_nodes)`` array holding for each categorical split
+    the position of its set in ``cat_bitsets``, and -1 for numerical splits and leaves. Each set is stored as
+    its number of 32 bit words followed by the words, and samples whose category is in it go left.
+    """
+    if all(getattr(tree, "categories", None) is None for tree in trees):
+        return None
+    cat_offsets = np.full((len(trees), max_nodes), -1, dtype=np.int32)
+    words = []
+    num_words = 0
+    for i, tree in enumerate(trees):
+        for node, categories in enumerate(getattr(tree, "categories", None) or []):
+            if categories is None:
+                continue
+            categories = np.asarray(categories, dtype=np.int64)
+            bitset = np.zeros(categories.max() // 32 + 1, dtype=np.uint32)
+            np.bitwise_or.at(bitset, categories // 32, np.left_shift(1, categories % 32).astype(np.uint32))
+            cat_offsets[i, node] = num_words
+            words.append(np.uint32(len(bitset)))
+            words.extend(bitset)
+            num_words += len(bitset) + 1
+    return cat_offsets, np.array(words, dtype=np.uint32)
+
+
+def _categorical_splits_unsupported(model, algorithm):
+    if getattr(model, "categorical_splits", None) is not None:
         raise NotImplementedError(
-            "Categorical split is not yet supported. You can still use"
-            " TreeExplainer with `feature_perturbation=tree_path_dependent`."
+            f"Categorical splits are not supported by {algorithm}. You can still use TreeExplainer with "
+            "algorithm=\"recursive\" or \"cached_background\"."
         )
 
 
@@ -81,6 +178,11 @@ class TreeExplainer(Explainer):
     feature dependence. It depends on fast C++ implementations either inside an
     external model package or in the local compiled C extension.
 
+    The local C extension releases the GIL while it runs, and explaining a batch
+    does not modify the explainer's tree arrays or background data, so concurrent
+    calls to ``shap_values`` (or ``__call__``) on the same ``TreeExplainer`` from
+    several Python threads are thread-safe and run in parallel.
+
     Examples
     --------
     See `Tree explainer examples <https://shap.readthedocs.io/en/latest/api_examples/explainers/Tree.html>`_
@@ -98,6 +200,8 @@ class TreeExplainer(Explainer):
         # FIXME: The `link` and `linearize_link` arguments are ignored. GH #3513
         link=None,
         linearize_link=None,
+        dtype="float64",
+        algorithm="recursive",
     ):
         """Build a new Tree explainer for the passed model.
 
@@ -108,7 +212,7 @@ class TreeExplainer(Explainer):
             XGBoost, LightGBM, CatBoost, Pyspark and most tree-based
             scikit-learn models are supported.
 
-        data : numpy.array or pandas.DataFrame
+        data : numpy.array, pandas.DataFrame, DenseData or dict
             The background dataset to use for integrating out features.
 
             This argument is optional when
@@ -117,7 +221,17 @@ class TreeExplainer(Explainer):
             path as our background dataset (this is recorded in the ``model``
             object).
 
-        feature_perturbation : "interventional" (default) or "tree_path_dependent" (default when data=None)
+            With ``feature_perturbation="interventional"`` or
+            ``feature_perturbation="background_path_dependent"`` the background can
+            also be weighted, either as a ``DenseData`` object (for example the
+            cluster centers and sizes returned by ``shap.kmeans``) or as a dict
+            ``{"data": samples, "weights": weights}``. The SHAP values and the
+            expected value are then weighted averages over the samples, so a
+            small weighted summary can stand in for a large background dataset
+            at the runtime of its number of samples. Weighted backgrounds are
+            never subsampled.
+
+        feature_perturbation : "interventional" (default), "tree_path_dependent" (default when data=None) or "background_path_dependent"
             Since SHAP values rely on conditional expectations, we need to
             decide how to handle correlated (or otherwise dependent) input
             features.
@@ -135,6 +249,22 @@ class TreeExplainer(Explainer):
             require a background dataset, and so is used by default when no
             background dataset is provided.
 
+            The "background_path_dependent" approach runs the
+            "tree_path_dependent" algorithm, but first counts how many
+            background samples go down each tree path and uses these counts
+            in place of the training counts. The background is compiled into
+            the trees once, when the explainer is created, so explaining a
+            sample costs the same for 100 or 100,000 background samples, and
+            the background is never subsampled. The trade-off is accuracy:
+            each branch is weighted by the fraction of the background samples
+            that reached its parent node, so the values equal the
+            "interventional" ones only when the features are independent in
+            the background data. With dependent features they lean towards
+            conditional expectations, like "tree_path_dependent" does.
+            Subtrees that no background sample reaches fall back to the
+            proportions of the model's own training counts. Only
+            ``model_output="raw"`` is supported.
+
         model_output : "raw", "probability", "log_loss", or model method name
             What output of the model should be explained.
 
@@ -157,13 +287,66 @@ class TreeExplainer(Explainer):
             Currently the "probability" and "log_loss" options are only
             supported when ``feature_perturbation="interventional"``.
 
+        dtype : "float64" (default) or "float32"
+            The floating point precision used by the local C extension to compute SHAP values.
+
+            With "float32" the tree arrays, the explained samples and the SHAP values are all
+            single precision, which halves the memory traffic of the path walk and the size of
+            the output. The results then only agree with "float64" to about float32 precision,
+            so the additivity check uses a looser tolerance. This option is only supported with
+            ``feature_perturbation="tree_path_dependent"``, and SHAP interaction values are
+            still computed in double precision.
+
+        algorithm : "recursive" (default), "path_tables", "paths" or "cached_background"
+            How the local C extension computes SHAP values.
+
+            * "recursive" walks every tree for every sample, extending and unwinding the path
+              of unique features as it goes. It needs no extra memory.
+            * "path_tables" precomputes a table of path weights for every leaf once (it has
+              ``2**d`` entries for a leaf with ``d`` unique features on its path) and caches it
+              on the explainer. Each sample then only costs ``O(depth)`` per leaf instead of
+              ``O(depth**2)``, which pays off when many batches are explained with one model.
+            * "paths" splits the ensemble into root to leaf paths (the layout used by
+              ``GPUTreeExplainer``), caches them on the explainer, and evaluates each path for
+              blocks of samples at once. The inner loops run over the samples, so they
+              vectorize well on the CPU, and ``n_jobs`` splits the samples across threads.
+            * "cached_background" is for ``feature_perturbation="interventional"``. It records
+              which branch every background sample takes at every node of every tree (one byte
+              each), the model output of every background sample and the reformatted trees
+              once, and caches them on the explainer. Later calls then no longer re-evaluate
+              the background samples, which helps when many small batches are explained. The
+              cache is rebuilt when ``tree_limit`` changes.
+
+            "path_tables" and "paths" are only supported with
+            ``feature_perturbation="tree_path_dependent"``. SHAP interaction values always use
+            the "recursive" algorithm.
+
+            When the C extension was not built, numba compiled versions of the "recursive"
+            kernels are used instead (single threaded, and compiled on first use), and the
+            other algorithms fall back to "recursive" with a warning.
+
         """
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"dtype must be \"float64\" or \"float32\", got {dtype!r}!")
+
+        data, self.data_weights = _split_weighted_background(data)
+        if self.data_weights is not None and feature_perturbation not in ("interventional", "background_path_dependent"):
+            raise ValueError(
+                "Weighted background data is only supported for feature_perturbation=\"interventional\" or "
+                "\"background_path_dependent\"!"
+            )
+
         if feature_names is not None:
             self.data_feature_names = feature_names
         elif isinstance(data, pd.DataFrame):
             self.data_feature_names = list(data.columns)
 
         masker = data
+        if data is not None and (self.data_weights is not None or feature_perturbation == "background_path_dependent"):
+            # the weights belong to the samples (and compiling the background into the trees
+            # is what makes a large background affordable), so all of them have to be kept
+            masker = maskers.Independent(data, max_samples=data.shape[0])
         super().__init__(model, masker, feature_names=feature_names)
 
         if type(self.masker) is maskers.Independent:
@@ -176,8 +359,6 @@ class TreeExplainer(Explainer):
 
         if isinstance(data, pd.DataFrame):
             self.data = data.values
-        elif isinstance(data, DenseData):
-            self.data = data.data
         else:
             self.data = data
         if self.data is None:
@@ -192,7 +373,12 @@ class TreeExplainer(Explainer):
         self.data_missing = None if self.data is None else pd.isna(self.data)
         self.feature_perturbation = feature_perturbation
         self.expected_value = None
-        self.model = TreeEnsemble(model, self.data, self.data_missing, model_output)
+        if feature_perturbation == "background_path_dependent" and self.data is not None:
+            # keep the model's own node weights, they are the prior for the background node weights
+            self.model = TreeEnsemble(model, None, None, model_output)
+            self.model._set_background_weights(self.data, self.data_missing, self.data_weights)
+        else:
+            self.model = TreeEnsemble(model, self.data, self.data_missing, model_output)
         self.model_output = model_output
         #self.model_output = self.model.model_output # this allows the TreeEnsemble to translate model outputs types by how it loads the model
 
@@ -201,11 +387,36 @@ class TreeExplainer(Explainer):
             raise InvalidFeaturePerturbationError("Invalid feature_perturbation option!")
 
         # check for unsupported combinations of feature_perturbation and model_outputs
-        if feature_perturbation == "tree_path_dependent":
+        if feature_perturbation in _PATH_DEPENDENT_PERTURBATIONS:
             if self.model.model_output != "raw":
-                raise ValueError("Only model_output=\"raw\" is supported for feature_perturbation=\"tree_path_dependent\"")
-        elif data is None:
+                raise ValueError(f"Only model_output=\"raw\" is supported for feature_perturbation=\"{feature_perturbation}\"")
+        if feature_perturbation != "tree_path_dependent" and data is None:
             raise ValueError("A background dataset must be provided unless you are using feature_perturbation=\"tree_path_dependent\"!")
+        if self.dtype == np.float32 and feature_perturbation not in _PATH_DEPENDENT_PERTURBATIONS:
+            raise ValueError("dtype=\"float32\" is only supported for feature_perturbation=\"tree_path_dependent\"!")
+
+        if algorithm not in ("recursive", "path_tables", "paths", "cached_background"):
+            raise ValueError(
+                f"algorithm must be \"recursive\", \"path_tables\", \"paths\" or \"cached_background\", got {algorithm!r}!"
+            )
+        if algorithm in ("path_tables", "paths"):
+            if feature_perturbation not in _PATH_DEPENDENT_PERTURBATIONS:
+                raise ValueError(f"algorithm=\"{algorithm}\" is only supported for feature_perturbation=\"tree_path_dependent\"!")
+            if self.dtype != np.float64:
+                raise ValueError(f"algorithm=\"{algorithm}\" only supports dtype=\"float64\"!")
+        elif algorithm == "cached_background" and feature_perturbation != "interventional":
+            raise ValueError("algorithm=\"cached_background\" is only supported for feature_perturbation=\"interventional\"!")
+        if algorithm in ("path_tables", "paths"):
+            _categorical_splits_unsupported(self.model, f"algorithm=\"{algorithm}\"")
+        if algorithm != "recursive" and not _HAS_CEXT:
+            warnings.warn(f"algorithm=\"{algorithm}\" needs the C extension, which was not built, so \"recursive\" is used instead.")
+            algorithm = "recursive"
+        self.algorithm = algorithm
+        self._path_tables = None
+        self._paths = None
+        self._background_cache = None
+        self._explain_one_state = None
+        self._explain_one_buffers = threading.local()
 
         if self.model.model_output != "raw":
             if self.model.objective is None and self.model.tree_output is None:
@@ -226,7 +437,7 @@ class TreeExplainer(Explainer):
             self.expected_value = self.__dynamic_expected_value
         elif data is not None:
             try:
-                self.expected_value = self.model.predict(self.data).mean(0)
+                self.expected_value = np.average(self.model.predict(self.data), axis=0, weights=self.data_weights)
             except ValueError:
                 raise ExplainerError("Currently TreeExplainer can only handle models with categorical splits when " \
                                 "feature_perturbation=\"tree_path_dependent\" and no background data is passed. Please try again using " \
@@ -247,9 +458,9 @@ class TreeExplainer(Explainer):
 
     def __dynamic_expected_value(self, y):
         """This computes the expected value conditioned on the given label value."""
-        return self.model.predict(self.data, np.ones(self.data.shape[0]) * y).mean(0)
+        return np.average(self.model.predict(self.data, np.ones(self.data.shape[0]) * y), axis=0, weights=self.data_weights)
 
-    def __call__(self, X, y=None, interactions=False, check_additivity=True):
+    def __call__(self, X, y=None, interactions=False, check_additivity=True, n_jobs=None, top_k=None):
 
         start_time = time.time()
 
@@ -258,13 +469,29 @@ class TreeExplainer(Explainer):
         else:
             feature_names = getattr(self, "data_feature_names", None)
 
-        if not interactions:
-            v = self.shap_values(X, y=y, from_call=True, check_additivity=check_additivity, approximate=self.approximate)
+        top_k_indices = None
+        if top_k is not None:
+            # the explanation then holds the top features of each row, with per row feature names
+            if interactions:
+                raise ValueError("top_k is not supported together with interactions=True!")
+            top_k_indices, v = self.shap_values(
+                X, y=y, from_call=True, check_additivity=check_additivity, approximate=self.approximate, n_jobs=n_jobs,
+                top_k=top_k
+            )
+            if v.ndim != 2:
+                raise ValueError("top_k is only supported for models with a single output, use shap_values(X, top_k=...) instead!")
+            if feature_names is None:
+                feature_names = [f"Feature {i}" for i in range(_num_rows_and_columns(X)[1])]
+            feature_names = np.array(feature_names, dtype=object)[top_k_indices]
+        elif not interactions:
+            v = self.shap_values(
+                X, y=y, from_call=True, check_additivity=check_additivity, approximate=self.approximate, n_jobs=n_jobs
+            )
             if isinstance(v, list):
                 v = np.stack(v, axis=-1)  # put outputs at the end
         else:
             assert not self.approximate, "Approximate computation not yet supported for interaction effects!"
-            v = self.shap_interaction_values(X)
+            v = self.shap_interaction_values(X, n_jobs=n_jobs)
 
         # the Explanation object expects an `expected_value` for each row
         if hasattr(self.expected_value, "__len__") and len(self.expected_value) > 1:
@@ -301,6 +528,12 @@ class TreeExplainer(Explainer):
             else:
                 X: scipy.sparse.csr_matrix = X.get_data()
 
+        if top_k_indices is not None:
+            if scipy.sparse.issparse(X):
+                X = np.asarray(X.tocsr()[np.arange(X.shape[0])[:, None], top_k_indices].todense())
+            elif X is not None:
+                X = np.take_along_axis(np.asarray(X), top_k_indices, axis=1)
+
         return Explanation(
             v,
             base_values=ev_tiled,
@@ -320,14 +553,19 @@ class TreeExplainer(Explainer):
         if isinstance(X, (pd.Series, pd.DataFrame)):
             X = X.values
         flat_output = False
-        if len(X.shape) == 1:
-            flat_output = True
-            X = X.reshape(1, X.shape[0])
-        if X.dtype != self.model.input_dtype:
-            X = X.astype(self.model.input_dtype)
-        X_missing = np.isnan(X, dtype=bool)
-        assert isinstance(X, np.ndarray), "Unknown instance type: " + str(type(X))
-        assert len(X.shape) == 2, "Passed input data matrix X must have 1 or 2 dimensions!"
+        if scipy.sparse.issparse(X):
+            # sparse matrices stay sparse, the missing values are the stored NaNs
+            X = scipy.sparse.csr_matrix(X, dtype=self.model.input_dtype)
+            X_missing = None
+        else:
+            if len(X.shape) == 1:
+                flat_output = True
+                X = X.reshape(1, X.shape[0])
+            if X.dtype != self.model.input_dtype:
+                X = X.astype(self.model.input_dtype)
+            X_missing = np.isnan(X, dtype=bool)
+            assert isinstance(X, np.ndarray), "Unknown instance type: " + str(type(X))
+            assert len(X.shape) == 2, "Passed input data matrix X must have 1 or 2 dimensions!"
 
         if self.model.model_output == "log_loss":
             if y is None:
@@ -366,13 +604,19 @@ class TreeExplainer(Explainer):
 
         return X, y, X_missing, flat_output, tree_limit, check_additivity
 
-    def shap_values(self, X, y=None, tree_limit=None, approximate=False, check_additivity=True, from_call=False):
+    def shap_values(
+        self, X, y=None, tree_limit=None, approximate=False, check_additivity=True, from_call=False, n_jobs=None,
+        sparse_output=False, return_predictions=False, return_error_bound=False, top_k=None, exact_depth=None,
+    ):
         """Estimate the SHAP values for a set of samples.
 
         Parameters
         ----------
-        X : numpy.array, pandas.DataFrame or catboost.Pool (for catboost)
+        X : numpy.array, pandas.DataFrame, scipy.sparse matrix or catboost.Pool (for catboost)
             A matrix of samples (# samples x # features) on which to explain the model's output.
+            Sparse matrices are never densified: only the columns the model splits on are
+            kept, and blocks of rows are expanded into small dense buffers inside the C
+            extension. Entries that are not stored are zeros, stored NaNs are missing values.
 
         y : numpy.array
             An array of label values for each sample. Used when explaining loss functions.
@@ -385,17 +629,71 @@ class TreeExplainer(Explainer):
             Run fast, but only roughly approximate the Tree SHAP values. This runs a method
             previously proposed by Saabas which only considers a single feature ordering. Take care
             since this does not have the consistency guarantees of Shapley values and places too
-            much weight on lower splits in the tree.
+            much weight on lower splits in the tree. See ``exact_depth`` for a point in between.
 
         check_additivity : bool
             Run a validation check that the sum of the SHAP values equals the output of the model. This
             check takes only a small amount of time, and will catch potential unforeseen errors.
             Note that this check only runs right now when explaining the margin of the model.
 
+        n_jobs : None (default) or int
+            The number of threads used by the C extension to explain the samples in parallel.
+            ``None`` means one thread and ``-1`` means all CPUs. Samples are split across the
+            threads, so the results are identical to a single-threaded run. This only applies
+            when the computation runs in the local C extension (not when it is delegated to
+            XGBoost, LightGBM or CatBoost).
+
+        sparse_output : bool
+            Only for sparse ``X``: return a ``scipy.sparse.csr_matrix`` of shape
+            ``(# samples x # features)`` (a list of them, one per output, for models with
+            multiple outputs) that only stores the features the model uses, instead of a
+            dense array.
+
+        return_predictions : bool
+            Also return the model output for every sample, in the units that are explained
+            (shaped like the output of ``TreeEnsemble.predict``). The C extension computes it
+            while it walks the trees for the SHAP values, and ``check_additivity`` reuses it
+            instead of predicting again. The path_tables and paths algorithms still predict
+            separately, and when the computation is delegated to XGBoost, LightGBM or CatBoost
+            the predictions are the row sums of their SHAP values (including the bias term).
+
+        return_error_bound : bool
+            Also return, for every sample (and output), an estimate of the L1 distance between
+            the returned and the exact SHAP values (zero unless ``approximate`` or
+            ``exact_depth`` is used). Each split below the exactly explained levels that the
+            sample follows adds the absolute change in the expected value it is credited with,
+            times the fraction of the training data that does not reach the split (the part of
+            the credit that the exact values give to the features of the splits above it). This
+            is an estimate rather than a guarantee, but it shrinks as ``exact_depth`` grows and
+            follows the actual error of each sample, so it can be used to pick ``exact_depth``
+            or to decide which samples to explain exactly. Only supported for the path
+            dependent ``feature_perturbation`` options.
+
+        top_k : None (default) or int
+            Only return the ``top_k`` largest magnitude SHAP values of each sample (and output),
+            as a pair of arrays ``(indices, values)`` of shape ``(# samples x top_k)`` (with a
+            trailing ``# outputs`` dimension for models with multiple outputs) that hold the
+            feature indices and their SHAP values, ordered by decreasing magnitude. The samples
+            are explained in blocks of rows, so the dense SHAP values of all samples are never
+            held in memory at once.
+
+        exact_depth : None (default) or int
+            A number of tree levels ``d`` for a point in between the exact values and
+            ``approximate=True`` (for the path dependent ``feature_perturbation`` options): the
+            top ``d`` levels of every tree are explained exactly, treating the nodes at depth
+            ``d`` as leaves that hold the expected value below them, and the rest of the path of
+            each sample is credited as in Saabas. ``0`` is Saabas, a ``d`` of at least the depth
+            of the trees gives the exact values, and the cost grows with ``d`` in between. The
+            values always sum to the model output, and are computed in double precision. Cannot
+            be combined with ``approximate=True``.
+
         Returns
         -------
         np.array
             Estimated SHAP values, usually of shape ``(# samples x # features)``.
+            With ``return_predictions=True`` and/or ``return_error_bound=True`` a tuple of the
+            SHAP values followed by the predictions and then the error estimates is returned.
+            With ``top_k`` the SHAP values are replaced by the ``indices`` and ``values`` arrays.
 
             Each row sums to the difference between the model output for that
             sample and the expected value of the model output (which is stored
@@ -415,8 +713,32 @@ class TreeExplainer(Explainer):
         if tree_limit is None:
             tree_limit = -1 if self.model.tree_limit is None else self.model.tree_limit
 
+        exact_depth = _check_exact_depth(exact_depth)
+        if exact_depth is not None and approximate:
+            raise ValueError("approximate=True and exact_depth cannot be combined, exact_depth=0 is the same as approximate=True!")
+        if return_error_bound and approximate:
+            if self.feature_perturbation not in _PATH_DEPENDENT_PERTURBATIONS:
+                raise ValueError("return_error_bound=True is only supported for the path dependent feature_perturbation options!")
+            # Saabas is the truncated algorithm with no exact levels
+            approximate = False
+            exact_depth = 0
+        if exact_depth is not None and self.feature_perturbation not in _PATH_DEPENDENT_PERTURBATIONS:
+            raise ValueError("exact_depth is only supported for the path dependent feature_perturbation options!")
+        if top_k is not None:
+            return self._top_k_shap_values(
+                X, y, tree_limit, approximate, check_additivity, from_call, n_jobs, sparse_output,
+                return_predictions, return_error_bound, top_k, exact_depth
+            )
+
         # shortcut using the C++ version of Tree SHAP in XGBoost, LightGBM, and CatBoost
-        if self.feature_perturbation == "tree_path_dependent" and self.model.model_type != "internal" and self.data is None:
+        if (
+            self.feature_perturbation == "tree_path_dependent"
+            and self.model.model_type != "internal"
+            and self.data is None
+            and self.algorithm == "recursive"
+            and exact_depth is None
+            and not return_error_bound
+        ):
             model_output_vals = None
             phi = None
             if self.model.model_type == "xgboost":
@@ -477,45 +799,447 @@ class TreeExplainer(Explainer):
                     self.assert_additivity(out, model_output_vals)
                 if isinstance(out, list):
                     out = np.stack(out, axis=-1)
+                if return_predictions:
+                    return out, phi.sum(axis=-1)
                 return out
 
         X, y, X_missing, flat_output, tree_limit, check_additivity = self._validate_inputs(
             X, y, tree_limit, check_additivity
         )
         transform = self.model.get_transform()
-        _xgboost_cat_unsupported(self.model)
-
-        # run the core algorithm using the C extension
-        assert_import("cext")
-        phi = np.zeros((X.shape[0], X.shape[1]+1, self.model.num_outputs))
+        if scipy.sparse.issparse(X):
+            if return_error_bound:
+                raise ValueError("return_error_bound=True is not supported for sparse inputs!")
+            if exact_depth is not None:
+                raise ValueError("exact_depth is not supported for sparse inputs!")
+            return self._sparse_shap_values(
+                X, y, tree_limit, approximate, check_additivity, _get_num_threads(n_jobs), sparse_output,
+                return_predictions
+            )
+        if exact_depth is not None:
+            return self._truncated_shap_values(
+                X, y, X_missing, flat_output, tree_limit, exact_depth, check_additivity, _get_num_threads(n_jobs),
+                return_predictions, return_error_bound
+            )
 
-        if not approximate:
+        # run the core algorithm using the C extension, which also fills in the predictions if we need them
+        phi = np.zeros((X.shape[0], X.shape[1]+1, self.model.num_outputs), dtype=self.dtype)
+        predictions = None
+        if return_predictions or (check_additivity and self.model.model_output == "raw"):
+            predictions = np.zeros((X.shape[0], self.model.num_outputs), dtype=self.dtype)
+        num_threads = _get_num_threads(n_jobs)
+        thresholds, values, node_sample_weight, base_offset = self.model._compute_arrays(self.dtype)
+        if X.dtype != self.dtype:
+            X = X.astype(self.dtype)
+
+        if not approximate and self.algorithm == "path_tables":
+            _cext.dense_tree_shap_path_tables(
+                self.model.children_left, self.model.children_right, self.model.children_default,
+                self.model.features, thresholds, values, tree_limit, base_offset,
+                self._get_path_tables(), X, X_missing, phi, num_threads
+            )
+        elif not approximate and self.algorithm == "paths":
+            _cext.dense_tree_shap_paths(
+                values, tree_limit, base_offset, self._get_paths(), X, X_missing, phi, num_threads
+            )
+        elif not approximate:
+            background_cache = None
+            if self.algorithm == "cached_background":
+                background_cache = self._get_background_cache(tree_limit, num_threads)
+            # the path dependent perturbations already have the background weights in their node weights
+            R_weights = self.data_weights if self.feature_perturbation == "interventional" else None
             _cext.dense_tree_shap(
                 self.model.children_left, self.model.children_right, self.model.children_default,
-                self.model.features, self.model.thresholds, self.model.values, self.model.node_sample_weight,
+                self.model.features, thresholds, values, node_sample_weight,
                 self.model.max_depth, X, X_missing, y, self.data, self.data_missing, tree_limit,
-                self.model.base_offset, phi, feature_perturbation_codes[self.feature_perturbation],
-                output_transform_codes[transform], False
+                base_offset, phi, feature_perturbation_codes[self.feature_perturbation],
+                output_transform_codes[transform], False, num_threads, None, background_cache, R_weights, None,
+                predictions, self.model.categorical_splits
             )
         else:
             _cext.dense_tree_saabas(
                 self.model.children_left, self.model.children_right, self.model.children_default,
-                self.model.features, self.model.thresholds, self.model.values,
-                self.model.max_depth, tree_limit, self.model.base_offset, output_transform_codes[transform],
-                X, X_missing, y, phi
+                self.model.features, thresholds, values,
+                self.model.max_depth, tree_limit, base_offset, output_transform_codes[transform],
+                X, X_missing, y, phi, num_threads, predictions, self.model.categorical_splits
             )
+        if predictions is not None and not approximate and self.algorithm in ("path_tables", "paths"):
+            predictions = self.model.predict(X, y, tree_limit=tree_limit, dtype=self.dtype).reshape(X.shape[0], -1)
 
         out = self._get_shap_output(phi, flat_output)
         if check_additivity and self.model.model_output == "raw":
-            self.assert_additivity(out, self.model.predict(X))
+            tolerance = 1e-2 if self.dtype == np.float64 else 5e-2
+            self.assert_additivity(out, self._get_predictions_output(predictions, False), tolerance=tolerance)
 
         # This statements handles the case of multiple outputs
         # e.g. a multi-class classification problem, multi-target regression problem
         # in this case the output shape corresponds to [num_samples, num_features, num_outputs]
         if isinstance(out, list):
             out = np.stack(out, axis=-1)
+        extra_outputs = []
+        if return_predictions:
+            extra_outputs.append(self._get_predictions_output(predictions, flat_output))
+        if return_error_bound:
+            extra_outputs.append(self._get_predictions_output(np.zeros((X.shape[0], self.model.num_outputs)), flat_output))
+        return (out, *extra_outputs) if extra_outputs else out
+
+    def _top_k_shap_values(
+        self, X, y, tree_limit, approximate, check_additivity, from_call, n_jobs, sparse_output,
+        return_predictions, return_error_bound, top_k, exact_depth
+    ):
+        """Explain ``X`` block by block, only keeping the ``top_k`` largest SHAP values, see ``shap_values``."""
+        if sparse_output:
+            raise ValueError("top_k and sparse_output cannot be combined!")
+        if top_k < 0:
+            raise ValueError(f"top_k must be a non-negative integer, got {top_k}!")
+
+        flat_output = len(getattr(X, "shape", ())) == 1
+        if flat_output:
+            blocks = [(slice(None), X)]
+        else:
+            num_rows, num_features = _num_rows_and_columns(X)
+            bytes_per_row = (num_features + 1) * self.model.num_outputs * np.dtype(np.float64).itemsize
+            chunk_size = max(1, (64 * 2**20) // bytes_per_row)
+            blocks = []
+            for start in range(0, num_rows, chunk_size):
+                rows = slice(start, min(start + chunk_size, num_rows))
+                blocks.append((rows, _slice_rows(X, rows)))
+
+        results = []
+        for rows, X_block in blocks:
+            result = self.shap_values(
+                X_block, None if y is None else y[rows], tree_limit, approximate, check_additivity, from_call, n_jobs,
+                return_predictions=return_predictions, return_error_bound=return_error_bound,
+                exact_depth=exact_depth,
+            )
+            values, *extra_outputs = result if isinstance(result, tuple) else (result,)
+            if flat_output:
+                indices, values = _top_k_attributions(values[None], top_k)
+                return (indices[0], values[0], *extra_outputs)
+            results.append((*_top_k_attributions(values, top_k), *extra_outputs))
+        if not results:
+            raise ValueError("X must contain at least one sample!")
+        return tuple(np.concatenate(arrays, axis=0) for arrays in zip(*results))
+
+    def explain_one(self, x, y=None, out=None):
+        """Estimate the SHAP values of a single sample with as little per call overhead as possible.
+
+        This is meant for explaining samples one at a time as they arrive. The model arrays,
+        the tree limit and the input and output buffers are prepared by the first call and
+        reused by the later ones, and ``x`` is not validated beyond being copied into the
+        input buffer, so it must hold the features the explainer was built for. Every thread
+        gets its own buffers while the model arrays are shared, so concurrent calls on the
+        same explainer are thread-safe. The values match ``shap_values(x)``, but they are
+        always computed single threaded by the shap kernels (also for models whose
+        ``shap_values`` are delegated to XGBoost, LightGBM or CatBoost), with the default
+        ``tree_limit`` and without the additivity check. The path_tables and paths
+        algorithms fall back to the recursive one.
+
+        Parameters
+        ----------
+        x : numpy.array
+            A single sample, a 1d array of # features values (NaN marks missing values).
+
+        y : None or float
+            The label of the sample, only used (and then required) when explaining the loss
+            of the model.
+
+        out : None or numpy.array
+            An array of the shape of the result to write the SHAP values into, instead of
+            allocating a new one.
+
+        Returns
+        -------
+        np.array
+            The SHAP values of the sample, of shape ``(# features)`` for models with a single
+            output and ``(# features x # outputs)`` otherwise, like ``shap_values(x)``.
+
+        """
+        if self._explain_one_state is None:
+            self._explain_one_state = self._get_explain_one_state()
+        buffers = getattr(self._explain_one_buffers, "buffers", None)
+        if buffers is None or buffers[0].shape[1] != len(x):
+            buffers = self._explain_one_buffers.buffers = self._get_explain_one_buffers(len(x))
+        X, X_missing, y_buffer, phi = buffers
+        np.copyto(X[0], x, casting="unsafe")
+        np.isnan(X, out=X_missing)
+        if y_buffer is not None:
+            if y is None:
+                raise ExplainerError("A label must be provided when model_output = \"log_loss\"!")
+            y_buffer[0] = y
+        phi.fill(0)
+        model_args, data_args, other_args = self._explain_one_state
+        _cext.dense_tree_shap(*model_args, X, X_missing, y_buffer, *data_args, phi, *other_args)
+
+        values = phi[0, :-1]
+        if self.model.model_output == "probability_doubled":
+            values = np.concatenate((-values, values), axis=1)
+        elif self.model.num_outputs == 1:
+            values = values[:, 0]
+        if out is None:
+            return values.copy()
+        np.copyto(out, values)
+        return out
+
+    def _get_explain_one_state(self):
+        """Build the ``dense_tree_shap`` arguments shared by all the ``explain_one`` calls."""
+        tree_limit = -1 if self.model.tree_limit is None else self.model.tree_limit
+        if tree_limit < 0 or tree_limit > self.model.values.shape[0]:
+            tree_limit = self.model.values.shape[0]
+        thresholds, values, node_sample_weight, base_offset = self.model._compute_arrays(self.dtype)
+        background_cache = None
+        if self.algorithm == "cached_background":
+            background_cache = self._get_background_cache(tree_limit, 1)
+        R_weights = self.data_weights if self.feature_perturbation == "interventional" else None
+        model_args = (
+            self.model.children_left, self.model.children_right, self.model.children_default,
+            self.model.features, thresholds, values, node_sample_weight, self.model.max_depth
+        )
+        data_args = (self.data, self.data_missing, tree_limit, base_offset)
+        other_args = (
+            feature_perturbation_codes[self.feature_perturbation],
+            output_transform_codes[self.model.get_transform()], False, 1, None, background_cache, R_weights, None,
+            None, self.model.categorical_splits
+        )
+        return model_args, data_args, other_args
+
+    def _get_explain_one_buffers(self, num_features):
+        """Build the input and output buffers of the ``explain_one`` calls made by the current thread."""
+        X = np.zeros((1, num_features), dtype=self.dtype)
+        X_missing = np.zeros((1, num_features), dtype=bool)
+        y_buffer = np.zeros(1) if self.model.model_output == "log_loss" else None
+        phi = np.zeros((1, num_features + 1, self.model.num_outputs), dtype=self.dtype)
+        return X, X_missing, y_buffer, phi
+
+    def __getstate__(self):
+        # the per thread explain_one buffers cannot be pickled, and are rebuilt on demand anyway
+        state = self.__dict__.copy()
+        state["_explain_one_buffers"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._explain_one_buffers = threading.local()
+
+    def _truncated_shap_values(
+        self, X, y, X_missing, flat_output, tree_limit, exact_depth, check_additivity, num_threads,
+        return_predictions, return_error_bound
+    ):
+        """Explain the top ``exact_depth`` levels of the trees exactly and the rest with Saabas, see ``shap_values``."""
+        phi = np.zeros((X.shape[0], X.shape[1]+1, self.model.num_outputs))
+        predictions = np.zeros((X.shape[0], self.model.num_outputs))
+        error_bounds = np.zeros((X.shape[0], self.model.num_outputs)) if return_error_bound else None
+        thresholds, values, node_sample_weight, base_offset = self.model._compute_arrays(np.float64)
+        _cext.dense_tree_shap_truncated(
+            self.model.children_left, self.model.children_right, self.model.children_default,
+            self.model.features, thresholds, values, node_sample_weight,
+            self.model.max_depth, X.astype(np.float64), X_missing, y, tree_limit, base_offset,
+            exact_depth, phi, output_transform_codes[self.model.get_transform()], num_threads, error_bounds,
+            predictions, self.model.categorical_splits
+        )
+
+        out = self._get_shap_output(phi, flat_output)
+        if check_additivity and self.model.model_output == "raw":
+            self.assert_additivity(out, self._get_predictions_output(predictions, False))
+        if isinstance(out, list):
+            out = np.stack(out, axis=-1)
+
+        extra_outputs = []
+        if return_predictions:
+            extra_outputs.append(self._get_predictions_output(predictions, flat_output))
+        if return_error_bound:
+            extra_outputs.append(self._get_predictions_output(error_bounds, flat_output))
+        return (out, *extra_outputs) if extra_outputs else out
+
+    def _sparse_shap_values(
+        self, X, y, tree_limit, approximate, check_additivity, num_threads, sparse_output, return_predictions=False
+    ):
+        """Explain a CSR matrix in the space of the features the model uses, then map the result back.
+
+        This always uses the recursive algorithm in double precision.
+        """
+        if approximate:
+            raise ValueError("approximate=True is not supported for sparse inputs!")
+        used_features, features = self.model._compact_features()
+        num_rows, num_features, num_used = X.shape[0], X.shape[1], len(used_features)
+
+        R, R_missing = self.data, self.data_missing
+        if R is not None:
+            R, R_missing = R[:, used_features], R_missing[:, used_features]
+
+        phi = np.zeros((num_rows, num_used + 1, self.model.num_outputs))
+        predictions = np.zeros((num_rows, self.model.num_outputs))
+        R_weights = self.data_weights if self.feature_perturbation == "interventional" else None
+        _cext.dense_tree_shap(
+            self.model.children_left, self.model.children_right, self.model.children_default,
+            features, self.model.thresholds, self.model.values, self.model.node_sample_weight,
+            self.model.max_depth, self.model._csr_input(X), None, y, R, R_missing, tree_limit,
+            self.model.base_offset, phi, feature_perturbation_codes[self.feature_perturbation],
+            output_transform_codes[self.model.get_transform()], False, num_threads, None, None, R_weights, None,
+            predictions, self.model.categorical_splits
+        )
+        predictions = self._get_predictions_output(predictions, False)
+
+        out = self._get_shap_output(phi, False)
+        if check_additivity and self.model.model_output == "raw":
+            self.assert_additivity(out, predictions)
+
+        # scatter the values of the used features back into the full feature space
+        blocks = out if isinstance(out, list) else [out]
+        if sparse_output:
+            indptr = np.arange(0, num_rows * num_used + 1, num_used) if num_used > 0 else np.zeros(num_rows + 1, dtype=int)
+            blocks = [
+                scipy.sparse.csr_matrix(
+                    (block.ravel(), np.tile(used_features, num_rows), indptr), shape=(num_rows, num_features)
+                )
+                for block in blocks
+            ]
+            for block in blocks:
+                block.eliminate_zeros()
+            out = blocks if isinstance(out, list) else blocks[0]
+        else:
+            full = np.zeros((num_rows, num_features, len(blocks)))
+            full[:, used_features] = np.stack(blocks, axis=-1)
+            out = full if isinstance(out, list) else full[..., 0]
+        return (out, predictions) if return_predictions else out
+
+    def staged_shap_values(self, X, stages, y=None, check_additivity=True, n_jobs=None):
+        """Estimate the SHAP values of the first ``k`` trees of the model for several ``k`` at once.
+
+        This is useful to follow how the attributions change across boosting rounds, e.g. for
+        early stopping diagnostics or to choose a ``tree_limit``. With
+        ``feature_perturbation="tree_path_dependent"`` (or "background_path_dependent") every
+        sample walks each tree only once and the running sum of the per tree SHAP values is
+        copied out at every stage, instead of calling ``shap_values(X, tree_limit=k)`` for
+        every ``k``.
+
+        Parameters
+        ----------
+        X : numpy.array or pandas.DataFrame
+            A matrix of samples (# samples x # features) on which to explain the model's output.
+
+        stages : list of int
+            The numbers of trees to explain the model with, in the same units as ``tree_limit``.
+            Each must be between 0 and the number of trees in the model.
+
+        y : numpy.array
+            An array of label values for each sample. Used when explaining loss functions.
+
+        check_additivity : bool
+            Check that the SHAP values of every stage sum up to the output of that many trees.
+
+        n_jobs : None (default) or int
+            The number of threads used to explain the samples, as in ``shap_values``.
+
+        Returns
+        -------
+        np.array
+            The SHAP values of every stage stacked along a new first axis, so ``values[i]``
+            matches ``shap_values(X, tree_limit=stages[i])``.
+
+        """
+        stages = np.asarray(stages)
+        num_trees = self.model.values.shape[0]
+        if stages.ndim != 1 or len(stages) == 0 or not np.issubdtype(stages.dtype, np.integer):
+            raise ValueError("stages must be a non-empty list of tree counts!")
+        if np.any(stages < 0) or np.any(stages > num_trees):
+            raise ValueError(f"stages must be between 0 and the number of trees in the model ({num_trees})!")
+
+        # the interventional algorithm has no running sum to snapshot, so each stage is explained on its own
+        if self.feature_perturbation not in _PATH_DEPENDENT_PERTURBATIONS:
+            out = np.stack([
+                self.shap_values(X, y=y, tree_limit=int(k), check_additivity=False, n_jobs=n_jobs) for k in stages
+            ])
+            if check_additivity and self.model.model_output == "raw" and self.data is not None:
+                num_outputs = self.model.num_outputs
+                for k, values in zip(stages, out):
+                    # each stage has its own expected value since it uses fewer trees
+                    model_output = np.reshape(self.model.predict(X, y, tree_limit=int(k)), (-1, num_outputs))
+                    expected_value = np.average(
+                        np.reshape(self.model.predict(self.data, tree_limit=int(k)), (-1, num_outputs)),
+                        axis=0, weights=self.data_weights,
+                    )
+                    values = values.reshape(model_output.shape[0], -1, num_outputs)
+                    self.assert_additivity(
+                        list(np.moveaxis(values, -1, 0)), model_output, expected_value=expected_value
+                    )
+            return out
+
+        X, y, X_missing, flat_output, _, check_additivity = self._validate_inputs(X, y, None, check_additivity)
+
+        # explain every distinct stage once, in increasing order
+        unique_stages, stage_inds = np.unique(stages, return_inverse=True)
+        phi = np.zeros((len(unique_stages), X.shape[0], X.shape[1]+1, self.model.num_outputs), dtype=self.dtype)
+        thresholds, values, node_sample_weight, base_offset = self.model._compute_arrays(self.dtype)
+        if X.dtype != self.dtype:
+            X = X.astype(self.dtype)
+        _cext.dense_tree_shap(
+            self.model.children_left, self.model.children_right, self.model.children_default,
+            self.model.features, thresholds, values, node_sample_weight,
+            self.model.max_depth, X, X_missing, y, self.data, self.data_missing, num_trees,
+            base_offset, phi, feature_perturbation_codes[self.feature_perturbation],
+            output_transform_codes[self.model.get_transform()], False, _get_num_threads(n_jobs),
+            unique_stages.astype(np.int32), None, None, None, None, self.model.categorical_splits
+        )
+
+        if check_additivity and self.model.model_output == "raw":
+            tolerance = 1e-2 if self.dtype == np.float64 else 5e-2
+            for k, stage_phi in zip(unique_stages, phi):
+                # each stage has its own expected value (the bias column) since it uses fewer trees
+                model_output = self.model.predict(X, tree_limit=int(k), dtype=self.dtype).reshape(X.shape[0], -1)
+                self.assert_additivity(
+                    list(np.moveaxis(stage_phi[:, :-1], -1, 0)), model_output, tolerance=tolerance,
+                    expected_value=stage_phi[0, -1]
+                )
+
+        out = phi[stage_inds][:, :, :-1]
+        if self.model.num_outputs == 1:
+            out = out[..., 0]
+        if flat_output:
+            out = out[:, 0]
         return out
 
+    def _get_path_tables(self):
+        """Build the leaf path tables of all the trees on first use and cache them."""
+        if self._path_tables is None:
+            self._path_tables = _cext.compute_path_tables(
+                self.model.children_left, self.model.children_right, self.model.features,
+                self.model.node_sample_weight, self.model.values.shape[0], _MAX_PATH_TABLE_SIZE
+            )
+        return self._path_tables
+
+    def _get_paths(self):
+        """Extract the root to leaf paths of all the trees on first use and cache them."""
+        if self._paths is None:
+            self._paths = _cext.compute_paths(
+                self.model.children_left, self.model.children_right, self.model.children_default,
+                self.model.features, self.model.thresholds, self.model.node_sample_weight,
+                self.model.values.shape[0]
+            )
+        return self._paths
+
+    def _get_background_cache(self, tree_limit, num_threads):
+        """Precompute what the interventional algorithm needs from the background data and cache it.
+
+        The cache holds the reformatted trees, the path weights, the branch each background
+        sample takes at each node and the model output of each background sample, all for
+        the first ``tree_limit`` trees.
+        """
+        if self._background_cache is None or self._background_cache[0] != tree_limit:
+            thresholds, values, _, base_offset = self.model._compute_arrays(np.float64)
+            self._background_cache = (tree_limit, _cext.compute_background_cache(
+                self.model.children_left, self.model.children_right, self.model.children_default,
+                self.model.features, thresholds, values, self.model.max_depth, self.data,
+                self.data_missing, tree_limit, base_offset, num_threads, self.model.categorical_splits
+            ))
+        return self._background_cache[1]
+
+    def _get_predictions_output(self, predictions, flat_output):
+        """Shape the ``(# samples, # outputs)`` predictions filled in by the C extension like ``TreeEnsemble.predict``."""
+        if self.model.num_outputs == 1:
+            predictions = predictions[:, 0]
+        return predictions[0] if flat_output else predictions
+
     def _get_shap_output(self, phi, flat_output):
         """Pull off the last column of ``phi`` and keep it as our expected_value."""
         if self.model.num_outputs == 1:
@@ -538,13 +1262,15 @@ class TreeExplainer(Explainer):
             out = [-out, out]
         return out
 
-    def shap_interaction_values(self, X, y=None, tree_limit=None):
+    def shap_interaction_values(self, X, y=None, tree_limit=None, chunk_size=None, out=None, top_k=None, n_jobs=None):
         """Estimate the SHAP interaction values for a set of samples.
 
         Parameters
         ----------
-        X : numpy.array, pandas.DataFrame or catboost.Pool (for catboost)
+        X : numpy.array, pandas.DataFrame, scipy.sparse matrix or catboost.Pool (for catboost)
             A matrix of samples (# samples x # features) on which to explain the model's output.
+            Sparse matrices are densified (block by block with ``chunk_size``), since the
+            interaction values are dense anyway.
 
         y : numpy.array
             An array of label values for each sample. Used when explaining loss functions (not yet supported).
@@ -553,6 +1279,29 @@ class TreeExplainer(Explainer):
             Limit the number of trees used by the model. By default, the limit of the original model
             is used (``None``). ``-1`` means no limit.
 
+        chunk_size : None (default) or int
+            Explain ``X`` in blocks of this many rows, so that the peak memory use is that of a
+            single block rather than of the full ``(# samples, # features, # features)`` tensor.
+            When ``out`` or ``top_k`` is given and ``chunk_size`` is None, a block size that
+            keeps each block around 256MB is used.
+
+        out : None (default) or numpy.array / numpy.memmap
+            A preallocated array of the same shape as the returned interaction values (for
+            example a ``np.memmap`` on disk) that the blocks are written into. When given,
+            ``out`` is returned. Cannot be combined with ``top_k``.
+
+        top_k : None (default) or int
+            Only keep the main effect and the ``top_k`` largest magnitude interaction partners
+            of each feature. The result is then returned as a ``scipy.sparse.coo_matrix`` of
+            shape ``(# samples, # features * # features)``, where column ``i * # features + j``
+            holds the interaction between features ``i`` and ``j`` (a list of such matrices, one
+            per output, for models with multiple outputs).
+
+        n_jobs : None (default) or int
+            The number of threads used to explain the samples, as in ``shap_values``. The unique
+            features of each tree, which every sample is conditioned on, are computed once and
+            cached on the model.
+
         Returns
         -------
         np.array
@@ -573,6 +1322,9 @@ class TreeExplainer(Explainer):
                 Return type for models with multiple outputs changed from list to np.ndarray.
 
         """
+        if chunk_size is not None or out is not None or top_k is not None:
+            return self._chunked_shap_interaction_values(X, y, tree_limit, chunk_size, out, top_k, n_jobs)
+
         assert self.model.model_output == "raw", "Only model_output = \"raw\" is supported for SHAP interaction values right now!"
         #assert self.feature_perturbation == "tree_path_dependent", "Only feature_perturbation = \"tree_path_dependent\" is supported for SHAP interaction values right now!"
         transform = "identity"
@@ -627,19 +1379,103 @@ class TreeExplainer(Explainer):
                 return phi[:, :-1, :-1]
 
         X, y, X_missing, flat_output, tree_limit, _ = self._validate_inputs(X, y, tree_limit, False)
+        if scipy.sparse.issparse(X):
+            # the interaction kernel needs dense rows, which are still much smaller than their dense output
+            X = X.toarray()
+            X_missing = np.isnan(X, dtype=bool)
         # run the core algorithm using the C extension
-        assert_import("cext")
         phi = np.zeros((X.shape[0], X.shape[1]+1, X.shape[1]+1, self.model.num_outputs))
+        unique_features = None
+        if feature_perturbation_codes[self.feature_perturbation] == feature_perturbation_codes["tree_path_dependent"]:
+            unique_features = self.model._unique_features()
         _cext.dense_tree_shap(
             self.model.children_left, self.model.children_right, self.model.children_default,
             self.model.features, self.model.thresholds, self.model.values, self.model.node_sample_weight,
             self.model.max_depth, X, X_missing, y, self.data, self.data_missing, tree_limit,
             self.model.base_offset, phi, feature_perturbation_codes[self.feature_perturbation],
-            output_transform_codes[transform], True
+            output_transform_codes[transform], True, _get_num_threads(n_jobs), None, None, None, unique_features,
+            None, self.model.categorical_splits
         )
 
         return self._get_shap_interactions_output(phi, flat_output)
 
+    def iter_shap_interaction_values(self, X, y=None, tree_limit=None, chunk_size=None, top_k=None, n_jobs=None):
+        """Estimate the SHAP interaction values block by block.
+
+        This is a generator version of :meth:`shap_interaction_values` for wide models, where the
+        full interaction tensor does not fit in memory. Only one block of rows is held in memory
+        at any time.
+
+        Parameters
+        ----------
+        X, y, tree_limit, n_jobs
+            See :meth:`shap_interaction_values`.
+
+        chunk_size : None (default) or int
+            The number of rows explained per block. By default a block size that keeps each block
+            around 256MB is used.
+
+        top_k : None (default) or int
+            If given, each block is returned in the sparse top-k layout described in
+            :meth:`shap_interaction_values`.
+
+        Yields
+        ------
+        (slice, np.array or scipy.sparse.coo_matrix)
+            The rows of ``X`` covered by the block and the interaction values for those rows.
+
+        """
+        num_rows, num_features = _num_rows_and_columns(X)
+        if chunk_size is None:
+            chunk_size = self._default_interaction_chunk_size(num_features)
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be a positive integer, got {chunk_size}!")
+
+        for start in range(0, num_rows, chunk_size):
+            rows = slice(start, min(start + chunk_size, num_rows))
+            values = self.shap_interaction_values(
+                _slice_rows(X, rows), None if y is None else y[rows], tree_limit, n_jobs=n_jobs
+            )
+            if top_k is not None:
+                values = _top_k_interactions(values, top_k)
+            yield rows, values
+
+    def _default_interaction_chunk_size(self, num_features):
+        """Pick a block size so each dense block of interaction values is around 256MB."""
+        num_outputs = self.model.num_outputs if hasattr(self.model, "values") else 1
+        bytes_per_row = (num_features + 1) ** 2 * num_outputs * np.dtype(np.float64).itemsize
+        return max(1, (256 * 2**20) // bytes_per_row)
+
+    def _chunked_shap_interaction_values(self, X, y, tree_limit, chunk_size, out, top_k, n_jobs=None):
+        if len(getattr(X, "shape", ())) == 1:
+            raise ValueError("chunk_size, out and top_k require a 2D data matrix X!")
+        if out is not None and top_k is not None:
+            raise ValueError("out and top_k cannot be combined, the top_k values are returned as a sparse matrix!")
+
+        num_rows = _num_rows_and_columns(X)[0]
+        sparse_blocks = []
+        for rows, values in self.iter_shap_interaction_values(X, y, tree_limit, chunk_size, top_k, n_jobs):
+            if top_k is not None:
+                sparse_blocks.append(values)
+                continue
+            if out is None:
+                out = np.empty((num_rows,) + values.shape[1:], dtype=values.dtype)
+            elif out.shape != (num_rows,) + values.shape[1:]:
+                emsg = (
+                    f"The passed `out` array has shape {out.shape} but the interaction values have "
+                    f"shape {(num_rows,) + values.shape[1:]}!"
+                )
+                raise DimensionError(emsg)
+            out[rows] = values
+
+        if top_k is not None:
+            if sparse_blocks and isinstance(sparse_blocks[0], list):
+                return [scipy.sparse.vstack([b[i] for b in sparse_blocks], format="coo") for i in range(len(sparse_blocks[0]))]
+            return scipy.sparse.vstack(sparse_blocks, format="coo")
+        if hasattr(out, "flush"):
+            out.flush()
+        return out
+
     def _get_shap_interactions_output(self, phi, flat_output):
         """Pull off the last column and keep it as our expected_value"""
         if self.model.num_outputs == 1:
@@ -657,11 +1493,13 @@ class TreeExplainer(Explainer):
                 out = np.stack([phi[:, :-1, :-1, i] for i in range(self.model.num_outputs)], axis=-1)
         return out
 
-    def assert_additivity(self, phi, model_output):
+    def assert_additivity(self, phi, model_output, tolerance=1e-2, expected_value=None):
+        if expected_value is None:
+            expected_value = self.expected_value
 
         def check_sum(sum_val, model_output):
             diff = np.abs(sum_val - model_output)
-            if np.max(diff / (np.abs(sum_val) + 1e-2)) > 1e-2:
+            if np.max(diff / (np.abs(sum_val) + 1e-2)) > tolerance:
                 ind = np.argmax(diff)
                 err_msg = "Additivity check failed in TreeExplainer! Please ensure the data matrix you passed to the " \
                           "explainer is the same shape that the model was trained on. If your data shape is correct " \
@@ -675,9 +1513,43 @@ class TreeExplainer(Explainer):
 
         if isinstance(phi, list):
             for i in range(len(phi)):
-                check_sum(self.expected_value[i] + phi[i].sum(-1), model_output[:,i])
+                check_sum(expected_value[i] + phi[i].sum(-1), model_output[:,i])
         else:
-            check_sum(self.expected_value + phi.sum(-1), model_output)
+            check_sum(expected_value + phi.sum(-1), model_output)
+
+    @classmethod
+    def from_compiled(cls, path, data=None, model_output=None, mmap_mode="r", **kwargs):
+        """Build a Tree explainer from a file written by ``TreeEnsemble.save_compiled``.
+
+        The model is not parsed again, the flat tree arrays are memory mapped from the file
+        instead. Many worker processes can then share a single page cached copy of a large
+        model and start up almost instantly.
+
+        Parameters
+        ----------
+        path : str or os.PathLike
+            The file written by ``explainer.model.save_compiled(path)``.
+
+        data : numpy.array or pandas.DataFrame
+            The background dataset, as for the ``TreeExplainer`` constructor. The node sample
+            weights stored in the file are used as they are.
+
+        model_output : None (default) or str
+            The model output to explain. By default this is the ``model_output`` the ensemble
+            was compiled with.
+
+        mmap_mode : "r" (default) or None
+            Memory map the arrays read only, or read them into memory if None.
+
+        **kwargs
+            Any other ``TreeExplainer`` constructor arguments, such as
+            ``feature_perturbation``, ``feature_names`` or ``algorithm``.
+
+        """
+        model = TreeEnsemble.load_compiled(path, mmap_mode=mmap_mode)
+        if model_output is None:
+            model_output = model.model_output
+        return cls(model, data, model_output=model_output, **kwargs)
 
     @staticmethod
     def supports_model_with_masker(model, masker):
@@ -695,6 +1567,71 @@ class TreeExplainer(Explainer):
         return True
 
 
+def _num_rows_and_columns(X):
+    """The shape of a data matrix, including xgboost DMatrix and catboost Pool objects."""
+    if hasattr(X, "num_row") and hasattr(X, "num_col"):
+        return X.num_row(), X.num_col()
+    return X.shape[0], X.shape[1]
+
+
+def _slice_rows(X, rows):
+    """Select a contiguous block of rows from any of the data types TreeExplainer accepts."""
+    if isinstance(X, (pd.DataFrame, pd.Series)):
+        return X.iloc[rows]
+    if safe_isinstance(X, ["xgboost.core.DMatrix", "catboost.core.Pool"]):
+        return X.slice(list(range(rows.start, rows.stop)))
+    return X[rows]
+
+
+def _top_k_attributions(values, top_k):
+    """Select the ``top_k`` largest magnitude SHAP values of every sample (and output).
+
+    ``values`` is of shape ``(# samples, # features[, # outputs])``. Returns the feature indices and
+    the selected values, of shape ``(# samples, top_k[, # outputs])``, ordered by decreasing magnitude.
+    """
+    num_features = values.shape[1]
+    k = min(max(int(top_k), 0), num_features)
+    magnitude = -np.abs(values)
+    if k < num_features:
+        indices = np.argpartition(magnitude, k, axis=1)[:, :k]
+    else:
+        indices = np.broadcast_to(
+            np.arange(num_features).reshape((1, -1) + (1,) * (values.ndim - 2)), values.shape
+        )
+    order = np.argsort(np.take_along_axis(magnitude, indices, axis=1), axis=1, kind="stable")
+    indices = np.take_along_axis(indices, order, axis=1)
+    return indices.astype(np.int32), np.take_along_axis(values, indices, axis=1)
+
+
+def _top_k_interactions(values, top_k):
+    """Sparsify interaction values to the main effects and ``top_k`` strongest partners per feature.
+
+    Returns a ``scipy.sparse.coo_matrix`` of shape ``(# samples, # features * # features)`` (or
+    a list of them, one per output, when ``values`` has an output dimension).
+    """
+    if values.ndim == 4:
+        return [_top_k_interactions(values[..., i], top_k) for i in range(values.shape[-1])]
+
+    num_rows, num_features, _ = values.shape
+    k = min(max(int(top_k), 0), num_features - 1)
+    rows = np.arange(num_rows)[:, None, None]
+    features = np.arange(num_features)[None, :, None]
+
+    # rank the off-diagonal partners of every feature by magnitude (the diagonal always stays)
+    magnitude = np.abs(values)
+    magnitude[:, np.arange(num_features), np.arange(num_features)] = -np.inf
+    if k < num_features - 1:
+        partners = np.argpartition(-magnitude, k, axis=-1)[..., :k]
+    else:
+        partners = np.argsort(-magnitude, axis=-1)[..., :k]
+    partners = np.concatenate([np.broadcast_to(features, (num_rows, num_features, 1)), partners], axis=-1)
+
+    row_ind = np.broadcast_to(rows, partners.shape).ravel()
+    col_ind = (features * num_features + partners).ravel()
+    data = values[rows, features, partners].ravel()
+    return scipy.sparse.coo_matrix((data, (row_ind, col_ind)), shape=(num_rows, num_features * num_features))
+
+
 class TreeEnsemble:
     """An ensemble of decision trees.
 
@@ -716,6 +1653,7 @@ class TreeEnsemble:
         self.tree_limit = None # used for limiting the number of trees we use by default (like from early stopping)
         self.num_stacked_models = 1 # If this is greater than 1 it means we have multiple stacked models with the same number of trees in each model (XGBoost multi-output style)
         self.cat_feature_indices = None # If this is set it tells us which features are treated categorically
+        self.categorical_splits = None # the category sets of the categorical splits, see _categorical_splits
 
         # we use names like keras
         objective_name_map = {
@@ -763,6 +1701,10 @@ class TreeEnsemble:
             self.trees = [SingleTree(t, data=data, data_missing=data_missing) for t in model["trees"]]
         elif isinstance(model, list) and isinstance(model[0], SingleTree): # old-style direct-load format
             self.trees = model
+        elif isinstance(model, TreeEnsemble): # an already built ensemble, e.g. from TreeEnsemble.load_compiled
+            for name, value in vars(model).items():
+                if name not in ("data", "data_missing", "model_output"):
+                    setattr(self, name, value)
         elif safe_isinstance(
             model,
             [
@@ -1261,6 +2203,7 @@ class TreeEnsemble:
 
             self.num_nodes = np.array([len(t.values) for t in self.trees], dtype=np.int32)
             self.max_depth = np.max([t.max_depth for t in self.trees])
+            self.categorical_splits = _categorical_splits(self.trees, max_nodes)
 
             # make sure the base offset is a 1D array
             if not hasattr(self.base_offset, "__len__") or len(self.base_offset) == 0:
@@ -1300,6 +2243,10 @@ class TreeEnsemble:
             assert hasattr(self, "_xgboost_n_outputs")
             return self._xgboost_n_outputs
 
+        # ensembles loaded with load_compiled only have the flat arrays
+        if self.trees is None and hasattr(self, "values"):
+            return self.values.shape[2]
+
         if self.num_stacked_models > 1:
             if len(self.trees) % self.num_stacked_models != 0:
                 raise ValueError(
@@ -1349,7 +2296,7 @@ class TreeEnsemble:
 
         return transform
 
-    def predict(self, X, y=None, output=None, tree_limit=None):
+    def predict(self, X, y=None, output=None, tree_limit=None, dtype=np.float64):
         """A consistent interface to make predictions from this model.
 
         Parameters
@@ -1358,6 +2305,9 @@ class TreeEnsemble:
             Limit the number of trees used by the model. By default None means no use the limit of the
             original model, and -1 means no limit.
 
+        dtype : np.float64 (default) or np.float32
+            The floating point precision the trees are evaluated in.
+
         """
         if output is None:
             output = self.model_output
@@ -1380,14 +2330,20 @@ class TreeEnsemble:
         if isinstance(X, (pd.Series, pd.DataFrame)):
             X = X.values
         flat_output = False
-        if len(X.shape) == 1:
-            flat_output = True
-            X = X.reshape(1, X.shape[0])
-        if X.dtype.type != self.input_dtype:
-            X = X.astype(self.input_dtype)
-        X_missing = np.isnan(X, dtype=bool)
-        assert isinstance(X, np.ndarray), "Unknown instance type: " + str(type(X))
-        assert len(X.shape) == 2, "Passed input data matrix X must have 1 or 2 dimensions!"
+        features = self.features
+        if scipy.sparse.issparse(X):
+            # CSR inputs are only evaluated in double precision
+            dtype = np.float64
+            X_missing = None
+        else:
+            if len(X.shape) == 1:
+                flat_output = True
+                X = X.reshape(1, X.shape[0])
+            if X.dtype.type != self.input_dtype:
+                X = X.astype(self.input_dtype)
+            X_missing = np.isnan(X, dtype=bool)
+            assert isinstance(X, np.ndarray), "Unknown instance type: " + str(type(X))
+            assert len(X.shape) == 2, "Passed input data matrix X must have 1 or 2 dimensions!"
 
         if tree_limit < 0 or tree_limit > self.values.shape[0]:
             tree_limit = self.values.shape[0]
@@ -1396,13 +2352,18 @@ class TreeEnsemble:
             assert y is not None, "Both samples and labels must be provided when explaining the loss (i.e. `explainer.shap_values(X, y)`)!"
             assert X.shape[0] == len(y), "The number of labels (%d) does not match the number of samples to explain (%d)!" % (len(y), X.shape[0])
         transform = self.get_transform()
-        assert_import("cext")
-        output = np.zeros((X.shape[0], self.num_outputs))
+        output = np.zeros((X.shape[0], self.num_outputs), dtype=dtype)
+        thresholds, values, _, base_offset = self._compute_arrays(dtype)
+        if X_missing is None:
+            _, features = self._compact_features()
+            X = self._csr_input(X)
+        elif X.dtype != dtype:
+            X = X.astype(dtype)
         _cext.dense_tree_predict(
             self.children_left, self.children_right, self.children_default,
-            self.features, self.thresholds, self.values,
-            self.max_depth, tree_limit, self.base_offset, output_transform_codes[transform],
-            X, X_missing, y, output
+            features, thresholds, values,
+            self.max_depth, tree_limit, base_offset, output_transform_codes[transform],
+            X, X_missing, y, output, self.categorical_splits
         )
 
         # drop dimensions we don't need
@@ -1417,6 +2378,255 @@ class TreeEnsemble:
             else:
                 return output
 
+    def predict_leaves(self, X, tree_limit=None, n_jobs=None):
+        """Return the index of the leaf each sample lands in, for each tree.
+
+        Parameters
+        ----------
+        X : numpy.array, pandas.DataFrame or scipy.sparse matrix
+            A matrix of samples (# samples x # features), or a single sample.
+
+        tree_limit : None (default) or int
+            Limit the number of trees used by the model, as in ``predict``.
+
+        n_jobs : None (default) or int
+            The number of threads used to walk the trees, as in ``TreeExplainer.shap_values``.
+
+        Returns
+        -------
+        np.array
+            An int32 array of shape ``(# samples x # trees)`` (``(# trees,)`` for a single sample),
+            holding the node index of the leaf within each tree, so ``values[j, leaves[i, j]]`` is
+            what tree ``j`` adds to the output for sample ``i``.
+
+        """
+        if tree_limit is None:
+            tree_limit = -1 if self.tree_limit is None else self.tree_limit
+        if tree_limit < 0 or tree_limit > self.values.shape[0]:
+            tree_limit = self.values.shape[0]
+
+        # sparse inputs are walked in blocks of dense rows
+        if scipy.sparse.issparse(X):
+            X = scipy.sparse.csr_matrix(X)
+            blocks = [
+                self.predict_leaves(X[start:start + _SPARSE_LEAVES_BLOCK_SIZE].toarray(), tree_limit, n_jobs)
+                for start in range(0, X.shape[0], _SPARSE_LEAVES_BLOCK_SIZE)
+            ]
+            return np.concatenate(blocks) if blocks else np.zeros((0, tree_limit), dtype=np.int32)
+
+        if isinstance(X, (pd.Series, pd.DataFrame)):
+            X = X.values
+        flat_output = len(X.shape) == 1
+        if flat_output:
+            X = X.reshape(1, X.shape[0])
+        # cast to the input dtype first so the thresholds compare exactly as the model does
+        if X.dtype.type != self.input_dtype:
+            X = X.astype(self.input_dtype)
+        X_missing = np.isnan(X, dtype=bool)
+
+        leaves = np.zeros((X.shape[0], tree_limit), dtype=np.int32)
+        _cext.dense_tree_predict_leaves(
+            self.children_left, self.children_right, self.children_default, self.features, self.thresholds,
+            tree_limit, X.astype(np.float64), X_missing, leaves, _get_num_threads(n_jobs), self.categorical_splits
+        )
+        return leaves[0] if flat_output else leaves
+
+    def save_compiled(self, path):
+        """Save the flat tree arrays to a file that ``load_compiled`` can memory map.
+
+        Parameters
+        ----------
+        path : str or os.PathLike
+            The file to write. It holds a small JSON header followed by the raw
+            ``children_left``, ``children_right``, ``children_default``, ``features``,
+            ``thresholds``, ``values`` and ``node_sample_weight`` arrays.
+
+        """
+        if not hasattr(self, "values"):
+            raise ValueError("Only ensembles that were parsed into flat tree arrays can be compiled!")
+        if self.categorical_splits is not None or (
+            self.cat_feature_indices is not None and len(self.cat_feature_indices) > 0
+        ):
+            raise ValueError("Ensembles with categorical splits can not be compiled!")
+
+        header = {
+            "version": _COMPILED_VERSION,
+            "internal_dtype": np.dtype(self.internal_dtype).str,
+            "input_dtype": np.dtype(self.input_dtype).str,
+            "attributes": {name: getattr(self, name) for name in _COMPILED_ATTRIBUTES},
+            "arrays": {},
+        }
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in _COMPILED_ARRAYS}
+        offset = 0
+        for name, array in arrays.items():
+            offset = -(-offset // _COMPILED_ALIGNMENT) * _COMPILED_ALIGNMENT
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += array.nbytes
+        # the attributes can be numpy scalars (like max_depth), which JSON does not know about
+        header_bytes = json.dumps(header, default=lambda value: value.item()).encode("utf-8")
+
+        with open(path, "wb") as f:
+            f.write(_COMPILED_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            start = f.tell()
+            for name, array in arrays.items():
+                f.write(b"\0" * (start + header["arrays"][name]["offset"] - f.tell()))
+                f.write(array.tobytes())
+
+    @classmethod
+    def load_compiled(cls, path, mmap_mode="r"):
+        """Load an ensemble written by ``save_compiled`` without parsing the original model.
+
+        Parameters
+        ----------
+        path : str or os.PathLike
+            The file written by ``save_compiled``.
+
+        mmap_mode : "r" (default) or None
+            Memory map the arrays read only, so many processes share one page cached copy,
+            or read them into memory if None.
+
+        """
+        with open(path, "rb") as f:
+            if f.read(len(_COMPILED_MAGIC)) != _COMPILED_MAGIC:
+                raise ValueError(f"{os.fspath(path)} is not a compiled TreeEnsemble file!")
+            header_size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_size).decode("utf-8"))
+        if header["version"] != _COMPILED_VERSION:
+            raise ValueError(f"Unsupported compiled TreeEnsemble version {header['version']}!")
+
+        if mmap_mode is None:
+            buffer = np.fromfile(path, dtype=np.uint8)
+        else:
+            buffer = np.memmap(path, dtype=np.uint8, mode=mmap_mode)
+        start = len(_COMPILED_MAGIC) + 8 + header_size
+
+        ensemble = cls.__new__(cls)
+        ensemble.model_type = "internal"
+        ensemble.trees = None
+        ensemble.data = None
+        ensemble.data_missing = None
+        ensemble.cat_feature_indices = None
+        ensemble.categorical_splits = None
+        ensemble.internal_dtype = np.dtype(header["internal_dtype"]).type
+        ensemble.input_dtype = np.dtype(header["input_dtype"]).type
+        for name, value in header["attributes"].items():
+            setattr(ensemble, name, value)
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            begin = start + spec["offset"]
+            end = begin + dtype.itemsize * int(np.prod(spec["shape"]))
+            setattr(ensemble, name, buffer[begin:end].view(dtype).reshape(spec["shape"]))
+        return ensemble
+
+    def _set_background_weights(self, data, data_missing, weights=None):
+        """Replace the node weights with the (weighted) fraction of the background samples reaching each node.
+
+        The model's own node weights, scaled down to ``_BACKGROUND_PRIOR_WEIGHT`` times the smallest
+        sample weight, are added as a prior, so subtrees no background sample reaches keep the
+        proportions of the training data. The internal node values and ``max_depth`` are then
+        recomputed as the expectations under the new weights.
+        """
+        if weights is None:
+            weights = np.full(data.shape[0], 1.0 / data.shape[0])
+        num_trees = self.values.shape[0]
+        background = np.zeros(self.children_left.shape, dtype=np.float64)
+        _cext.dense_tree_update_weights(
+            self.children_left, self.children_right, self.children_default, self.features,
+            self.thresholds, self.values, num_trees, background, data, data_missing, weights,
+            self.categorical_splits
+        )
+
+        prior = np.zeros_like(background)
+        if getattr(self, "node_sample_weight", None) is not None:
+            root_weight = self.node_sample_weight[:, :1]
+            np.divide(self.node_sample_weight, root_weight, out=prior, where=root_weight > 0)
+        in_tree = np.arange(background.shape[1]) < self.num_nodes[:, None]
+        if np.any(in_tree & (background <= 0) & (prior <= 0)):
+            raise ExplainerError(
+                "The background dataset does not reach every leaf of the model, and the model does not "
+                "record how many training samples reached them either, so feature_perturbation="
+                "\"background_path_dependent\" cannot be used! Try a larger background dataset or "
+                "feature_perturbation=\"interventional\"."
+            )
+        self.node_sample_weight = background + _BACKGROUND_PRIOR_WEIGHT * weights[weights > 0].min() * prior
+        self.fully_defined_weighting = True
+
+        # the values may be shared with another ensemble (or be a read only memory map)
+        self.values = np.array(self.values, dtype=np.float64)
+        self.max_depth = max(
+            _cext.compute_expectations(
+                self.children_left[i], self.children_right[i], self.node_sample_weight[i], self.values[i]
+            )
+            for i in range(num_trees)
+        )
+        self._float32_arrays = None
+
+    def _unique_features(self):
+        """Return the features each tree splits on, one row per tree in order of first use, padded with -1.
+
+        These are the features the SHAP interaction values condition on, so they are computed once
+        and cached instead of being searched for in every call.
+        """
+        if getattr(self, "_unique_feature_array", None) is None:
+            rows = []
+            for features, children_left in zip(self.features, self.children_left):
+                split_features = features[children_left >= 0]
+                unique, first_use = np.unique(split_features, return_index=True)
+                rows.append(unique[np.argsort(first_use)])
+            unique_features = np.full((len(rows), max([len(r) for r in rows] + [1])), -1, dtype=np.int32)
+            for i, row in enumerate(rows):
+                unique_features[i, :len(row)] = row
+            self._unique_feature_array = unique_features
+        return self._unique_feature_array
+
+    def _compact_features(self):
+        """Return the sorted features the trees split on, and ``features`` renumbered to index into them.
+
+        Sparse inputs only keep these columns, so the dense row blocks the C extension expands
+        them into are only as wide as the model needs.
+        """
+        if getattr(self, "_compact_feature_arrays", None) is None:
+            splits = self.children_left >= 0
+            used_features = np.unique(self.features[splits])
+            features = self.features.copy()
+            features[splits] = np.searchsorted(used_features, self.features[splits])
+            self._compact_feature_arrays = (used_features, features)
+        return self._compact_feature_arrays
+
+    def _csr_input(self, X):
+        """Pack the used columns of a sparse matrix as the ``(data, indices, indptr, # columns)`` tuple the C extension takes."""
+        used_features, _ = self._compact_features()
+        X = scipy.sparse.csr_matrix(X)[:, used_features]
+        if X.nnz >= 2**31:
+            raise ValueError("Sparse inputs with 2**31 or more stored entries are not supported!")
+        # cast to the input dtype first so the thresholds compare exactly as the model does
+        data = X.data.astype(self.input_dtype).astype(np.float64)
+        return data, X.indices.astype(np.int32), X.indptr.astype(np.int32), len(used_features)
+
+    def _compute_arrays(self, dtype):
+        """Return the (thresholds, values, node_sample_weight, base_offset) arrays in the given precision.
+
+        The float32 copies are made once and cached. Thresholds are rounded down, so that
+        ``x <= threshold`` picks the same branch as in double precision for every float32 ``x``.
+        """
+        node_sample_weight = getattr(self, "node_sample_weight", None)
+        if np.dtype(dtype) == np.float64:
+            return self.thresholds, self.values, node_sample_weight, self.base_offset
+
+        if getattr(self, "_float32_arrays", None) is None:
+            thresholds = self.thresholds.astype(np.float32)
+            rounded_up = thresholds > self.thresholds
+            thresholds[rounded_up] = np.nextafter(thresholds[rounded_up], np.float32(-np.inf))
+            self._float32_arrays = (
+                thresholds,
+                self.values.astype(np.float32),
+                None if node_sample_weight is None else node_sample_weight.astype(np.float32),
+                np.asarray(self.base_offset, dtype=np.float32),
+            )
+        return self._float32_arrays
+
 
 class SingleTree:
     """A single decision tree.
@@ -1462,11 +2672,16 @@ class SingleTree:
     max_depth : int
         The max depth of the tree.
 
+    categories : list or None
+        None if the tree only has numerical splits. Otherwise a list of length #nodes holding
+        the categories of each categorical split, which send the samples whose category (the
+        integer part of the feature value) is one of them to the left child, and None for the
+        numerical splits and leaves.
+
     """
 
     def __init__(self, tree, normalize=False, scaling=1.0, data=None, data_missing=None):
-        assert_import("cext")
-
+        self.categories = None
         if safe_isinstance(tree, ["sklearn.tree._tree.Tree", "econml.tree._tree.Tree"]):
             self.children_left = tree.children_left.astype(np.int32)
             self.children_right = tree.children_right.astype(np.int32)
@@ -1485,8 +2700,10 @@ class SingleTree:
             self.children_default = tree["children_default"].astype(np.int32)
             self.features = tree["features"].astype(np.int32)
             self.thresholds = tree["thresholds"]
-            self.values = tree["values"] * scaling
+            # compute_expectations fills in the internal nodes in place, so this must already be float64
+            self.values = np.asarray(tree["values"] * scaling, dtype=np.float64)
             self.node_sample_weight = tree["node_sample_weight"]
+            self.categories = tree.get("categories", None)
 
         # deprecated dictionary support (with sklearn singular style "feature" and "value" names)
         elif isinstance(tree, dict) and "children_left" in tree:
@@ -1495,8 +2712,10 @@ class SingleTree:
             self.children_default = tree["children_default"].astype(np.int32)
             self.features = tree["feature"].astype(np.int32)
             self.thresholds = tree["threshold"]
-            self.values = tree["value"] * scaling
+            # compute_expectations fills in the internal nodes in place, so this must already be float64
+            self.values = np.asarray(tree["value"] * scaling, dtype=np.float64)
             self.node_sample_weight = tree["node_sample_weight"]
+            self.categories = tree.get("categories", None)
 
         elif safe_isinstance(
             tree,
@@ -1594,7 +2813,14 @@ class SingleTree:
                         self.children_default[vsplit_idx] = self.children_right[vsplit_idx]
 
                     self.features[vsplit_idx] = vertex["split_feature"]
-                    self.thresholds[vsplit_idx] = vertex["threshold"]
+                    if vertex["decision_type"] == "==":
+                        # categorical splits send the categories in the "||" separated list to the left
+                        if self.categories is None:
+                            self.categories = [None] * num_nodes
+                        self.categories[vsplit_idx] = [int(c) for c in str(vertex["threshold"]).split("||")]
+                        self.thresholds[vsplit_idx] = 0
+                    else:
+                        self.thresholds[vsplit_idx] = vertex["threshold"]
                     self.values[vsplit_idx] = [vertex["internal_value"]]
                     self.node_sample_weight[vsplit_idx] = vertex["internal_count"]
                     visited.append(vsplit_idx)
@@ -1720,9 +2946,13 @@ class SingleTree:
         # Re-compute the number of samples that pass through each node if we are given data
         if data is not None and data_missing is not None:
             self.node_sample_weight.fill(0.0)
+            categorical_splits = _categorical_splits([self], len(self.children_left))
+            if categorical_splits is not None:
+                categorical_splits = (categorical_splits[0][0], categorical_splits[1])
             _cext.dense_tree_update_weights(
                 self.children_left, self.children_right, self.children_default, self.features,
-                self.thresholds, self.values, 1, self.node_sample_weight, data, data_missing
+                self.thresholds, self.values, 1, self.node_sample_weight, data, data_missing, None,
+                categorical_splits
             )
 
         # we compute the expectations to make sure they follow the SHAP logic
@@ -1843,21 +3073,6 @@ class XGBTreeModelLoader:
         trees = booster["model"]["trees"]
         self.num_trees = len(trees)
 
-        self.node_parents = []
-        self.node_cleft = []
-        self.node_cright = []
-        self.node_sindex = []
-        self.children_default: list[np.ndarray] = []
-        self.sum_hess = []
-
-        self.values = []
-        self.thresholds = []
-        self.features = []
-
-        # Categorical features, not supported by the SHAP package yet.
-        self.split_types = []
-        self.categories = []
-
         feature_types = model.feature_types
         if feature_types is not None:
             cat_feature_indices: np.ndarray = np.where(
@@ -1870,66 +3085,76 @@ class XGBTreeModelLoader:
         else:
             self.cat_feature_indices = None
 
-        def to_integers(data: list[int]) -> np.ndarray:
-            """Handle u8 array from UBJSON."""
-            assert isinstance(data, list)
-            return np.asanyarray(data, dtype=np.uint8)
-
-        for i in range(self.num_trees):
-            tree = trees[i]
-            parents = np.asarray(tree["parents"])
-            self.node_parents.append(parents)
-            self.node_cleft.append(np.asarray(tree["left_children"], dtype=np.int32))
-            self.node_cright.append(np.asarray(tree["right_children"], dtype=np.int32))
-            self.node_sindex.append(np.asarray(tree["split_indices"], dtype=np.uint32))
-
-            base_weight = np.asarray(tree["base_weights"], dtype=np.float32)
-            if base_weight.size != self.node_cleft[-1].size:
-                raise ValueError("vector-leaf is not yet supported.")
-
-            default_left = to_integers(tree["default_left"])
-            default_child = np.where(
-                default_left == 1, self.node_cleft[-1], self.node_cright[-1]
-            ).astype(np.int64)
-            self.children_default.append(default_child)
-            self.sum_hess.append(np.asarray(tree["sum_hessian"], dtype=np.float64))
-
-            is_leaf = self.node_cleft[-1] == -1
-
-            # XGBoost stores split condition and leaf weight in the same field.
-            split_cond = np.asarray(tree["split_conditions"], dtype=np.float32)
-            leaf_weight = np.where(is_leaf, split_cond, 0.0)
-            thresholds = np.where(is_leaf, 0.0, split_cond)
-
-            # Xgboost uses < for thresholds where shap uses <= Move the threshold down
-            # by the smallest possible increment
-            thresholds = np.where(
-                is_leaf, 0.0, np.nextafter(thresholds, -np.float32(np.inf))
-            )
-
-            self.values.append(leaf_weight.reshape(leaf_weight.size, 1))
-            self.thresholds.append(thresholds)
-
-            split_idx = np.asarray(tree["split_indices"], dtype=np.int64)
-            self.features.append(split_idx)
+        # The nodes of all the trees are concatenated into one buffer per field, so the per
+        # node work below is vectorized over the whole model and each tree is a slice of it.
+        tree_sizes = np.array([len(tree["left_children"]) for tree in trees], dtype=np.int64)
+        tree_ends = np.cumsum(tree_sizes).tolist()
+        tree_begins = [0] + tree_ends[:-1]
+
+        def concatenate(name: str, dtype) -> np.ndarray:
+            if self.num_trees == 0:
+                return np.empty(0, dtype=dtype)
+            return np.concatenate([np.asarray(tree[name], dtype=dtype) for tree in trees])
+
+        def split(array: np.ndarray) -> list[np.ndarray]:
+            return [array[begin:end] for begin, end in zip(tree_begins, tree_ends)]
+
+        node_cleft = concatenate("left_children", np.int32)
+        node_cright = concatenate("right_children", np.int32)
+        self.node_parents = split(concatenate("parents", np.int32))
+        self.node_cleft = split(node_cleft)
+        self.node_cright = split(node_cright)
+        self.node_sindex = split(concatenate("split_indices", np.uint32))
+
+        base_weight_sizes = np.array([len(tree["base_weights"]) for tree in trees], dtype=np.int64)
+        if np.any(base_weight_sizes != tree_sizes):
+            raise ValueError("vector-leaf is not yet supported.")
+
+        # when ubjson is used, this is a byte array with each element as uint8
+        default_left = concatenate("default_left", np.uint8)
+        children_default = np.where(default_left == 1, node_cleft, node_cright).astype(np.int64)
+        self.children_default: list[np.ndarray] = split(children_default)
+        self.sum_hess = split(concatenate("sum_hessian", np.float64))
+
+        is_leaf = node_cleft == -1
+
+        # XGBoost stores split condition and leaf weight in the same field.
+        split_cond = concatenate("split_conditions", np.float32)
+        leaf_weight = np.where(is_leaf, split_cond, 0.0)
+
+        # Xgboost uses < for thresholds where shap uses <= Move the threshold down
+        # by the smallest possible increment
+        thresholds = np.where(
+            is_leaf, 0.0, np.nextafter(split_cond, -np.float32(np.inf))
+        )
 
-            # - categorical features
-            # when ubjson is used, this is a byte array with each element as uint8
-            split_types = to_integers(tree["split_type"])
-            self.split_types.append(split_types)
-            # categories for each node is stored in a CSR style storage with segment as
-            # the begin ptr and the `categories' as values.
-            cat_segments: list[int] = tree["categories_segments"]
-            cat_sizes: list[int] = tree["categories_sizes"]
+        self.values = split(leaf_weight.reshape(leaf_weight.size, 1))
+        self.thresholds = split(thresholds)
+        self.features = split(concatenate("split_indices", np.int64))
+
+        # 0 for numerical splits and 1 for categorical splits, see get_trees
+        self.split_types = split(concatenate("split_type", np.uint8))
+        # categories for each node is stored in a CSR style storage with segment as
+        # the begin ptr and the `categories' as values. They are only parsed on first use.
+        self._categories = None
+        self._raw_categories = []
+        for tree in trees:
             # node index for categorical nodes
-            cat_nodes: list[int] = tree["categories_nodes"]
-            assert len(cat_segments) == len(cat_sizes) == len(cat_nodes)
-            cats = tree["categories"]
-
-            tree_categories = self.parse_categories(
-                cat_nodes, cat_segments, cat_sizes, cats, self.node_cleft[-1]
+            cat_nodes = tree["categories_nodes"]
+            assert len(tree["categories_segments"]) == len(tree["categories_sizes"]) == len(cat_nodes)
+            self._raw_categories.append(
+                (cat_nodes, tree["categories_segments"], tree["categories_sizes"], tree["categories"])
             )
-            self.categories.append(tree_categories)
+
+    @property
+    def categories(self) -> list[list[list[int]]]:
+        """The categories of each node of each tree, an empty list for numerical splits and leaves."""
+        if self._categories is None:
+            self._categories = [
+                self.parse_categories(cat_nodes, cat_segments, cat_sizes, cats, left_children)
+                for (cat_nodes, cat_segments, cat_sizes, cats), left_children in zip(self._raw_categories, self.node_cleft)
+            ]
+        return self._categories
 
     @staticmethod
     def parse_categories(
@@ -1943,37 +3168,18 @@ class XGBTreeModelLoader:
         node. Returns a list, in which each element is a list of categories for tree
         split. For a numerical split, the list is empty.
 
-        This is not used yet, only implemented for future reference.
-
         """
         # The storage for categories is only defined for categorical nodes to prevent
-        # unnecessary overhead for numerical splits, we track the categorical node that
-        # are processed using a counter.
-        cat_cnt = 0
-        if cat_nodes:
-            last_cat_node = cat_nodes[cat_cnt]
-        else:
-            last_cat_node = -1
-        node_categories: list[list[int]] = []
-        for node_id in range(len(left_children)):
-            if node_id == last_cat_node:
-                beg = cat_segments[cat_cnt]
-                size = cat_sizes[cat_cnt]
-                end = beg + size
-                # categories for this node
-                node_cats = cats[beg:end]
-                # categories are unique for each node
-                assert len(set(node_cats)) == len(node_cats)
-                cat_cnt += 1
-                if cat_cnt == len(cat_nodes):
-                    last_cat_node = -1  # continue to process the rest of the nodes
-                else:
-                    last_cat_node = cat_nodes[cat_cnt]
-                assert node_cats
-                node_categories.append(node_cats)
-            else:
-                # append an empty node, it's either a numerical node or a leaf.
-                node_categories.append([])
+        # unnecessary overhead for numerical splits, so every other node (a numerical
+        # split or a leaf) keeps an empty list.
+        node_categories: list[list[int]] = [[] for _ in range(len(left_children))]
+        for node_id, beg, size in zip(cat_nodes, cat_segments, cat_sizes):
+            # categories for this node
+            node_cats = [int(c) for c in cats[beg:beg + size]]
+            # categories are unique for each node
+            assert len(set(node_cats)) == len(node_cats)
+            assert node_cats
+            node_categories[node_id] = node_cats
         return node_categories
 
     def get_trees(self, data=None, data_missing=None) -> list[SingleTree]:
@@ -1988,6 +3194,14 @@ class XGBTreeModelLoader:
                 "value": self.values[i],
                 "node_sample_weight": self.sum_hess[i],
             }
+            is_categorical = self.split_types[i] == 1
+            if np.any(is_categorical):
+                # XGBoost sends the categories of a split to the right (and all others, including the
+                # invalid ones, to the left), so the children are swapped to send them left instead
+                info["children_left"] = np.where(is_categorical, self.node_cright[i], self.node_cleft[i])
+                info["children_right"] = np.where(is_categorical, self.node_cleft[i], self.node_cright[i])
+                info["threshold"] = np.where(is_categorical, 0.0, self.thresholds[i])
+                info["categories"] = [categories or None for categories in self.categories[i]]
             trees.append(SingleTree(info, data=data, data_missing=data_missing))
         return trees
 
@@ -0,0 +1,758 @@
+"""Numba versions of the Tree SHAP kernels of the C extension.
+
+``TreeExplainer`` uses this module in place of ``shap._cext`` when the C extension was not
+built, so the functions here take the same arguments as their ``_cext`` counterparts and fill
+the same output arrays. Only the kernels behind the default ``algorithm="recursive"`` are
+provided (path dependent and interventional SHAP values, path dependent interaction values,
+Saabas and depth truncated values, predictions and leaf indices, and the node weight and
+expectation updates), for models with numerical splits only. The predictions requested
+alongside SHAP values are computed in a separate pass. They run in a single thread and are
+compiled on first use, in the precision of the model arrays.
+"""
+import math
+
+import numpy as np
+import scipy.sparse
+from numba import njit
+
+from ..utils._exceptions import ExplainerError
+
+FEATURE_DEPENDENCE_INDEPENDENT = 0
+FEATURE_DEPENDENCE_TREE_PATH_DEPENDENT = 1
+
+# rows of a CSR input expanded into a dense block at a time
+_CSR_BLOCK_SIZE = 256
+
+# the exact_depth of untruncated trees
+_NO_TRUNCATION = 2**62
+
+
+@njit
+def _transform(model_transform, margin, y):
+    """The output transforms of the C extension (identity, logistic, logistic_nlogloss, squared_loss)."""
+    if model_transform == 1:
+        return 1 / (1 + math.exp(-margin))
+    elif model_transform == 2:
+        return math.log(1 + math.exp(margin)) - y * margin
+    elif model_transform == 3:
+        return (margin - y) * (margin - y)
+    return margin
+
+
+@njit
+def _next_node(children_left, children_right, children_default, node, feature, threshold, x, x_missing):
+    if x_missing[feature]:
+        return children_default[node]
+    elif x[feature] <= threshold:
+        return children_left[node]
+    return children_right[node]
+
+
+@njit
+def _tree_predict(children_left, children_right, children_default, features, thresholds, x, x_missing):
+    """Return the index of the leaf ``x`` lands in."""
+    node = 0
+    while children_left[node] >= 0:
+        node = _next_node(
+            children_left, children_right, children_default, node, features[node], thresholds[node], x, x_missing
+        )
+    return node
+
+
+@njit(nogil=True)
+def _dense_tree_predict(children_left, children_right, children_default, features, thresholds, values,
+                        tree_limit, base_offset, model_transform, X, X_missing, y, has_y, out):
+    for i in range(X.shape[0]):
+        for k in range(values.shape[2]):
+            out[i, k] += base_offset[k]
+        for j in range(tree_limit):
+            leaf = _tree_predict(
+                children_left[j], children_right[j], children_default[j], features[j], thresholds[j], X[i], X_missing[i]
+            )
+            for k in range(values.shape[2]):
+                out[i, k] += values[j, leaf, k]
+        if model_transform != 0:
+            y_i = y[i] if has_y else 0.0
+            for k in range(values.shape[2]):
+                out[i, k] = _transform(model_transform, out[i, k], y_i)
+
+
+@njit(nogil=True)
+def _dense_tree_predict_leaves(children_left, children_right, children_default, features, thresholds, tree_limit,
+                               X, X_missing, out_leaves):
+    for i in range(X.shape[0]):
+        for j in range(tree_limit):
+            out_leaves[i, j] = _tree_predict(
+                children_left[j], children_right[j], children_default[j], features[j], thresholds[j], X[i], X_missing[i]
+            )
+
+
+@njit(nogil=True)
+def _dense_tree_update_weights(children_left, children_right, children_default, features, thresholds,
+                               tree_limit, node_sample_weight, X, X_missing, weights):
+    for i in range(X.shape[0]):
+        for j in range(tree_limit):
+            node = 0
+            while True:
+                node_sample_weight[j, node] += weights[i]
+                if children_left[j, node] < 0:
+                    break
+                node = _next_node(
+                    children_left[j], children_right[j], children_default[j], node, features[j, node],
+                    thresholds[j, node], X[i], X_missing[i]
+                )
+
+
+@njit
+def _compute_expectations(children_left, children_right, node_sample_weight, values, i, depth):
+    max_depth = 0
+    if children_right[i] >= 0:
+        li = np.int64(children_left[i])
+        ri = np.int64(children_right[i])
+        depth_left = _compute_expectations(children_left, children_right, node_sample_weight, values, li, depth + 1)
+        depth_right = _compute_expectations(children_left, children_right, node_sample_weight, values, ri, depth + 1)
+        left_weight = node_sample_weight[li]
+        right_weight = node_sample_weight[ri]
+        for j in range(values.shape[1]):
+            if left_weight == 0 and right_weight == 0:
+                values[i, j] = 0.0
+            else:
+                values[i, j] = (left_weight * values[li, j] + right_weight * values[ri, j]) / (left_weight + right_weight)
+        max_depth = max(depth_left, depth_right) + 1
+    return max_depth
+
+
+@njit
+def _tree_saabas(children_left, children_right, children_default, features, thresholds, values,
+                 node_sample_weight, x, x_missing, phi, start_depth, error_estimate):
+    """Credit the splits at ``start_depth`` or below on the path of ``x``, see ``tree_saabas`` in tree_shap.h.
+
+    The absolute credits times the fraction of the training data that does not reach the split are added to
+    ``error_estimate``.
+    """
+    node = 0
+    depth = 0
+    root_weight = node_sample_weight[0]
+    while children_left[node] >= 0:
+        feature = features[node]
+        next_node = _next_node(
+            children_left, children_right, children_default, node, feature, thresholds[node], x, x_missing
+        )
+        # credit the feature with the change in the expected value from this node to the next
+        if depth >= start_depth:
+            outside_fraction = 1 - node_sample_weight[node] / root_weight if root_weight > 0 else 0.0
+            for k in range(values.shape[1]):
+                credit = values[next_node, k] - values[node, k]
+                phi[feature, k] += credit
+                error_estimate[k] += abs(credit) * outside_fraction
+        node = next_node
+        depth += 1
+
+
+@njit(nogil=True)
+def _dense_tree_saabas(children_left, children_right, children_default, features, thresholds, values,
+                       tree_limit, base_offset, X, X_missing, out_contribs):
+    M = X.shape[1]
+    # the error estimate is not used here, so any node weights will do
+    unit_weights = np.ones(children_left.shape[1], dtype=values.dtype)
+    error_estimate = np.zeros(values.shape[2], dtype=values.dtype)
+    for i in range(X.shape[0]):
+        for j in range(tree_limit):
+            _tree_saabas(
+                children_left[j], children_right[j], children_default[j], features[j], thresholds[j], values[j],
+                unit_weights, X[i], X_missing[i], out_contribs[i], 0, error_estimate
+            )
+        for k in range(values.shape[2]):
+            out_contribs[i, M, k] += base_offset[k]
+
+
+# The path dependent algorithm, see tree_shap_recursive in tree_shap.h. The unique path is kept in four
+# parallel arrays (feature index, zero fraction, one fraction and permutation weight) and each level of
+# the recursion copies its parent's path to the next free slots.
+
+@njit
+def _extend_path(feature_index, zero_fraction, one_fraction, pweight, offset, unique_depth,
+                 new_zero_fraction, new_one_fraction, new_feature_index):
+    feature_index[offset + unique_depth] = new_feature_index
+    zero_fraction[offset + unique_depth] = new_zero_fraction
+    one_fraction[offset + unique_depth] = new_one_fraction
+    pweight[offset + unique_depth] = 1.0 if unique_depth == 0 else 0.0
+    for i in range(unique_depth - 1, -1, -1):
+        pweight[offset + i + 1] += new_one_fraction * pweight[offset + i] * (i + 1) / (unique_depth + 1)
+        pweight[offset + i] = new_zero_fraction * pweight[offset + i] * (unique_depth - i) / (unique_depth + 1)
+
+
+@njit
+def _unwind_path(feature_index, zero_fraction, one_fraction, pweight, offset, unique_depth, path_index):
+    one = one_fraction[offset + path_index]
+    zero = zero_fraction[offset + path_index]
+    next_one_portion = pweight[offset + unique_depth]
+    for i in range(unique_depth - 1, -1, -1):
+        if one != 0:
+            tmp = pweight[offset + i]
+            pweight[offset + i] = next_one_portion * (unique_depth + 1) / ((i + 1) * one)
+            next_one_portion = tmp - pweight[offset + i] * zero * (unique_depth - i) / (unique_depth + 1)
+        else:
+            pweight[offset + i] = pweight[offset + i] * (unique_depth + 1) / (zero * (unique_depth - i))
+    for i in range(path_index, unique_depth):
+        feature_index[offset + i] = feature_index[offset + i + 1]
+        zero_fraction[offset + i] = zero_fraction[offset + i + 1]
+        one_fraction[offset + i] = one_fraction[offset + i + 1]
+
+
+@njit
+def _unwound_path_sum(zero_fraction, one_fraction, pweight, offset, unique_depth, path_index):
+    one = one_fraction[offset + path_index]
+    zero = zero_fraction[offset + path_index]
+    next_one_portion = pweight[offset + unique_depth]
+    total = 0.0
+    if one != 0:
+        for i in range(unique_depth - 1, -1, -1):
+            tmp = next_one_portion / ((i + 1) * one)
+            total += tmp
+            next_one_portion = pweight[offset + i] - tmp * zero * (unique_depth - i)
+    else:
+        for i in range(unique_depth - 1, -1, -1):
+            total += pweight[offset + i] / (zero * (unique_depth - i))
+    return total * (unique_depth + 1)
+
+
+@njit
+def _tree_shap_recursive(children_left, children_right, children_default, features, thresholds, values,
+                         node_sample_weight, x, x_missing, phi, node_index, unique_depth,
+                         feature_index, zero_fraction, one_fraction, pweight, parent_offset,
+                         parent_zero_fraction, parent_one_fraction, parent_feature_index,
+                         condition, condition_feature, condition_fraction, node_depth, exact_depth):
+
+    # stop if we have no weight coming down to us
+    if condition_fraction == 0:
+        return
+
+    # extend the unique path
+    offset = parent_offset + unique_depth + 1
+    for i in range(unique_depth + 1):
+        feature_index[offset + i] = feature_index[parent_offset + i]
+        zero_fraction[offset + i] = zero_fraction[parent_offset + i]
+        one_fraction[offset + i] = one_fraction[parent_offset + i]
+        pweight[offset + i] = pweight[parent_offset + i]
+    if condition == 0 or condition_feature != parent_feature_index:
+        _extend_path(
+            feature_index, zero_fraction, one_fraction, pweight, offset, unique_depth,
+            parent_zero_fraction, parent_one_fraction, parent_feature_index
+        )
+    split_index = np.int64(features[node_index])
+
+    # leaf node (or the last level explained exactly, which then acts as a leaf with the expected value below it)
+    if children_right[node_index] < 0 or node_depth >= exact_depth:
+        for i in range(1, unique_depth + 1):
+            w = _unwound_path_sum(zero_fraction, one_fraction, pweight, offset, unique_depth, i)
+            scale = w * (one_fraction[offset + i] - zero_fraction[offset + i]) * condition_fraction
+            for j in range(values.shape[1]):
+                phi[feature_index[offset + i], j] += scale * values[node_index, j]
+        return
+
+    # internal node, find which branch is "hot" (meaning x would follow it)
+    hot_index = np.int64(_next_node(
+        children_left, children_right, children_default, node_index, split_index, thresholds[node_index], x, x_missing
+    ))
+    cold_index = np.int64(children_right[node_index] if hot_index == children_left[node_index] else children_left[node_index])
+    w = np.float64(node_sample_weight[node_index])
+    hot_zero_fraction = node_sample_weight[hot_index] / w
+    cold_zero_fraction = node_sample_weight[cold_index] / w
+    incoming_zero_fraction = 1.0
+    incoming_one_fraction = 1.0
+
+    # see if we have already split on this feature,
+    # if so we undo that split so we can redo it for this node
+    path_index = 0
+    while path_index <= unique_depth:
+        if feature_index[offset + path_index] == split_index:
+            break
+        path_index += 1
+    if path_index != unique_depth + 1:
+        incoming_zero_fraction = zero_fraction[offset + path_index]
+        incoming_one_fraction = one_fraction[offset + path_index]
+        _unwind_path(feature_index, zero_fraction, one_fraction, pweight, offset, unique_depth, path_index)
+        unique_depth -= 1
+
+    # divide up the condition_fraction among the recursive calls
+    hot_condition_fraction = condition_fraction
+    cold_condition_fraction = condition_fraction
+    if condition > 0 and split_index == condition_feature:
+        cold_condition_fraction = 0.0
+        unique_depth -= 1
+    elif condition < 0 and split_index == condition_feature:
+        hot_condition_fraction *= hot_zero_fraction
+        cold_condition_fraction *= cold_zero_fraction
+        unique_depth -= 1
+
+    _tree_shap_recursive(
+        children_left, children_right, children_default, features, thresholds, values, node_sample_weight,
+        x, x_missing, phi, hot_index, unique_depth + 1, feature_index, zero_fraction, one_fraction, pweight,
+        offset, hot_zero_fraction * incoming_zero_fraction, incoming_one_fraction, split_index,
+        condition, condition_feature, hot_condition_fraction, node_depth + 1, exact_depth
+    )
+    _tree_shap_recursive(
+        children_left, children_right, children_default, features, thresholds, values, node_sample_weight,
+        x, x_missing, phi, cold_index, unique_depth + 1, feature_index, zero_fraction, one_fraction, pweight,
+        offset, cold_zero_fraction * incoming_zero_fraction, 0.0, split_index,
+        condition, condition_feature, cold_condition_fraction, node_depth + 1, exact_depth
+    )
+
+
+@njit
+def _tree_shap(children_left, children_right, children_default, features, thresholds, values,
+               node_sample_weight, max_depth, x, x_missing, phi, condition, condition_feature, exact_depth):
+    M = x.shape[0]
+
+    # update the reference value with the expected value of the tree's predictions
+    if condition == 0:
+        for j in range(values.shape[1]):
+            phi[M, j] += values[0, j]
+
+    # the path weights are kept in double precision whatever the precision of the model
+    maxd = max_depth + 2
+    path_size = (maxd * (maxd + 1)) // 2
+    feature_index = np.zeros(path_size, dtype=np.int64)
+    zero_fraction = np.zeros(path_size)
+    one_fraction = np.zeros(path_size)
+    pweight = np.zeros(path_size)
+    _tree_shap_recursive(
+        children_left, children_right, children_default, features, thresholds, values, node_sample_weight,
+        x, x_missing, phi, 0, 0, feature_index, zero_fraction, one_fraction, pweight, 0,
+        1.0, 1.0, -1, condition, np.int64(condition_feature), 1.0, 0, exact_depth
+    )
+
+
+@njit(nogil=True)
+def _dense_tree_path_dependent(children_left, children_right, children_default, features, thresholds, values,
+                               node_sample_weight, max_depth, tree_limit, base_offset, X, X_missing, stages,
+                               out_contribs):
+    num_stages = stages.shape[0]
+    M = X.shape[1]
+    num_trees = min(tree_limit, stages[num_stages - 1]) if num_stages > 0 else tree_limit
+    running_contribs = np.zeros((M + 1, values.shape[2]), dtype=values.dtype)
+    for i in range(X.shape[0]):
+        instance_out_contribs = running_contribs if num_stages > 0 else out_contribs[i]
+        running_contribs[:] = 0
+
+        # each sample walks every tree once, and the running sum is copied out at every stage
+        stage = 0
+        for j in range(num_trees + 1):
+            while stage < num_stages and (stages[stage] <= j or j == num_trees):
+                out_contribs[stage * X.shape[0] + i] = running_contribs
+                for k in range(values.shape[2]):
+                    out_contribs[stage * X.shape[0] + i, M, k] += base_offset[k]
+                stage += 1
+            if j == num_trees:
+                break
+            _tree_shap(
+                children_left[j], children_right[j], children_default[j], features[j], thresholds[j], values[j],
+                node_sample_weight[j], max_depth, X[i], X_missing[i], instance_out_contribs, 0, 0,
+                _NO_TRUNCATION
+            )
+
+        if num_stages == 0:
+            for k in range(values.shape[2]):
+                instance_out_contribs[M, k] += base_offset[k]
+
+
+@njit(nogil=True)
+def _dense_tree_interactions_path_dependent(children_left, children_right, children_default, features, thresholds,
+                                            values, node_sample_weight, max_depth, tree_limit, base_offset, X,
+                                            X_missing, unique_features, out_contribs):
+    M = X.shape[1]
+    diag_contribs = np.zeros((M + 1, values.shape[2]), dtype=out_contribs.dtype)
+    on_contribs = np.zeros_like(diag_contribs)
+    off_contribs = np.zeros_like(diag_contribs)
+    for i in range(X.shape[0]):
+        diag_contribs[:] = 0
+        for j in range(tree_limit):
+            _tree_shap(
+                children_left[j], children_right[j], children_default[j], features[j], thresholds[j], values[j],
+                node_sample_weight[j], max_depth, X[i], X_missing[i], diag_contribs, 0, 0,
+                _NO_TRUNCATION
+            )
+
+            # the interaction of each feature is half the difference of the SHAP values with it held on and off
+            for ind in unique_features[j]:
+                if ind < 0:
+                    break
+                on_contribs[:] = 0
+                off_contribs[:] = 0
+                _tree_shap(
+                    children_left[j], children_right[j], children_default[j], features[j], thresholds[j], values[j],
+                    node_sample_weight[j], max_depth, X[i], X_missing[i], on_contribs, 1, ind,
+                    _NO_TRUNCATION
+                )
+                _tree_shap(
+                    children_left[j], children_right[j], children_default[j], features[j], thresholds[j], values[j],
+                    node_sample_weight[j], max_depth, X[i], X_missing[i], off_contribs, -1, ind,
+                    _NO_TRUNCATION
+                )
+                for col in range(M + 1):
+                    for k in range(values.shape[2]):
+                        val = (on_contribs[col, k] - off_contribs[col, k]) / 2
+                        out_contribs[i, ind, col, k] += val
+                        diag_contribs[col, k] -= val
+
+        for col in range(M + 1):
+            out_contribs[i, col, col] = diag_contribs[col]
+        for k in range(values.shape[2]):
+            out_contribs[i, M, M, k] += base_offset[k]
+
+
+@njit(nogil=True)
+def _dense_tree_shap_truncated(children_left, children_right, children_default, features, thresholds, values,
+                               node_sample_weight, max_depth, tree_limit, base_offset, X, X_missing, exact_depth,
+                               out_contribs, out_error_bounds, has_error_bounds):
+    M = X.shape[1]
+    error_estimate = np.zeros(values.shape[2])
+    for i in range(X.shape[0]):
+        error_estimate[:] = 0
+        for j in range(tree_limit):
+            _tree_shap(
+                children_left[j], children_right[j], children_default[j], features[j], thresholds[j], values[j],
+                node_sample_weight[j], max_depth, X[i], X_missing[i], out_contribs[i], 0, 0, exact_depth
+            )
+            _tree_saabas(
+                children_left[j], children_right[j], children_default[j], features[j], thresholds[j], values[j],
+                node_sample_weight[j], X[i], X_missing[i], out_contribs[i], exact_depth, error_estimate
+            )
+        for k in range(values.shape[2]):
+            out_contribs[i, M, k] += base_offset[k]
+            if has_error_bounds:
+                out_error_bounds[i, k] = error_estimate[k]
+
+
+# The interventional algorithm. For one sample x and one background sample r, the nodes where x and r
+# take different branches split the tree walk in two, one side using x's value of the feature and the
+# other r's. A leaf reached while taking x's branch for the features in A and r's branch for the features
+# in B is the model output of exactly the coalitions that contain A and none of B, so its value v adds
+# v * (|A| - 1)! |B|! / (|A| + |B|)! to each feature in A and subtracts v * |A|! (|B| - 1)! / (|A| + |B|)!
+# from each feature in B. Once a feature is assigned to A or B, later splits on it follow the same side.
+
+@njit
+def _independent_weights(max_depth):
+    """weights[a, b] = a! b! / (a + b + 1)!"""
+    weights = np.zeros((max_depth + 1, max_depth + 1))
+    for a in range(max_depth + 1):
+        for b in range(max_depth + 1):
+            weights[a, b] = math.exp(math.lgamma(a + 1) + math.lgamma(b + 1) - math.lgamma(a + b + 2))
+    return weights
+
+
+@njit
+def _tree_shap_independent(children_left, children_right, children_default, features, thresholds, values,
+                           oind, x, x_missing, r, r_missing, weights, feature_sides, path_features,
+                           node, num_x, num_r, phi):
+    if children_left[node] < 0:
+        value = values[node, oind]
+        num_path = num_x + num_r
+        for p in range(num_path):
+            feature = path_features[p]
+            if feature_sides[feature] == 1:
+                phi[feature] += value * weights[num_x - 1, num_r]
+            else:
+                phi[feature] -= value * weights[num_x, num_r - 1]
+        # the empty coalition only reaches the leaves r reaches
+        if num_x == 0:
+            phi[phi.shape[0] - 1] += value
+        return
+
+    feature = features[node]
+    x_child = np.int64(_next_node(children_left, children_right, children_default, node, feature, thresholds[node], x, x_missing))
+    r_child = np.int64(_next_node(children_left, children_right, children_default, node, feature, thresholds[node], r, r_missing))
+    side = feature_sides[feature]
+    if side == 1 or (side == 0 and x_child == r_child):
+        _tree_shap_independent(
+            children_left, children_right, children_default, features, thresholds, values, oind, x, x_missing,
+            r, r_missing, weights, feature_sides, path_features, x_child, num_x, num_r, phi
+        )
+    elif side == 2:
+        _tree_shap_independent(
+            children_left, children_right, children_default, features, thresholds, values, oind, x, x_missing,
+            r, r_missing, weights, feature_sides, path_features, r_child, num_x, num_r, phi
+        )
+    else:
+        path_features[num_x + num_r] = feature
+        feature_sides[feature] = 1
+        _tree_shap_independent(
+            children_left, children_right, children_default, features, thresholds, values, oind, x, x_missing,
+            r, r_missing, weights, feature_sides, path_features, x_child, num_x + 1, num_r, phi
+        )
+        feature_sides[feature] = 2
+        _tree_shap_independent(
+            children_left, children_right, children_default, features, thresholds, values, oind, x, x_missing,
+            r, r_missing, weights, feature_sides, path_features, r_child, num_x, num_r + 1, phi
+        )
+        feature_sides[feature] = 0
+
+
+@njit(nogil=True)
+def _dense_independent(children_left, children_right, children_default, features, thresholds, values,
+                       max_depth, tree_limit, base_offset, model_transform, X, X_missing, y, has_y, R, R_missing,
+                       R_weights, has_R_weights, out_contribs):
+    M = X.shape[1]
+    num_R = R.shape[0]
+    num_outputs = values.shape[2]
+    weights = _independent_weights(max_depth)
+    feature_sides = np.zeros(M, dtype=np.int8)
+    path_features = np.zeros(max_depth + 1, dtype=np.int64)
+    tmp_out_contribs = np.zeros(M + 1)
+
+    # the model's margin output for each reference only depends on the reference
+    r_margins = np.zeros((num_R, num_outputs))
+    if model_transform != 0:
+        for j in range(num_R):
+            for k in range(tree_limit):
+                leaf = _tree_predict(
+                    children_left[k], children_right[k], children_default[k], features[k], thresholds[k],
+                    R[j], R_missing[j]
+                )
+                for oind in range(num_outputs):
+                    r_margins[j, oind] += values[k, leaf, oind]
+            for oind in range(num_outputs):
+                r_margins[j, oind] += base_offset[oind]
+
+    for oind in range(num_outputs):
+        for i in range(X.shape[0]):
+            y_i = y[i] if has_y else 0.0
+
+            # compute the model's margin output for x
+            margin_x = 0.0
+            if model_transform != 0:
+                margin_x = base_offset[oind]
+                for k in range(tree_limit):
+                    leaf = _tree_predict(
+                        children_left[k], children_right[k], children_default[k], features[k], thresholds[k],
+                        X[i], X_missing[i]
+                    )
+                    margin_x += values[k, leaf, oind]
+
+            for j in range(num_R):
+                r_weight = R_weights[j] if has_R_weights else 1.0
+                tmp_out_contribs[:] = 0
+                for k in range(tree_limit):
+                    _tree_shap_independent(
+                        children_left[k], children_right[k], children_default[k], features[k], thresholds[k],
+                        values[k], oind, X[i], X_missing[i], R[j], R_missing[j], weights, feature_sides,
+                        path_features, 0, 0, 0, tmp_out_contribs
+                    )
+
+                # per reference scaling for non-linear transformations
+                rescale_factor = 1.0
+                if model_transform != 0:
+                    margin_r = r_margins[j, oind]
+                    if margin_x != margin_r:
+                        rescale_factor = _transform(model_transform, margin_x, y_i) - _transform(model_transform, margin_r, y_i)
+                        rescale_factor /= margin_x - margin_r
+
+                for k in range(M):
+                    out_contribs[i, k, oind] += tmp_out_contribs[k] * rescale_factor * r_weight
+                if model_transform != 0:
+                    out_contribs[i, M, oind] += _transform(model_transform, base_offset[oind] + tmp_out_contribs[M], 0.0) * r_weight
+                else:
+                    out_contribs[i, M, oind] += (base_offset[oind] + tmp_out_contribs[M]) * r_weight
+
+            # average the results over all the references (weighted references are already scaled)
+            if not has_R_weights:
+                for k in range(M + 1):
+                    out_contribs[i, k, oind] /= num_R
+
+
+def _dense_blocks(X, X_missing, dtype):
+    """Yield ``(rows, X, X_missing)`` blocks of dense rows, expanding a ``(data, indices, indptr, # columns)`` CSR tuple."""
+    if not isinstance(X, tuple):
+        yield slice(None), np.ascontiguousarray(X, dtype=dtype), np.ascontiguousarray(X_missing, dtype=bool)
+        return
+    data, indices, indptr, num_columns = X
+    X = scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, num_columns))
+    for start in range(0, X.shape[0], _CSR_BLOCK_SIZE):
+        rows = slice(start, min(start + _CSR_BLOCK_SIZE, X.shape[0]))
+        block = X[rows].toarray().astype(dtype)
+        yield rows, block, np.isnan(block)
+
+
+def _tree_arrays(children_left, children_right, children_default, features, thresholds, values, dtype):
+    return (
+        np.ascontiguousarray(children_left, dtype=np.int32), np.ascontiguousarray(children_right, dtype=np.int32),
+        np.ascontiguousarray(children_default, dtype=np.int32), np.ascontiguousarray(features, dtype=np.int32),
+        np.ascontiguousarray(thresholds, dtype=dtype), np.ascontiguousarray(values, dtype=dtype),
+    )
+
+
+def _check_numerical_splits(categorical_splits):
+    if categorical_splits is not None:
+        raise ExplainerError("Models with categorical splits need the C extension, which was not built!")
+
+
+def _optional_array(a, dtype):
+    """Return ``(array, is_given)``, numba needs an array of the right type even when the argument is None."""
+    if a is None:
+        return np.zeros(0, dtype=dtype), False
+    return np.ascontiguousarray(a, dtype=dtype), True
+
+
+def dense_tree_shap(children_left, children_right, children_default, features, thresholds, values,
+                    node_sample_weights, max_depth, X, X_missing, y, R, R_missing, tree_limit, base_offset,
+                    out_contribs, feature_dependence, model_transform, interactions, num_threads=1, stages=None,
+                    background_cache=None, R_weights=None, unique_features=None, out_predictions=None,
+                    categorical_splits=None):
+    """Fill ``out_contribs`` with SHAP (interaction) values, see ``_cext.dense_tree_shap``.
+
+    ``num_threads`` and ``background_cache`` are accepted for compatibility but not used.
+    """
+    _check_numerical_splits(categorical_splits)
+    dtype = values.dtype
+    trees = _tree_arrays(children_left, children_right, children_default, features, thresholds, values, dtype)
+    base_offset = np.ascontiguousarray(base_offset, dtype=dtype)
+    y, has_y = _optional_array(y, dtype)
+    stages, _ = _optional_array(stages, np.int64)
+    if feature_dependence == FEATURE_DEPENDENCE_INDEPENDENT:
+        if interactions:
+            raise ExplainerError("The interventional algorithm does not support interaction values!")
+        R = np.ascontiguousarray(R, dtype=np.float64)
+        R_missing = np.ascontiguousarray(R_missing, dtype=bool)
+        R_weights, has_R_weights = _optional_array(R_weights, np.float64)
+    elif feature_dependence == FEATURE_DEPENDENCE_TREE_PATH_DEPENDENT:
+        node_sample_weights = np.ascontiguousarray(node_sample_weights, dtype=dtype)
+        if interactions and unique_features is None:
+            unique_features = np.full((trees[0].shape[0], trees[0].shape[1]), -1, dtype=np.int64)
+            for j, (tree_features, tree_children_left) in enumerate(zip(trees[3], trees[0])):
+                split_features = tree_features[tree_children_left >= 0]
+                used, first_use = np.unique(split_features, return_index=True)
+                unique_features[j, :len(used)] = used[np.argsort(first_use)]
+    else:
+        raise ExplainerError("Only the interventional and tree path dependent algorithms are available without the C extension!")
+
+    for rows, X_block, X_missing_block in _dense_blocks(X, X_missing, dtype):
+        y_block = y[rows] if has_y else y
+        out_block = out_contribs[rows]
+        if feature_dependence == FEATURE_DEPENDENCE_INDEPENDENT:
+            _dense_independent(
+                *trees, max_depth, tree_limit, base_offset, model_transform, X_block, X_missing_block, y_block,
+                has_y, R, R_missing, R_weights, has_R_weights, out_block
+            )
+        elif interactions:
+            _dense_tree_interactions_path_dependent(
+                *trees, node_sample_weights, max_depth, tree_limit, base_offset, X_block, X_missing_block,
+                np.ascontiguousarray(unique_features, dtype=np.int64), out_block
+            )
+        elif len(stages) > 0:
+            # the stages are the leading axis of out_contribs, so CSR blocks are not supported here
+            flat_out = out_contribs.reshape(-1, *out_contribs.shape[2:])
+            _dense_tree_path_dependent(
+                *trees, node_sample_weights, max_depth, tree_limit, base_offset, X_block, X_missing_block, stages,
+                flat_out
+            )
+        else:
+            _dense_tree_path_dependent(
+                *trees, node_sample_weights, max_depth, tree_limit, base_offset, X_block, X_missing_block, stages,
+                out_block
+            )
+        if out_predictions is not None:
+            out_predictions[rows] = 0
+            _dense_tree_predict(
+                *trees, tree_limit, base_offset, model_transform, X_block, X_missing_block, y_block, has_y,
+                out_predictions[rows]
+            )
+
+
+def dense_tree_saabas(children_left, children_right, children_default, features, thresholds, values, max_depth,
+                      tree_limit, base_offset, model_output, X, X_missing, y, out_contribs, num_threads=1,
+                      out_predictions=None, categorical_splits=None):
+    """Fill ``out_contribs`` with Saabas values, see ``_cext.dense_tree_saabas``."""
+    _check_numerical_splits(categorical_splits)
+    dtype = values.dtype
+    trees = _tree_arrays(children_left, children_right, children_default, features, thresholds, values, dtype)
+    base_offset = np.ascontiguousarray(base_offset, dtype=dtype)
+    y, has_y = _optional_array(y, dtype)
+    for rows, X_block, X_missing_block in _dense_blocks(X, X_missing, dtype):
+        _dense_tree_saabas(*trees, tree_limit, base_offset, X_block, X_missing_block, out_contribs[rows])
+        if out_predictions is not None:
+            out_predictions[rows] = 0
+            _dense_tree_predict(
+                *trees, tree_limit, base_offset, model_output, X_block, X_missing_block, y[rows] if has_y else y,
+                has_y, out_predictions[rows]
+            )
+
+
+def dense_tree_shap_truncated(children_left, children_right, children_default, features, thresholds, values,
+                              node_sample_weights, max_depth, X, X_missing, y, tree_limit, base_offset, exact_depth,
+                              out_contribs, model_output, num_threads=1, out_error_bounds=None, out_predictions=None,
+                              categorical_splits=None):
+    """Fill ``out_contribs`` with depth truncated SHAP values, see ``_cext.dense_tree_shap_truncated``."""
+    _check_numerical_splits(categorical_splits)
+    if exact_depth < 0:
+        raise ValueError("exact_depth must be non-negative!")
+    dtype = np.float64
+    trees = _tree_arrays(children_left, children_right, children_default, features, thresholds, values, dtype)
+    base_offset = np.ascontiguousarray(base_offset, dtype=dtype)
+    node_sample_weights = np.ascontiguousarray(node_sample_weights, dtype=dtype)
+    y, has_y = _optional_array(y, dtype)
+    has_error_bounds = out_error_bounds is not None
+    if not has_error_bounds:
+        out_error_bounds = np.zeros((0, values.shape[2]))
+    X = np.ascontiguousarray(X, dtype=dtype)
+    X_missing = np.ascontiguousarray(X_missing, dtype=bool)
+    _dense_tree_shap_truncated(
+        *trees, node_sample_weights, max_depth, tree_limit, base_offset, X, X_missing,
+        min(exact_depth, _NO_TRUNCATION), out_contribs, out_error_bounds, has_error_bounds
+    )
+    if out_predictions is not None:
+        out_predictions[:] = 0
+        _dense_tree_predict(*trees, tree_limit, base_offset, model_output, X, X_missing, y, has_y, out_predictions)
+
+
+def dense_tree_predict(children_left, children_right, children_default, features, thresholds, values, max_depth,
+                       tree_limit, base_offset, model_output, X, X_missing, y, out_pred, categorical_splits=None):
+    """Add the (transformed) model output of each sample to ``out_pred``, see ``_cext.dense_tree_predict``."""
+    _check_numerical_splits(categorical_splits)
+    dtype = values.dtype
+    trees = _tree_arrays(children_left, children_right, children_default, features, thresholds, values, dtype)
+    base_offset = np.ascontiguousarray(base_offset, dtype=dtype)
+    y, has_y = _optional_array(y, dtype)
+    for rows, X_block, X_missing_block in _dense_blocks(X, X_missing, dtype):
+        _dense_tree_predict(
+            *trees, tree_limit, base_offset, model_output, X_block, X_missing_block,
+            y[rows] if has_y else y, has_y, out_pred[rows]
+        )
+
+
+def dense_tree_predict_leaves(children_left, children_right, children_default, features, thresholds, tree_limit, X,
+                              X_missing, out_leaves, num_threads=1, categorical_splits=None):
+    """Fill ``out_leaves`` with the leaf each sample lands in for each tree, see ``_cext.dense_tree_predict_leaves``."""
+    _check_numerical_splits(categorical_splits)
+    trees = _tree_arrays(children_left, children_right, children_default, features, thresholds, thresholds, np.float64)
+    _dense_tree_predict_leaves(
+        *trees[:5], tree_limit, np.ascontiguousarray(X, dtype=np.float64), np.ascontiguousarray(X_missing, dtype=bool),
+        out_leaves
+    )
+
+
+def dense_tree_update_weights(children_left, children_right, children_default, features, thresholds, values,
+                              tree_limit, node_sample_weight, X, X_missing, X_weights=None, categorical_splits=None):
+    """Add the (weighted) number of samples of ``X`` passing through each node to ``node_sample_weight``."""
+    _check_numerical_splits(categorical_splits)
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    if X_weights is None:
+        X_weights = np.ones(X.shape[0])
+    trees = _tree_arrays(children_left, children_right, children_default, features, thresholds, values, np.float64)
+    # a single tree (as in SingleTree) is passed as flat arrays
+    single_tree = trees[0].ndim == 1
+    if single_tree:
+        trees = tuple(a[np.newaxis] for a in trees)
+        node_sample_weight = node_sample_weight[np.newaxis]
+    _dense_tree_update_weights(
+        *trees[:5], tree_limit, node_sample_weight, X, np.ascontiguousarray(X_missing, dtype=bool),
+        np.ascontiguousarray(X_weights, dtype=np.float64)
+    )
+
+
+def compute_expectations(children_left, children_right, node_sample_weight, values):
+    """Set the value of every internal node of a tree to the weighted mean of its children, return the tree depth."""
+    return _compute_expectations(
+        np.ascontiguousarray(children_left, dtype=np.int32), np.ascontiguousarray(children_right, dtype=np.int32),
+        np.ascontiguousarray(node_sample_weight, dtype=np.float64), values, 0, 0
+    )
@@ -48,7 +48,7 @@ class Random(Explainer):
 
         # generate random feature attributions
         # we produce small values so our explanation errors are similar to a constant function
-        row_values = np.random.randn(*((len(fm),) + outputs.shape[1:])) * 0.001
+        row_values = self._random_state.randn(*((len(fm),) + outputs.shape[1:])) * 0.001
 
         return {
             "values": row_values,
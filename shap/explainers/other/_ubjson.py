@@ -1,8 +1,9 @@
 """This is an incomplete implementation of the UBJSON specification. Expected is a readable file pointer to a UBJSON file.
 Things that are not implemented:
 - High precision numbers
-- Optimized arrays with type & count
 - nested arrays, so arrays in arrays are not supported, objects in arrays are supported
+
+Optimized arrays with a numeric type & count are returned as numpy arrays in native byte order.
 """
 import struct
 
@@ -57,6 +58,9 @@ struct_mapping = {
     CHAR: 's',
 }
 
+# precompiled big endian unpackers, looked up once per element
+struct_unpackers = {tag: struct.Struct(f'>{prefix}') for tag, prefix in struct_mapping.items() if tag != CHAR}
+
 numpy_type_mapping = {
     INT8: np.int8,
     UINT8: np.uint8,
@@ -66,6 +70,7 @@ numpy_type_mapping = {
     FLOAT32: np.float32,
     FLOAT64: np.float64,
 }
+numpy_big_endian_types = {tag: np.dtype(t).newbyteorder(">") for tag, t in numpy_type_mapping.items()}
 
 
 objects = [OBJECT_OPEN, OBJECT_CLOSE]
@@ -89,14 +94,13 @@ arrays = [ARRAY_CLOSE, ARRAY_OPEN]
 #     [2.113]
 #     [23.8889]
 # // No end marker since a count was specified.
+# The typed array is read straight into a numpy buffer.
 def _decode_array_optimized(fp):
     tag = fp.read(1)
     # optimized array with count
     if tag == b"#":
         array_length_indicator = fp.read(1)
-        array_length_indicator_type = struct_mapping[array_length_indicator]
-        array_length = type_sizes[array_length_indicator]
-        array_length = struct.unpack(f'>{array_length_indicator_type}', fp.read(array_length))[0]
+        array_length = struct_unpackers[array_length_indicator].unpack(fp.read(type_sizes[array_length_indicator]))[0]
 
         array = []
         for _ in range(array_length):
@@ -110,13 +114,13 @@ def _decode_array_optimized(fp):
         value_type_length = type_sizes[value_type_byte]
         tag = fp.read(1)
         array_type_byte = fp.read(1)
-        array_type_length = type_sizes[array_type_byte]
-        array_type_prefix = struct_mapping[array_type_byte]
-        array_length_bytes = fp.read(array_type_length)
-        array_length = struct.unpack(f'>{array_type_prefix}', array_length_bytes)[0]
+        array_length = struct_unpackers[array_type_byte].unpack(fp.read(type_sizes[array_type_byte]))[0]
+        buffer = fp.read(array_length * value_type_length)
+        if value_type_byte in numpy_type_mapping:
+            # UBJSON is big endian, so swap the bytes into the native order in one pass
+            return np.frombuffer(buffer, dtype=numpy_big_endian_types[value_type_byte]).astype(numpy_type_mapping[value_type_byte])
         if array_length == 0:
             return list()
-        buffer = fp.read(array_length * value_type_length)
         return list(struct.unpack('>' + f'{struct_mapping[value_type_byte]}' * array_length, buffer))
     else:
         raise ValueError("Expected optimized array but got received bytes of unoptimized array.")
@@ -142,9 +146,7 @@ def _decode_object(tag, fp):
 
 def __decode_element(tag, fp):
     if (element_type_length := type_sizes.get(tag)) is not None:
-        value_bytes = fp.read(element_type_length)
-        value_struct_prefix = struct_mapping[tag]
-        return struct.unpack(f'>{value_struct_prefix}', value_bytes)[0]
+        return struct_unpackers[tag].unpack(fp.read(element_type_length))[0]
     elif tag == STRING:
         string_length_type = fp.read(1)
         length = __decode_element(string_length_type, fp)
@@ -83,6 +83,7 @@ class Tabular(Masker):
         self._last_mask = np.zeros(data.shape[1], dtype=bool)
         self.shape = self.data.shape
         self.supports_delta_masking = True
+        self.supports_full_masking = True
         # self._last_x = None
         # self._data_variance = np.ones(self.data.shape, dtype=bool)
 
@@ -96,6 +97,17 @@ class Tabular(Masker):
         if len(x.shape) != 1 or x.shape[0] != self.data.shape[1]:
             raise DimensionError("The input passed for tabular masking does not match the background data shape!")
 
+        # if mask is a matrix of masks then we mask the whole batch at once
+        if len(mask.shape) == 2:
+            variants = ~self.invariants(x)
+            varying_rows_out = np.zeros((mask.shape[0], self.shape[0]), dtype=bool)
+            masked_inputs_out = np.zeros((mask.shape[0] * self.shape[0], self.shape[1]), dtype=self._masked_data.dtype)
+            _full_masking(mask, x, self.data, variants, masked_inputs_out, varying_rows_out)
+            if self.output_dataframe:
+                return (pd.DataFrame(masked_inputs_out, columns=self.feature_names),), varying_rows_out
+
+            return (masked_inputs_out,), varying_rows_out
+
         # if mask is an array of integers then we are doing delta masking
         if np.issubdtype(mask.dtype, np.integer):
 
@@ -237,6 +249,31 @@ def _delta_masking(masks, x, curr_delta_inds, varying_rows_out,
 
 
 
+@njit
+def _full_masking(masks, x, data, variants, masked_inputs_out, varying_rows_out):
+    """Mask a whole batch of full (boolean) masks, marking the rows that differ from the previous mask.
+
+    This matches masking the masks one at a time, where the first mask of the batch varies on every row.
+    """
+    N, M = data.shape
+    for i in range(masks.shape[0]):
+        for j in range(N):
+            for k in range(M):
+                if masks[i, k]:
+                    masked_inputs_out[i * N + j, k] = x[k]
+                else:
+                    masked_inputs_out[i * N + j, k] = data[j, k]
+
+        if i == 0:
+            varying_rows_out[i, :] = True
+        else:
+            for k in range(M):
+                if masks[i, k] != masks[i - 1, k]:
+                    for j in range(N):
+                        if variants[j, k]:
+                            varying_rows_out[i, j] = True
+
+
 class Independent(Tabular):
     """This masks out tabular features by integrating over the given background dataset."""
 
@@ -19,7 +19,7 @@ from ._general import (
     shapley_coefficients,
     suppress_stderr,
 )
-from ._masked_model import MaskedModel, make_masks
+from ._masked_model import MaskedModel, OutputCache, make_masks
 from ._show_progress import show_progress
 
 __all__ = [
@@ -41,6 +41,7 @@ __all__ = [
     "shapley_coefficients",
     "suppress_stderr",
     "MaskedModel",
+    "OutputCache",
     "make_masks",
     "show_progress",
 ]
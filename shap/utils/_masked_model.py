@@ -1,7 +1,10 @@
 import copy
+import threading
 import warnings
+from collections import OrderedDict
 
 import numpy as np
+import pandas as pd
 import scipy.sparse
 from numba import njit
 
@@ -15,16 +18,20 @@ class MaskedModel:
     function that can be called to mask out any set of inputs. This class attempts to be smart
     about only evaluating the model for background samples when the inputs changed (note this
     requires the masker object to have a .invariants method).
+
+    An optional ``OutputCache`` passed as ``output_cache`` is used to skip the model evaluation of
+    masked rows that were already evaluated, also by other ``MaskedModel`` objects that share it.
     """
 
     delta_mask_noop_value = 2147483647 # used to encode a noop for delta masking
 
-    def __init__(self, model, masker, link, linearize_link, *args):
+    def __init__(self, model, masker, link, linearize_link, *args, output_cache=None):
         self.model = model
         self.masker = masker
         self.link = link
         self.linearize_link = linearize_link
         self.args = args
+        self.output_cache = output_cache
 
         # if the masker supports it, save what positions vary from the background
         if callable(getattr(self.masker, "invariants", None)):
@@ -74,6 +81,7 @@ class MaskedModel:
         if batch_size is None:
             batch_size = len(masks)
         do_delta_masking = getattr(self.masker, "reset_delta_masking", None) is not None
+        do_full_masking = getattr(self.masker, "supports_full_masking", False) and self._variants is not None
         num_varying_rows = np.zeros(len(masks), dtype=int)
         batch_positions = np.zeros(len(masks)+1, dtype=int)
         varying_rows = []
@@ -82,69 +90,78 @@ class MaskedModel:
         all_outputs = []
         for batch_ind in range(0, len(masks), batch_size):
             mask_batch = masks[batch_ind:batch_ind + batch_size]
-            all_masked_inputs = []
-            num_mask_samples = np.zeros(len(mask_batch), dtype=int)
-            last_mask = np.zeros(mask_batch.shape[1], dtype=bool)
-            for i, mask in enumerate(mask_batch):
-
-                # mask the inputs
-                delta_mask = mask ^ last_mask
-                if do_delta_masking and delta_mask.sum() == 1:
-                    delta_ind = np.nonzero(delta_mask)[0][0]
-                    masked_inputs = self.masker(delta_ind, *self.args).copy()
-                else:
-                    masked_inputs = self.masker(mask, *self.args)
-
-                # get a copy that won't get overwritten by the next iteration
-                if not getattr(self.masker, "immutable_outputs", False):
-                    masked_inputs = copy.deepcopy(masked_inputs)
-
-                # wrap the masked inputs if they are not already in a tuple
-                if not isinstance(masked_inputs, tuple):
-                    masked_inputs = (masked_inputs,)
-
-                # masked_inputs = self.masker(mask, *self.args)
-                num_mask_samples[i] = len(masked_inputs[0])
-
-                # see which rows have been updated, so we can only evaluate the model on the rows we need to
-                if i == 0 or self._variants is None:
-                    varying_rows.append(np.ones(num_mask_samples[i], dtype=bool))
-                    num_varying_rows[batch_ind + i] = num_mask_samples[i]
-                else:
-                    # a = np.any(self._variants & delta_mask, axis=1)
-                    # a = np.any(self._variants & delta_mask, axis=1)
-                    # a = np.any(self._variants & delta_mask, axis=1)
-                    # (self._variants & delta_mask).sum(1) > 0
-
-                    np.bitwise_and(self._variants, delta_mask, out=delta_tmp)
-                    varying_rows.append(np.any(delta_tmp, axis=1))#np.any(self._variants & delta_mask, axis=1))
-                    num_varying_rows[batch_ind + i] = varying_rows[-1].sum()
-                    # for i in range(20):
-                    #     varying_rows[-1].sum()
-                last_mask[:] = mask
-
-                batch_positions[batch_ind + i + 1] = batch_positions[batch_ind + i] + num_varying_rows[batch_ind + i]
-
-                # subset the masked input to only the rows that vary
-                if num_varying_rows[batch_ind + i] != num_mask_samples[i]:
-                    if len(self.args) == 1:
-                        # _ = masked_inputs[varying_rows[-1]]
-                        # _ = masked_inputs[varying_rows[-1]]
-                        # _ = masked_inputs[varying_rows[-1]]
-                        masked_inputs_subset = masked_inputs[0][varying_rows[-1]]
+            if do_full_masking:
+                # the masker masks the whole batch at once and tells us which rows vary from mask to mask
+                masked_inputs, batch_varying_rows = self.masker(mask_batch, *self.args)
+                batch_end = batch_ind + len(mask_batch)
+                num_varying_rows[batch_ind:batch_end] = batch_varying_rows.sum(1)
+                batch_positions[batch_ind+1:batch_end+1] = batch_positions[batch_ind] + np.cumsum(num_varying_rows[batch_ind:batch_end])
+                varying_rows.extend(batch_varying_rows)
+                joined_masked_inputs = tuple(arg[batch_varying_rows.reshape(-1)] for arg in masked_inputs)
+            else:
+                all_masked_inputs = []
+                num_mask_samples = np.zeros(len(mask_batch), dtype=int)
+                last_mask = np.zeros(mask_batch.shape[1], dtype=bool)
+                for i, mask in enumerate(mask_batch):
+
+                    # mask the inputs
+                    delta_mask = mask ^ last_mask
+                    if do_delta_masking and delta_mask.sum() == 1:
+                        delta_ind = np.nonzero(delta_mask)[0][0]
+                        masked_inputs = self.masker(delta_ind, *self.args).copy()
                     else:
-                        masked_inputs_subset = [v[varying_rows[-1]] for v in zip(*masked_inputs[0])]
-                    masked_inputs = (masked_inputs_subset,) + masked_inputs[1:]
+                        masked_inputs = self.masker(mask, *self.args)
 
-                # define no. of list based on output of masked_inputs
-                if len(all_masked_inputs) != len(masked_inputs):
-                    all_masked_inputs = [[] for m in range(len(masked_inputs))]
+                    # get a copy that won't get overwritten by the next iteration
+                    if not getattr(self.masker, "immutable_outputs", False):
+                        masked_inputs = copy.deepcopy(masked_inputs)
 
-                for i, v in enumerate(masked_inputs):
-                    all_masked_inputs[i].append(v)
+                    # wrap the masked inputs if they are not already in a tuple
+                    if not isinstance(masked_inputs, tuple):
+                        masked_inputs = (masked_inputs,)
 
-            joined_masked_inputs = tuple([np.concatenate(v) for v in all_masked_inputs])
-            outputs = self.model(*joined_masked_inputs)
+                    # masked_inputs = self.masker(mask, *self.args)
+                    num_mask_samples[i] = len(masked_inputs[0])
+
+                    # see which rows have been updated, so we can only evaluate the model on the rows we need to
+                    if i == 0 or self._variants is None:
+                        varying_rows.append(np.ones(num_mask_samples[i], dtype=bool))
+                        num_varying_rows[batch_ind + i] = num_mask_samples[i]
+                    else:
+                        # a = np.any(self._variants & delta_mask, axis=1)
+                        # a = np.any(self._variants & delta_mask, axis=1)
+                        # a = np.any(self._variants & delta_mask, axis=1)
+                        # (self._variants & delta_mask).sum(1) > 0
+
+                        np.bitwise_and(self._variants, delta_mask, out=delta_tmp)
+                        varying_rows.append(np.any(delta_tmp, axis=1))#np.any(self._variants & delta_mask, axis=1))
+                        num_varying_rows[batch_ind + i] = varying_rows[-1].sum()
+                        # for i in range(20):
+                        #     varying_rows[-1].sum()
+                    last_mask[:] = mask
+
+                    batch_positions[batch_ind + i + 1] = batch_positions[batch_ind + i] + num_varying_rows[batch_ind + i]
+
+                    # subset the masked input to only the rows that vary
+                    if num_varying_rows[batch_ind + i] != num_mask_samples[i]:
+                        if len(self.args) == 1:
+                            # _ = masked_inputs[varying_rows[-1]]
+                            # _ = masked_inputs[varying_rows[-1]]
+                            # _ = masked_inputs[varying_rows[-1]]
+                            masked_inputs_subset = masked_inputs[0][varying_rows[-1]]
+                        else:
+                            masked_inputs_subset = [v[varying_rows[-1]] for v in zip(*masked_inputs[0])]
+                        masked_inputs = (masked_inputs_subset,) + masked_inputs[1:]
+
+                    # define no. of list based on output of masked_inputs
+                    if len(all_masked_inputs) != len(masked_inputs):
+                        all_masked_inputs = [[] for m in range(len(masked_inputs))]
+
+                    for i, v in enumerate(masked_inputs):
+                        all_masked_inputs[i].append(v)
+
+                joined_masked_inputs = tuple([np.concatenate(v) for v in all_masked_inputs])
+            outputs = self._evaluate_model(joined_masked_inputs)
             _assert_output_input_match(joined_masked_inputs, outputs)
             all_outputs.append(outputs)
         outputs = np.concatenate(all_outputs)
@@ -189,34 +206,64 @@ class MaskedModel:
 
 
     def _delta_masking_call(self, masks, zero_index=None, batch_size=None):
-        # TODO: we need to do batching here
-
         assert getattr(self.masker, "supports_delta_masking", None) is not None, "Masker must support delta masking!"
 
-        masked_inputs, varying_rows = self.masker(masks, *self.args)
-        num_varying_rows = varying_rows.sum(1)
-
-        subset_masked_inputs = [arg[varying_rows.reshape(-1)] for arg in masked_inputs]
-
-        batch_positions = np.zeros(len(varying_rows)+1, dtype=int)
-        for i in range(len(varying_rows)):
-            batch_positions[i+1] = batch_positions[i] + num_varying_rows[i]
-
-        # joined_masked_inputs = self._stack_inputs(all_masked_inputs)
-        outputs = self.model(*subset_masked_inputs)
-        _assert_output_input_match(subset_masked_inputs, outputs)
-
-        if self.linearize_link and self.link != links.identity and self._linearizing_weights is None:
-            self.background_outputs = outputs[batch_positions[zero_index]:batch_positions[zero_index+1]]
-            self._linearizing_weights = link_reweighting(self.background_outputs, self.link)
-
-        averaged_outs = np.zeros((varying_rows.shape[0],) + outputs.shape[1:])
-        last_outs = np.zeros((varying_rows.shape[1],) + outputs.shape[1:])
-        #print("link", self.link)
-        _build_fixed_output(averaged_outs, last_outs, outputs, batch_positions, varying_rows, num_varying_rows, self.link, self._linearizing_weights)
+        # the delta masks are split into blocks of batch_size masks, so only one block of masked inputs
+        # is held in memory at a time. The masker starts each call from the all off mask, so every block
+        # is prefixed with the flips that bring it to the mask the previous block ended on.
+        mask_ends = np.nonzero(masks >= 0)[0] + 1
+        num_masks = len(mask_ends)
+        if batch_size is None:
+            batch_size = num_masks
+        blocks = []
+        state = np.zeros(self._masker_cols, dtype=bool)
+        for first in range(0, num_masks, batch_size):
+            last = min(first + batch_size, num_masks)
+            block_masks = masks[0 if first == 0 else mask_ends[first-1]:mask_ends[last-1]]
+            prefix = (-np.nonzero(state)[0] - 1).astype(masks.dtype)
+            blocks.append((first, last, np.concatenate([prefix, block_masks])))
+            flips = np.where(block_masks < 0, -block_masks - 1, block_masks)[block_masks != MaskedModel.delta_mask_noop_value]
+            state ^= np.bincount(flips, minlength=self._masker_cols) % 2 == 1
+
+        # the linearizing weights come from the background outputs, so the block that holds them runs first
+        linearize = self.linearize_link and self.link != links.identity and self._linearizing_weights is None
+        if linearize and zero_index is not None:
+            blocks.sort(key=lambda block: not block[0] <= zero_index < block[1])
+
+        averaged_outs = None
+        for first, last, block_masks in blocks:
+            masked_inputs, varying_rows = self.masker(block_masks, *self.args)
+            num_varying_rows = varying_rows.sum(1)
+
+            subset_masked_inputs = [arg[varying_rows.reshape(-1)] for arg in masked_inputs]
+
+            batch_positions = np.zeros(len(varying_rows)+1, dtype=int)
+            batch_positions[1:] = np.cumsum(num_varying_rows)
+
+            outputs = self._evaluate_model(subset_masked_inputs)
+            _assert_output_input_match(subset_masked_inputs, outputs)
+
+            if linearize and self._linearizing_weights is None:
+                local_index = zero_index - first
+                self.background_outputs = outputs[batch_positions[local_index]:batch_positions[local_index+1]]
+                self._linearizing_weights = link_reweighting(self.background_outputs, self.link)
+
+            if averaged_outs is None:
+                averaged_outs = np.zeros((num_masks,) + outputs.shape[1:])
+                last_outs = np.zeros((varying_rows.shape[1],) + outputs.shape[1:])
+            _build_fixed_output(
+                averaged_outs[first:last], last_outs, outputs, batch_positions, varying_rows, num_varying_rows,
+                self.link, self._linearizing_weights
+            )
 
         return averaged_outs
 
+    def _evaluate_model(self, inputs):
+        """Run the model on a batch of masked inputs, going through the output cache if we have one."""
+        if self.output_cache is None:
+            return self.model(*inputs)
+        return self.output_cache(self.model, *inputs)
+
     @property
     def mask_shapes(self):
         if hasattr(self.masker, "mask_shapes") and callable(self.masker.mask_shapes):
@@ -265,6 +312,113 @@ class MaskedModel:
 
         return expanded_main_effects
 
+class OutputCache:
+    """A least recently used cache of model outputs, keyed by the dtype, shape and content of the input rows.
+
+    Pass it as ``output_cache`` to an explainer (or ``MaskedModel``) so masked rows that were already
+    evaluated, by any mask of any explained sample, are looked up instead of being sent to the model
+    again. Only models called with a single numeric array or DataFrame are cached; other inputs go
+    straight to the model. The outputs are assumed to depend on nothing but the input row, so a cache
+    must not be shared between different models. It can be used from several threads at once.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        """Build an empty cache.
+
+        Parameters
+        ----------
+        max_bytes : int
+            The budget for the cached rows and outputs. The least recently used entries are evicted
+            when it is exceeded.
+
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Drop all the cached outputs and reset the hit/miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __call__(self, model, *inputs):
+        """Return ``model(*inputs)``, only evaluating the model on the rows that are not cached."""
+        if len(inputs) != 1 or not isinstance(inputs[0], (np.ndarray, pd.DataFrame)):
+            return model(*inputs)
+        data = inputs[0]
+        values = data.values if isinstance(data, pd.DataFrame) else data
+        if values.dtype.hasobject or len(values) == 0:
+            return model(*inputs)
+
+        # look up every row, sending each distinct missing row to the model once
+        rows = np.ascontiguousarray(values).reshape(len(values), -1)
+        keys = _row_keys(rows, f"{values.dtype.str}{values.shape[1:]}".encode())
+        hit_inds, hit_outputs = [], []
+        missing = {} # the position of each missing row in the batch sent to the model
+        missing_inds, miss_inds, miss_positions = [], [], []
+        with self._lock:
+            for i, key in enumerate(keys):
+                output = self._entries.get(key)
+                if output is not None:
+                    self._entries.move_to_end(key)
+                    hit_inds.append(i)
+                    hit_outputs.append(output)
+                    continue
+                position = missing.setdefault(key, len(missing_inds))
+                if position == len(missing_inds):
+                    missing_inds.append(i)
+                miss_inds.append(i)
+                miss_positions.append(position)
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+
+        if len(missing) > 0:
+            subset = data.iloc[missing_inds] if isinstance(data, pd.DataFrame) else data[missing_inds]
+            missing_outputs = np.asarray(model(subset))
+            _assert_output_input_match((subset,), missing_outputs)
+            with self._lock:
+                for key, output in zip(missing, missing_outputs):
+                    if key in self._entries:
+                        continue
+                    output = output.copy()
+                    self._entries[key] = output
+                    self.nbytes += len(key) + output.nbytes
+                while self.nbytes > self.max_bytes and len(self._entries) > 0:
+                    key, output = self._entries.popitem(last=False)
+                    self.nbytes -= len(key) + output.nbytes
+            template = missing_outputs
+        else:
+            template = np.asarray(hit_outputs[0])[None]
+
+        outputs = np.empty((len(keys),) + template.shape[1:], dtype=template.dtype)
+        if len(hit_inds) > 0:
+            outputs[hit_inds] = np.stack(hit_outputs)
+        if len(miss_inds) > 0:
+            outputs[miss_inds] = missing_outputs[miss_positions]
+        return outputs
+
+
+def _row_keys(rows, prefix):
+    """The cache key of each row of a contiguous 2D array: ``prefix`` followed by the bytes of the row.
+
+    The keys are built in one pass over a byte buffer, viewing each row as a single ``np.void`` item.
+    """
+    row_bytes = rows.view(np.uint8).reshape(len(rows), -1)
+    buffer = np.empty((len(rows), len(prefix) + row_bytes.shape[1]), dtype=np.uint8)
+    buffer[:, :len(prefix)] = np.frombuffer(prefix, dtype=np.uint8)
+    buffer[:, len(prefix):] = row_bytes
+    return buffer.view(np.dtype((np.void, buffer.shape[1]))).ravel().tolist()
+
+
 def _assert_output_input_match(inputs, outputs):
     assert len(outputs) == len(inputs[0]), \
         f"The model produced {len(outputs)} output rows when given {len(inputs[0])} input rows! Check the implementation of the model you provided for errors."
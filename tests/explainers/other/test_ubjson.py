@@ -97,3 +97,20 @@ def test_decode_array():
     key_type = fp.read(1)
     key, value = _decode_simple_key_value_pair(fp, key_type)
     assert key == "base_weights" and value == [-0.0012426718603819609]
+
+def test_decode_typed_array_to_numpy():
+    # [$l#i3 an optimized array of three big endian int32 values
+    split_indices = b"L\x00\x00\x00\x00\x00\x00\x00\rsplit_indices[$l#i\x03\x00\x00\x00\x02\xff\xff\xff\xff\x00\x00\x01\x00"
+    fp = BytesIO(split_indices)
+    key_type = fp.read(1)
+    key, value = _decode_simple_key_value_pair(fp, key_type)
+    assert key == "split_indices"
+    assert isinstance(value, np.ndarray) and value.dtype == np.int32
+    np.testing.assert_array_equal(value, [2, -1, 256])
+
+    # an empty optimized array keeps its type
+    sum_hessian = b"L\x00\x00\x00\x00\x00\x00\x00\x0bsum_hessian[$D#L\x00\x00\x00\x00\x00\x00\x00\x00"
+    fp = BytesIO(sum_hessian)
+    key_type = fp.read(1)
+    key, value = _decode_simple_key_value_pair(fp, key_type)
+    assert key == "sum_hessian" and value.dtype == np.float64 and value.size == 0
@@ -1,5 +1,6 @@
 """Tests for Explainer class."""
 
+import numpy as np
 import pytest
 import sklearn
 
@@ -69,3 +70,79 @@ def test_explainer_xgboost():
     # check the properties of Explanation object
     assert explanation.values.shape == (*X.shape,)
     assert explanation.base_values.shape == (len(X),)
+
+
+@pytest.mark.parametrize("algorithm", ["exact", "permutation", "partition"])
+def test_packed_model_calls(algorithm):
+    """Packing the model calls of several rows must give the same explanations with fewer, larger model calls."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(60, 6))
+    model_rows = []
+
+    def model(data):
+        model_rows.append(len(data))
+        return np.tanh(data @ np.arange(6))
+
+    masker = shap.maskers.Partition(X, max_samples=20)
+    explainer = shap.Explainer(model, masker, algorithm=algorithm, seed=0)
+    expected = explainer(X[:10])
+    unpacked_rows = list(model_rows)
+
+    model_rows.clear()
+    explanation = explainer(X[:10], pack_size=2000)
+    assert len(model_rows) < len(unpacked_rows)
+    assert max(model_rows) > max(unpacked_rows)
+    np.testing.assert_allclose(explanation.base_values, expected.base_values)
+    np.testing.assert_allclose(explanation.values, expected.values, atol=1e-10)
+
+    def failing_model(data):
+        raise RuntimeError("model failure")
+
+    with pytest.raises(RuntimeError, match="model failure"):
+        shap.Explainer(failing_model, masker, algorithm=algorithm)(X[:10], pack_size=2000)
+
+
+def _tanh_model(data):
+    return np.tanh(data @ np.arange(data.shape[1]))
+
+
+@pytest.mark.parametrize("algorithm", ["exact", "permutation", "partition"])
+@pytest.mark.parametrize("backend", ["threads", "processes"])
+def test_parallel_rows_match_serial(algorithm, backend):
+    """Explaining the rows in parallel workers must match a serial run of a seeded explainer exactly."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(60, 6))
+    masker = shap.maskers.Partition(X, max_samples=20)
+    explainer = shap.Explainer(_tanh_model, masker, algorithm=algorithm, seed=3)
+
+    expected = explainer(X[:8])
+    # the per row random states of a serial run must not stay on the explainer
+    assert explainer._random_state is np.random
+    explanation = explainer(X[:8], n_jobs=3, backend=backend)
+    np.testing.assert_array_equal(explanation.values, expected.values)
+    np.testing.assert_array_equal(explanation.base_values, expected.base_values)
+    np.testing.assert_array_equal(explainer(X[:8], max_evals=200, n_jobs=2).values, explainer(X[:8], max_evals=200).values)
+
+    with pytest.raises(ValueError):
+        explainer(X[:8], n_jobs=2, backend="gpus")
+    with pytest.raises(ValueError):
+        explainer(X[:8], n_jobs=2, pack_size=1000)
+
+
+@pytest.mark.parametrize("algorithm", ["permutation", "partition"])
+def test_seed_leaves_global_random_state(algorithm):
+    """A seed must make the explanations reproducible without touching the global numpy random state."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(60, 6))
+    masker = shap.maskers.Partition(X, max_samples=20)
+
+    np.random.seed(7)
+    expected_draw = np.random.rand()
+    np.random.seed(7)
+    explainer = shap.Explainer(_tanh_model, masker, algorithm=algorithm, seed=5)
+    assert explainer.seed == 5
+    assert np.random.rand() == expected_draw
+
+    explanation = explainer(X[:4])
+    explanation_again = shap.Explainer(_tanh_model, masker, algorithm=algorithm, seed=5)(X[:4])
+    np.testing.assert_array_equal(explanation.values, explanation_again.values)
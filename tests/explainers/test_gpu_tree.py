@@ -121,9 +121,12 @@ def test_xgboost_cat_unsupported() -> None:
     with pytest.raises(NotImplementedError, match="Categorical"):
         gpu_ex.shap_values(X)
 
-    ex = shap.TreeExplainer(clf, X, feature_perturbation="interventional")
-    with pytest.raises(NotImplementedError, match="Categorical"):
-        ex.shap_values(X)
+    # the CPU kernels handle the categorical splits themselves
+    X_codes = X.assign(Workclass=X["Workclass"].cat.codes.astype(float))
+    ex = shap.TreeExplainer(clf, X_codes[:100], feature_perturbation="interventional")
+    values = ex.shap_values(X_codes[:100])
+    margin = clf.predict(X[:100], output_margin=True)
+    np.testing.assert_allclose(values.sum(1) + ex.expected_value, margin, atol=1e-4)
 
 
 def lightgbm_base():
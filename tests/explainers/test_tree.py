@@ -3,17 +3,19 @@ import itertools
 import math
 import pickle
 import sys
+import threading
 
 import numpy as np
 import pandas as pd
 import pytest
+import scipy.sparse
 import sklearn
 import sklearn.pipeline
 from sklearn.utils import check_array
 
 import shap
 from shap.explainers._tree import SingleTree
-from shap.utils._exceptions import InvalidModelError
+from shap.utils._exceptions import DimensionError, InvalidModelError
 
 
 def test_unsupported_model_raises_error():
@@ -1903,3 +1905,587 @@ def test_catboost_column_names_with_special_characters():
         )
     shap_values = explainer.shap_values(x_train)
     assert np.allclose(shap_values.sum(1) + explainer.expected_value, cb_best.predict_proba(x_train)[:, 1])
+
+
+@pytest.mark.parametrize("feature_perturbation", ["tree_path_dependent", "interventional"])
+def test_n_jobs_matches_serial(feature_perturbation):
+    """Splitting the samples across threads must give bit-identical results."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 6))
+    y = X[:, 0] + X[:, 1] * X[:, 2] + rs.normal(size=200)
+    model = sklearn.ensemble.RandomForestRegressor(n_estimators=10, max_depth=5, random_state=0).fit(X, y)
+    data = X[:30] if feature_perturbation == "interventional" else None
+    explainer = shap.TreeExplainer(model, data, feature_perturbation=feature_perturbation)
+
+    serial = explainer.shap_values(X)
+    threaded = explainer.shap_values(X, n_jobs=4)
+    np.testing.assert_array_equal(serial, threaded)
+
+    serial = explainer.shap_values(X, approximate=True)
+    threaded = explainer.shap_values(X, approximate=True, n_jobs=-1)
+    np.testing.assert_array_equal(serial, threaded)
+
+    explanation = explainer(X[:7], n_jobs=3)
+    np.testing.assert_array_equal(explanation.values, explainer.shap_values(X[:7]))
+
+
+def test_concurrent_shap_values_thread_safe():
+    """Concurrent calls on one explainer (with the GIL released) must match serial calls."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(120, 5))
+    y = X[:, 0] - X[:, 3] + rs.normal(size=120)
+    model = sklearn.ensemble.GradientBoostingRegressor(n_estimators=20, max_depth=3, random_state=0).fit(X, y)
+    for data in [None, X[:20]]:
+        explainer = shap.TreeExplainer(model, data)
+        chunks = np.array_split(X, 6)
+        expected = [explainer.shap_values(c) for c in chunks]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(explainer.shap_values, chunks))
+        for e, r in zip(expected, results):
+            np.testing.assert_array_equal(e, r)
+
+
+def test_chunked_interaction_values(tmp_path):
+    """Block-wise interaction values (dense, memmap and sparse top-k) must match the full tensor."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(50, 6))
+    y = X[:, 0] + X[:, 1] * X[:, 2]
+    model = sklearn.ensemble.RandomForestRegressor(n_estimators=5, max_depth=4, random_state=0).fit(X, y)
+    explainer = shap.TreeExplainer(model)
+    full = explainer.shap_interaction_values(X)
+
+    np.testing.assert_array_equal(explainer.shap_interaction_values(X, chunk_size=7), full)
+
+    out = np.lib.format.open_memmap(tmp_path / "interactions.npy", mode="w+", dtype=np.float64, shape=full.shape)
+    assert explainer.shap_interaction_values(X, chunk_size=11, out=out) is out
+    np.testing.assert_array_equal(out, full)
+    for shape in [(49, 6, 6), (51, 6, 6), (50, 6, 5)]:
+        with pytest.raises(DimensionError):
+            explainer.shap_interaction_values(X, chunk_size=11, out=np.empty(shape))
+    with pytest.raises(ValueError, match="top_k"):
+        explainer.shap_interaction_values(X, chunk_size=11, out=np.empty(full.shape), top_k=2)
+
+    blocks = list(explainer.iter_shap_interaction_values(X, chunk_size=20))
+    assert [rows.start for rows, _ in blocks] == [0, 20, 40]
+    np.testing.assert_array_equal(np.concatenate([v for _, v in blocks]), full)
+
+    top = explainer.shap_interaction_values(X, chunk_size=9, top_k=2)
+    assert top.shape == (50, 36)
+    top = top.toarray().reshape(full.shape)
+    for i in range(X.shape[0]):
+        for j in range(X.shape[1]):
+            np.testing.assert_allclose(top[i, j, j], full[i, j, j])
+            off_diag = np.abs(np.delete(full[i, j], j))
+            kept = np.delete(top[i, j], j) != 0
+            assert kept.sum() <= 2
+            assert np.all(off_diag[kept] >= np.sort(off_diag)[-2])
+
+
+@pytest.mark.parametrize("approximate", [False, True])
+def test_float32_matches_float64(approximate):
+    """The single precision kernels must agree with the double precision ones up to float32 precision."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(100, 5)).astype(np.float32)
+    y = X[:, 0] + 2 * X[:, 1] * (X[:, 2] > 0)
+    model = sklearn.ensemble.GradientBoostingRegressor(n_estimators=50, max_depth=4, random_state=0).fit(X, y)
+
+    expected = shap.TreeExplainer(model).shap_values(X, approximate=approximate)
+    explainer = shap.TreeExplainer(model, dtype="float32")
+    shap_values = explainer.shap_values(X, approximate=approximate)
+    assert shap_values.dtype == np.float32
+    np.testing.assert_allclose(shap_values, expected, rtol=1e-4, atol=1e-4)
+
+    predictions = explainer.model.predict(X, dtype=np.float32)
+    assert predictions.dtype == np.float32
+    np.testing.assert_allclose(predictions, model.predict(X), rtol=1e-5, atol=1e-5)
+
+
+def test_float32_unsupported_options():
+    X = np.random.RandomState(0).normal(size=(20, 3))
+    model = sklearn.ensemble.RandomForestRegressor(n_estimators=2, random_state=0).fit(X, X[:, 0])
+    with pytest.raises(ValueError, match="dtype"):
+        shap.TreeExplainer(model, dtype="float16")
+    with pytest.raises(ValueError, match="tree_path_dependent"):
+        shap.TreeExplainer(model, X, dtype="float32")
+
+
+@pytest.mark.parametrize("algorithm,cache", [("path_tables", "_path_tables"), ("paths", "_paths")])
+def test_algorithm_matches_recursive(algorithm, cache):
+    """The path table and path decomposition algorithms must give the same values as the recursive algorithm."""
+    xgboost = pytest.importorskip("xgboost")
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 8))
+    y = X[:, 0] + X[:, 1] * X[:, 2] + (X[:, 3] > 0)
+    X_missing = X.copy()
+    X_missing[rs.rand(*X.shape) < 0.1] = np.nan
+    models = [
+        (sklearn.ensemble.RandomForestRegressor(n_estimators=10, max_depth=8, random_state=0).fit(X, y), X),
+        (sklearn.ensemble.RandomForestClassifier(n_estimators=10, max_depth=6, random_state=0).fit(X, (y > 0).astype(int) + (y > 1)), X),
+        (xgboost.XGBRegressor(n_estimators=10, max_depth=5).fit(X_missing, y), X_missing),
+    ]
+    for model, data in models:
+        explainer = shap.TreeExplainer(model, algorithm=algorithm)
+        expected = shap.TreeExplainer(model).shap_values(data)
+        np.testing.assert_allclose(explainer.shap_values(data), expected, atol=1e-5)
+        # the tables/paths are cached and reused for the next batch
+        tables = getattr(explainer, cache)
+        np.testing.assert_allclose(explainer.shap_values(data[:10], n_jobs=2), expected[:10], atol=1e-5)
+        assert getattr(explainer, cache) is tables
+
+    with pytest.raises(ValueError, match="tree_path_dependent"):
+        shap.TreeExplainer(models[0][0], X, algorithm=algorithm)
+
+
+@pytest.mark.skipif(not shap.explainers._tree._HAS_CEXT, reason="cached_background needs the C extension")
+def test_cached_background_matches_recursive():
+    """Interventional SHAP values with a cached background must match the uncached ones."""
+    xgboost = pytest.importorskip("xgboost")
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 6))
+    X[rs.rand(*X.shape) < 0.1] = np.nan
+    y = (np.nan_to_num(X[:, 0]) + np.nan_to_num(X[:, 1]) > 0).astype(int)
+    model = xgboost.XGBClassifier(n_estimators=20, max_depth=4).fit(X, y)
+    background = X[:30]
+
+    for model_output in ["raw", "probability", "log_loss"]:
+        expected = shap.TreeExplainer(model, background, model_output=model_output)
+        explainer = shap.TreeExplainer(model, background, model_output=model_output, algorithm="cached_background")
+        for batch in [slice(0, 20), slice(20, 25)]:
+            np.testing.assert_allclose(
+                explainer.shap_values(X[batch], y=y[batch]), expected.shap_values(X[batch], y=y[batch]), atol=1e-10
+            )
+        # the cache is built once and reused for the next batches
+        cache = explainer._background_cache
+        explainer.shap_values(X[25:30], y=y[25:30])
+        assert explainer._background_cache is cache
+
+    # a different tree_limit rebuilds the cache
+    np.testing.assert_allclose(
+        explainer.shap_values(X[:10], y=y[:10], tree_limit=5, check_additivity=False),
+        expected.shap_values(X[:10], y=y[:10], tree_limit=5, check_additivity=False),
+        atol=1e-10,
+    )
+    assert explainer._background_cache[0] == 5
+
+    with pytest.raises(ValueError, match="interventional"):
+        shap.TreeExplainer(model, algorithm="cached_background")
+
+
+def test_weighted_background_matches_repeated_rows():
+    """A weighted background must give the same values as repeating each background row by its weight."""
+    xgboost = pytest.importorskip("xgboost")
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 5))
+    X[rs.rand(*X.shape) < 0.1] = np.nan
+    y = (np.nan_to_num(X[:, 0]) + np.nan_to_num(X[:, 1]) > 0).astype(int)
+    model = xgboost.XGBClassifier(n_estimators=20, max_depth=4).fit(X, y)
+    weights = np.array([1, 2, 3, 1, 1])
+    repeated = np.repeat(X[:5], weights, axis=0)
+
+    for model_output in ["raw", "probability"]:
+        explainer = shap.TreeExplainer(model, {"data": X[:5], "weights": weights}, model_output=model_output)
+        expected = shap.TreeExplainer(model, repeated, model_output=model_output)
+        np.testing.assert_allclose(explainer.expected_value, expected.expected_value)
+        np.testing.assert_allclose(explainer.shap_values(X[:20]), expected.shap_values(X[:20]), atol=1e-10)
+
+    # the cluster sizes of shap.kmeans are used as weights
+    summary = shap.kmeans(np.nan_to_num(X), 10)
+    explainer = shap.TreeExplainer(model, summary)
+    np.testing.assert_allclose(
+        explainer.expected_value, np.average(model.predict(summary.data, output_margin=True), weights=summary.weights), atol=1e-5
+    )
+    explainer(np.nan_to_num(X[:10]))
+
+    with pytest.raises(ValueError, match="weights"):
+        shap.TreeExplainer(model, {"data": X[:5], "weights": weights[:4]})
+    with pytest.raises(ValueError, match="interventional"):
+        shap.TreeExplainer(model, summary, feature_perturbation="tree_path_dependent")
+
+
+def test_background_path_dependent():
+    """Compiling the background into the node weights must match interventional values for independent features."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(500, 3))
+    y = X[:, 0] + X[:, 1] * X[:, 2] + (X[:, 0] > 0) * X[:, 1]
+    # every combination of the feature values, so the features are exactly independent in the background
+    grid = np.array(np.meshgrid(*[np.linspace(-2.5, 2.5, 11)] * 3)).reshape(3, -1).T
+
+    model = sklearn.tree.DecisionTreeRegressor(max_depth=2, random_state=0).fit(X, y)
+    explainer = shap.TreeExplainer(model, grid, feature_perturbation="background_path_dependent")
+    assert explainer.data.shape[0] == grid.shape[0]
+    expected = shap.TreeExplainer(model, shap.maskers.Independent(grid, max_samples=grid.shape[0]))
+    np.testing.assert_allclose(explainer.expected_value, expected.expected_value)
+    np.testing.assert_allclose(explainer.shap_values(X[:50]), expected.shap_values(X[:50]), atol=1e-5)
+
+    # subtrees no background sample reaches fall back to the training proportions
+    model = sklearn.ensemble.RandomForestRegressor(n_estimators=5, max_depth=6, random_state=0).fit(X, y)
+    explainer = shap.TreeExplainer(model, X[:3], feature_perturbation="background_path_dependent")
+    assert np.isfinite(explainer.shap_values(X[:50])).all()
+    explainer = shap.TreeExplainer(model, shap.kmeans(X, 10), feature_perturbation="background_path_dependent")
+    explainer.shap_values(X[:50])
+    explainer.shap_interaction_values(X[:5])
+
+    with pytest.raises(ValueError, match="raw"):
+        shap.TreeExplainer(model, X[:10], feature_perturbation="background_path_dependent", model_output="log_loss")
+
+
+def test_compiled_ensemble_roundtrip(tmp_path):
+    """An explainer loaded from a compiled ensemble file must match one built from the model."""
+    xgboost = pytest.importorskip("xgboost")
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 6))
+    X[rs.rand(*X.shape) < 0.1] = np.nan
+    y = np.nan_to_num(X[:, 0]) + np.nan_to_num(X[:, 1] * X[:, 2])
+    path = tmp_path / "model.shaptree"
+    for model in [
+        sklearn.ensemble.RandomForestRegressor(n_estimators=10, max_depth=6, random_state=0).fit(np.nan_to_num(X), y),
+        xgboost.XGBClassifier(n_estimators=10, max_depth=4).fit(X, y > 0),
+    ]:
+        data = X if isinstance(model, xgboost.XGBClassifier) else np.nan_to_num(X)
+        explainer = shap.TreeExplainer(model, feature_perturbation="tree_path_dependent")
+        explainer.model.save_compiled(path)
+
+        compiled = shap.TreeExplainer.from_compiled(path)
+        assert isinstance(compiled.model.values, np.memmap)
+        np.testing.assert_allclose(compiled.expected_value, explainer.expected_value)
+        np.testing.assert_allclose(compiled.shap_values(data), explainer.shap_values(data), atol=1e-5)
+        np.testing.assert_allclose(compiled.model.predict(data), explainer.model.predict(data))
+
+        background = data[:50]
+        expected = shap.TreeExplainer(model, background, model_output="probability" if hasattr(model, "predict_proba") else "raw")
+        compiled = shap.TreeExplainer.from_compiled(path, background, model_output=expected.model_output, mmap_mode=None)
+        np.testing.assert_allclose(compiled.shap_values(data), expected.shap_values(data), atol=1e-6)
+
+    path.write_bytes(b"not a compiled model")
+    with pytest.raises(ValueError, match="not a compiled TreeEnsemble"):
+        shap.TreeExplainer.from_compiled(path)
+
+
+def test_xgboost_loader_slices_concatenated_trees():
+    """Every tree parsed from the concatenated UBJSON node buffers must predict like XGBoost."""
+    xgboost = pytest.importorskip("xgboost")
+    from shap.explainers._tree import XGBTreeModelLoader
+
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(300, 5))
+    X[rs.rand(*X.shape) < 0.1] = np.nan
+    y = (np.nan_to_num(X[:, 0]) > 0).astype(int) + (np.nan_to_num(X[:, 1]) > 0.5)
+    model = xgboost.XGBClassifier(n_estimators=30, max_depth=4).fit(X, y)
+
+    loader = XGBTreeModelLoader(model.get_booster())
+    assert loader.num_trees == 90
+    assert sum(len(t) for t in loader.node_cleft) == len(np.concatenate(loader.thresholds))
+    assert all(len(c) == len(t) and not any(c) for c, t in zip(loader.categories, loader.node_cleft))
+
+    ensemble = shap.explainers._tree.TreeEnsemble(model, model_output="raw")
+    np.testing.assert_allclose(ensemble.predict(X), model.predict(X, output_margin=True), rtol=1e-5, atol=1e-5)
+
+
+def test_staged_shap_values():
+    """Every stage of staged_shap_values must match shap_values with that tree_limit."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(100, 5))
+    y = X[:, 0] + X[:, 1] * X[:, 2]
+    model = sklearn.ensemble.RandomForestClassifier(n_estimators=12, max_depth=5, random_state=0).fit(X, (y > 0).astype(int) + (y > 1))
+    stages = [12, 0, 4, 4, 9]
+
+    for explainer in [
+        shap.TreeExplainer(model, feature_perturbation="tree_path_dependent"),
+        shap.TreeExplainer(model, X[:20], feature_perturbation="interventional"),
+    ]:
+        staged = explainer.staged_shap_values(X, stages)
+        assert staged.shape == (len(stages), X.shape[0], X.shape[1], 3)
+        for k, values in zip(stages, staged):
+            if k == 0:
+                np.testing.assert_allclose(values, 0)
+            else:
+                np.testing.assert_allclose(values, explainer.shap_values(X, tree_limit=k, check_additivity=False), atol=1e-10)
+
+    with pytest.raises(ValueError, match="between 0 and the number of trees"):
+        explainer.staged_shap_values(X, [13])
+
+
+def test_sparse_csr_input():
+    """CSR inputs must give the same SHAP values and predictions as their dense version."""
+    rs = np.random.RandomState(0)
+    X = scipy.sparse.random(200, 500, density=0.05, format="csr", random_state=rs)
+    X_dense = X.toarray()
+    y = X_dense[:, 0] + X_dense[:, 5] + 3 * X_dense[:, 7]
+    model = sklearn.ensemble.RandomForestRegressor(n_estimators=10, max_depth=6, random_state=0).fit(X_dense, y)
+
+    for explainer in [shap.TreeExplainer(model), shap.TreeExplainer(model, X_dense[:20])]:
+        expected = explainer.shap_values(X_dense)
+        np.testing.assert_allclose(explainer.shap_values(X, n_jobs=2), expected, atol=1e-10)
+        sparse_values = explainer.shap_values(X, sparse_output=True)
+        assert scipy.sparse.issparse(sparse_values) and sparse_values.shape == X.shape
+        # only the features the model splits on are stored
+        assert set(sparse_values.indices) <= set(explainer.model._compact_features()[0])
+        np.testing.assert_allclose(sparse_values.toarray(), expected, atol=1e-10)
+        np.testing.assert_allclose(explainer.model.predict(X), explainer.model.predict(X_dense))
+
+    # interaction values densify the rows
+    explainer = shap.TreeExplainer(model)
+    expected = explainer.shap_interaction_values(X_dense[:5])
+    np.testing.assert_allclose(explainer.shap_interaction_values(X[:5]), expected, atol=1e-10)
+    np.testing.assert_allclose(explainer.shap_interaction_values(X[:5], chunk_size=2), expected, atol=1e-10)
+
+
+def test_interaction_values_n_jobs():
+    """Threaded SHAP interaction values must match the single threaded ones exactly."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(60, 8))
+    y = X[:, 0] + X[:, 1] * X[:, 2] + (X[:, 3] > 0) * X[:, 4]
+    model = sklearn.ensemble.RandomForestRegressor(n_estimators=10, max_depth=6, random_state=0).fit(X, y)
+    explainer = shap.TreeExplainer(model)
+
+    unique_features = explainer.model._unique_features()
+    assert unique_features.shape[0] == len(model.estimators_)
+    for row, estimator in zip(unique_features, model.estimators_):
+        tree = estimator.tree_
+        assert set(row[row >= 0]) == set(tree.feature[tree.children_left >= 0])
+
+    expected = explainer.shap_interaction_values(X)
+    np.testing.assert_array_equal(explainer.shap_interaction_values(X, n_jobs=3), expected)
+    np.testing.assert_array_equal(explainer.shap_interaction_values(X, chunk_size=25, n_jobs=2), expected)
+
+
+def test_numba_engine_matches_cext(monkeypatch):
+    """The numba kernels used when the C extension is missing must match the C extension."""
+    xgboost = pytest.importorskip("xgboost")
+    from shap.explainers import _tree, _tree_numba
+
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 5))
+    X[rs.rand(*X.shape) < 0.05] = np.nan
+    y = np.nan_to_num(X[:, 0]) + np.nan_to_num(X[:, 1] * X[:, 2]) > 0
+    model = xgboost.XGBClassifier(n_estimators=10, max_depth=4, random_state=0).fit(X, y)
+    rf = sklearn.ensemble.RandomForestRegressor(n_estimators=5, max_depth=5, random_state=0).fit(np.nan_to_num(X), y)
+    X_sparse = scipy.sparse.csr_matrix(np.nan_to_num(X[:20]))
+
+    def explain():
+        explainers = {
+            "path": shap.TreeExplainer(rf),
+            "float32": shap.TreeExplainer(rf, dtype="float32"),
+            "interventional": shap.TreeExplainer(model, X[:30]),
+            "probability": shap.TreeExplainer(model, X[:30], model_output="probability"),
+            "background_path": shap.TreeExplainer(model, X[:100], feature_perturbation="background_path_dependent"),
+        }
+        out = {name: e.shap_values(X[:20] if name in ("interventional", "probability", "background_path") else np.nan_to_num(X[:20]))
+               for name, e in explainers.items()}
+        out["saabas"] = explainers["path"].shap_values(np.nan_to_num(X[:20]), approximate=True)
+        out["interactions"] = explainers["path"].shap_interaction_values(np.nan_to_num(X[:10]))
+        out["staged"] = explainers["path"].staged_shap_values(np.nan_to_num(X[:20]), [1, 3])
+        out["sparse"] = explainers["path"].shap_values(X_sparse)
+        out["predict"] = explainers["interventional"].model.predict(X[:20])
+        return out
+
+    expected = explain()
+    monkeypatch.setattr(_tree, "_cext", _tree_numba)
+    monkeypatch.setattr(_tree, "_HAS_CEXT", False)
+    actual = explain()
+    for name in expected:
+        np.testing.assert_allclose(actual[name], expected[name], atol=1e-5 if name == "float32" else 1e-6, err_msg=name)
+
+    with pytest.warns(UserWarning, match="needs the C extension"):
+        assert shap.TreeExplainer(rf, algorithm="path_tables").algorithm == "recursive"
+
+
+def test_predict_leaves_and_return_predictions():
+    """Leaf indices must match sklearn, and the fused predictions must match ``TreeEnsemble.predict``."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(100, 5))
+    y = X[:, 0] + X[:, 1] * X[:, 2] > 0
+    model = sklearn.ensemble.RandomForestClassifier(n_estimators=5, max_depth=5, random_state=0).fit(X, y)
+
+    explainer = shap.TreeExplainer(model)
+    leaves = explainer.model.predict_leaves(X)
+    np.testing.assert_array_equal(leaves, model.apply(X.astype(np.float32)))
+    np.testing.assert_array_equal(explainer.model.predict_leaves(scipy.sparse.csr_matrix(X)), leaves)
+    np.testing.assert_array_equal(explainer.model.predict_leaves(X[0]), leaves[0])
+
+    for explainer in [
+        shap.TreeExplainer(model),
+        shap.TreeExplainer(model, X[:20]),
+        shap.TreeExplainer(model, X[:20], model_output="probability"),
+    ]:
+        expected = explainer.model.predict(X)
+        values, predictions = explainer.shap_values(X, return_predictions=True)
+        np.testing.assert_allclose(values, explainer.shap_values(X))
+        np.testing.assert_allclose(predictions, expected)
+        np.testing.assert_allclose(explainer.shap_values(X, approximate=True, return_predictions=True)[1], expected)
+        np.testing.assert_allclose(explainer.shap_values(X[0], return_predictions=True)[1], expected[0])
+    _, predictions = explainer.shap_values(scipy.sparse.csr_matrix(X), return_predictions=True)
+    np.testing.assert_allclose(predictions, expected)
+
+
+def test_truncated_approximation():
+    """Truncating at depth 0 must give Saabas, at the tree depth the exact values, and the error estimate must track the error."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 6))
+    y = X[:, 0] * X[:, 1] + np.sin(X[:, 2]) + X[:, 3]
+    model = sklearn.ensemble.GradientBoostingRegressor(n_estimators=10, max_depth=5, random_state=0).fit(X, y)
+    explainer = shap.TreeExplainer(model)
+    exact = explainer.shap_values(X[:50])
+
+    saabas = explainer.shap_values(X[:50], approximate=True)
+    np.testing.assert_allclose(explainer.shap_values(X[:50], exact_depth=0), saabas)
+    # approximate keeps its boolean meaning for integer values
+    np.testing.assert_array_equal(explainer.shap_values(X[:50], approximate=0), exact)
+    np.testing.assert_array_equal(explainer.shap_values(X[:50], approximate=1), saabas)
+    previous_estimate = np.inf
+    for depth in [0, 2, 3, 4, 5, 10]:
+        values, predictions, estimates = explainer.shap_values(
+            X[:50], exact_depth=depth, return_predictions=True, return_error_bound=True
+        )
+        np.testing.assert_allclose(values.sum(1) + explainer.expected_value, model.predict(X[:50]), atol=1e-8)
+        np.testing.assert_allclose(predictions, model.predict(X[:50]))
+        errors = np.abs(values - exact).sum(1)
+        assert estimates.mean() <= previous_estimate
+        previous_estimate = estimates.mean()
+        if depth >= 5:
+            np.testing.assert_allclose(values, exact, atol=1e-8)
+            np.testing.assert_array_equal(estimates, 0)
+        else:
+            # the estimate is within a small factor of the actual error and follows it from row to row
+            assert 0.5 < estimates.mean() / errors.mean() < 3
+            assert np.corrcoef(estimates, errors)[0, 1] > 0.7
+
+    np.testing.assert_array_equal(explainer.shap_values(X[:5], return_error_bound=True)[1], 0)
+    np.testing.assert_array_equal(
+        explainer.shap_values(X[:5], approximate=True, return_error_bound=True)[1],
+        explainer.shap_values(X[:5], exact_depth=0, return_error_bound=True)[1],
+    )
+    for exact_depth in [-1, 1.5, True]:
+        with pytest.raises(ValueError, match="exact_depth"):
+            explainer.shap_values(X[:5], exact_depth=exact_depth)
+    with pytest.raises(ValueError, match="cannot be combined"):
+        explainer.shap_values(X[:5], approximate=True, exact_depth=2)
+    with pytest.raises(ValueError, match="path dependent"):
+        shap.TreeExplainer(model, X[:20]).shap_values(X[:5], exact_depth=2)
+
+
+def test_categorical_splits():
+    """Models with categorical splits must be explained by the shap kernels, matching the libraries' own values."""
+    xgboost = pytest.importorskip("xgboost")
+    lightgbm = pytest.importorskip("lightgbm")
+    rs = np.random.RandomState(0)
+    X = pd.DataFrame({
+        "a": rs.normal(size=1000),
+        "b": pd.Categorical(rs.randint(0, 40, size=1000)),
+        "c": pd.Categorical(rs.randint(0, 5, size=1000)),
+    })
+    y = 2 * np.isin(X["b"].cat.codes, [1, 3, 5, 20, 33]) + X["a"] + (X["c"].cat.codes == 2)
+    X_codes = X.assign(b=X["b"].cat.codes.astype(float), c=X["c"].cat.codes.astype(float)).values
+
+    xgb_model = xgboost.XGBRegressor(
+        n_estimators=10, max_depth=4, enable_categorical=True, max_cat_to_onehot=1, tree_method="hist"
+    )
+    lgb_model = lightgbm.LGBMRegressor(n_estimators=10, min_data_per_group=5, verbose=-1)
+
+    def xgb_contribs(X):
+        return xgb_model.get_booster().predict(xgboost.DMatrix(X, enable_categorical=True), pred_contribs=True)
+
+    def lgb_contribs(X):
+        return lgb_model.predict(X, pred_contrib=True)
+
+    for model, contribs in [(xgb_model.fit(X, y), xgb_contribs), (lgb_model.fit(X, y), lgb_contribs)]:
+        explainer = shap.TreeExplainer(model, X_codes[:100], feature_perturbation="interventional")
+        assert explainer.model.categorical_splits is not None
+        np.testing.assert_allclose(explainer.model.predict(X_codes), model.predict(X), atol=1e-5)
+        values = explainer.shap_values(X_codes[:200])
+        np.testing.assert_allclose(values.sum(1) + explainer.expected_value, model.predict(X[:200]), atol=1e-5)
+
+        # the internal path dependent kernel against the library's own implementation
+        expected = contribs(X[:200])[:, :-1]
+        explainer = shap.TreeExplainer(model)
+        explainer.model.model_type = "internal"
+        np.testing.assert_allclose(explainer.shap_values(X_codes[:200]), expected, atol=1e-5)
+        np.testing.assert_allclose(explainer.shap_values(X_codes[:200], n_jobs=2), expected, atol=1e-5)
+
+        # the training data as background gives the same node weights as the training covers
+        explainer = shap.TreeExplainer(model, X_codes, feature_perturbation="background_path_dependent")
+        np.testing.assert_allclose(explainer.shap_values(X_codes[:200]), expected, atol=1e-5)
+        with pytest.raises(NotImplementedError, match="Categorical"):
+            shap.TreeExplainer(model, algorithm="path_tables")
+
+
+def test_explain_one():
+    """explain_one must match shap_values row by row and reuse the output buffer it is given."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(200, 5))
+    X[rs.rand(*X.shape) < 0.05] = np.nan
+    y = np.nan_to_num(X[:, 0]) + np.nan_to_num(X[:, 1] * X[:, 2])
+    model = sklearn.ensemble.HistGradientBoostingRegressor(max_iter=10, random_state=0).fit(X, y)
+    for explainer in [
+        shap.TreeExplainer(model),
+        shap.TreeExplainer(model, X[:30], feature_perturbation="interventional"),
+        shap.TreeExplainer(model, X[:30], feature_perturbation="interventional", algorithm="cached_background"),
+    ]:
+        expected = explainer.shap_values(X[:10])
+        np.testing.assert_allclose(np.array([explainer.explain_one(x) for x in X[:10]]), expected, atol=1e-8)
+
+    classifier = sklearn.ensemble.RandomForestClassifier(n_estimators=5, max_depth=4, random_state=0)
+    classifier.fit(np.nan_to_num(X), y > 0)
+    explainer = shap.TreeExplainer(classifier)
+    out = np.empty((5, 2))
+    for x in np.nan_to_num(X[:5]):
+        assert explainer.explain_one(x, out=out) is out
+        np.testing.assert_allclose(out, explainer.shap_values(x), atol=1e-8)
+
+
+
+def test_explain_one_concurrent():
+    """Concurrent explain_one calls on one explainer must not overwrite each other's buffers."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(400, 8))
+    y = X[:, 0] + X[:, 1] * X[:, 2] - X[:, 5]
+    model = sklearn.ensemble.GradientBoostingRegressor(n_estimators=50, random_state=0).fit(X, y)
+    explainer = shap.TreeExplainer(model)
+    expected = explainer.shap_values(X)
+    results = [None] * 4
+
+    def worker(i):
+        results[i] = np.array([explainer.explain_one(x) for x in X[i::4]])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i in range(4):
+        np.testing.assert_allclose(results[i], expected[i::4], atol=1e-8)
+    explainer = pickle.loads(pickle.dumps(explainer))
+    np.testing.assert_allclose(explainer.explain_one(X[0]), expected[0], atol=1e-8)
+
+def test_top_k_shap_values():
+    """top_k must return the largest magnitude SHAP values of each row with their feature indices."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(100, 12))
+    y = X[:, 0] + 2 * X[:, 1] * X[:, 2] - X[:, 5]
+    model = sklearn.ensemble.GradientBoostingRegressor(n_estimators=20, random_state=0).fit(X, y)
+    explainer = shap.TreeExplainer(model)
+    full = explainer.shap_values(X[:50])
+
+    indices, values = explainer.shap_values(X[:50], top_k=3)
+    assert indices.shape == values.shape == (50, 3)
+    np.testing.assert_array_equal(np.take_along_axis(full, indices, axis=1), values)
+    np.testing.assert_array_equal(np.abs(values), -np.sort(-np.abs(full), axis=1)[:, :3])
+    assert explainer.shap_values(X[:5], top_k=20)[0].shape == (5, 12)
+    indices, values = explainer.shap_values(X[0], top_k=2)
+    np.testing.assert_array_equal(values, full[0, indices])
+
+    explanation = explainer(pd.DataFrame(X[:5], columns=[f"f{i}" for i in range(12)]), top_k=3)
+    indices, values = explainer.shap_values(X[:5], top_k=3)
+    np.testing.assert_array_equal(explanation.values, values)
+    np.testing.assert_array_equal(explanation.data, np.take_along_axis(X[:5], indices, axis=1))
+    assert list(explanation.feature_names[0]) == [f"f{i}" for i in indices[0]]
+
+    classifier = sklearn.ensemble.RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y > 0)
+    explainer = shap.TreeExplainer(classifier)
+    indices, values = explainer.shap_values(X[:4], top_k=2)
+    assert indices.shape == (4, 2, 2)
+    np.testing.assert_array_equal(np.take_along_axis(explainer.shap_values(X[:4]), indices, axis=1), values)
+    with pytest.raises(ValueError):
+        explainer(X[:4], top_k=2)
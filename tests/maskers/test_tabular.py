@@ -105,3 +105,59 @@ def test_serialization_partion_masker_numpy():
 
     # comparing masked values
     assert np.array_equal(original_partition_masker(mask, X[0])[0], new_partition_masker(mask, X[0])[0])
+
+def test_full_masking_matches_single_masks():
+    """Masking a whole batch of masks at once must match masking them one at a time."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(50, 8))
+    X[:, 3] = 0
+    x = rs.normal(size=8)
+    x[3] = 0
+    masks = rs.rand(40, 8) < 0.5
+
+    masker = shap.maskers.Independent(X)
+    (masked_inputs,), varying_rows = masker(masks, x)
+    for i, mask in enumerate(masks):
+        np.testing.assert_array_equal(masked_inputs[i * 50:(i + 1) * 50], np.where(mask, x, X))
+    assert varying_rows[0].all()
+    np.testing.assert_array_equal(varying_rows[1:], ((masks[1:] ^ masks[:-1])[:, None, :] & (X != x)).any(2))
+
+    def model(data):
+        return np.tanh(data @ np.arange(8))
+
+    outputs = []
+    for supports_full_masking in [True, False]:
+        masker.supports_full_masking = supports_full_masking
+        masked_model = shap.utils.MaskedModel(model, masker, shap.links.identity, False, x)
+        outputs.append(masked_model(masks, batch_size=15))
+    np.testing.assert_allclose(outputs[0], outputs[1])
+
+def test_batched_delta_masking_matches_unbatched():
+    """Delta masking in blocks of batch_size masks must match masking all of them in one model call."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(30, 6))
+    x = rs.normal(size=6)
+    X[:, 2] = x[2]
+    masks = [shap.utils.MaskedModel.delta_mask_noop_value]
+    for _ in range(40):
+        inds = rs.choice(6, rs.randint(1, 4), replace=False)
+        masks += [-i - 1 for i in inds[:-1]] + [inds[-1]]
+    masks = np.array(masks)
+
+    def model(data):
+        return 1 / (1 + np.exp(-np.stack([data @ np.arange(6), data[:, 0]], axis=1)))
+
+    model_calls = []
+
+    def counting_model(data):
+        model_calls.append(len(data))
+        return model(data)
+
+    for link, linearize_link in [(shap.links.identity, False), (shap.links.logit, True)]:
+        expected = shap.utils.MaskedModel(model, shap.maskers.Independent(X), link, linearize_link, x)(masks, zero_index=0)
+        for batch_size in [1, 7, 100]:
+            masked_model = shap.utils.MaskedModel(counting_model, shap.maskers.Independent(X), link, linearize_link, x)
+            model_calls.clear()
+            np.testing.assert_allclose(masked_model(masks, zero_index=0, batch_size=batch_size), expected)
+            assert len(model_calls) == -(-41 // batch_size)
+            assert max(model_calls) <= batch_size * len(X)
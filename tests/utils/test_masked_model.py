@@ -0,0 +1,71 @@
+"""Tests for the MaskedModel utilities."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import shap
+from shap.utils import OutputCache
+
+
+def test_output_cache():
+    """Rows that were already evaluated must be looked up, evicting the least recently used ones."""
+    model_rows = []
+
+    def model(data):
+        model_rows.append(len(data))
+        return np.asarray(data).sum(1)
+
+    cache = OutputCache()
+    data = np.array([[1.0, 2.0], [3.0, 4.0], [1.0, 2.0]])
+    np.testing.assert_array_equal(cache(model, data), [3, 7, 3])
+    assert model_rows == [2] and (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+    np.testing.assert_array_equal(cache(model, pd.DataFrame(data[::-1])), [3, 7, 3])
+    assert model_rows == [2] and (cache.hits, cache.misses) == (4, 2)
+
+    # each entry holds a 7 byte dtype and shape prefix ("<f8(2,)"), a 16 byte row and an 8 byte output
+    cache = OutputCache(max_bytes=62)
+    cache(model, data[:2])
+    cache(model, data[:1])
+    cache(model, np.array([[5.0, 6.0]]))
+    assert len(cache) == 2 and cache.nbytes == 62
+    cache(model, data[:1])
+    assert cache.misses == 3
+
+    # rows with the same bytes but a different dtype or shape are different entries
+    cache = OutputCache()
+    cache(model, np.zeros((2, 2)))
+    assert cache(model, np.zeros((2, 4), dtype=np.float32)).tolist() == [0, 0]
+    assert cache(model, np.zeros((1, 1, 2))).shape == (1, 2)
+    assert cache(model, np.zeros((2, 1))).shape == (2,)
+    assert (cache.hits, cache.misses, len(cache)) == (3, 4, 4)
+
+    cache.clear()
+    assert (len(cache), cache.nbytes, cache.hits, cache.misses) == (0, 0, 0, 0)
+    assert cache(model, np.array([["a"], ["b"]], dtype=object)).tolist() == ["a", "b"]
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize("algorithm", ["exact", "permutation", "partition"])
+def test_output_cache_explainers(algorithm):
+    """Explainers with an output cache must give the same values while calling the model on fewer rows."""
+    rs = np.random.RandomState(0)
+    X = rs.normal(size=(50, 6))
+    model_rows = []
+
+    def model(data):
+        model_rows.append(len(data))
+        return np.tanh(data @ np.arange(6))
+
+    # a seeded explainer also seeds the numba random state that shuffles the clustered features
+    masker = shap.maskers.Partition(X)
+    explainer = shap.Explainer(model, masker, algorithm=algorithm, seed=0)
+    expected = explainer(X[[0, 0, 1]]).values
+    uncached_rows = sum(model_rows)
+
+    model_rows.clear()
+    cache = OutputCache()
+    explainer = shap.Explainer(model, masker, algorithm=algorithm, output_cache=cache, seed=0)
+    np.testing.assert_array_equal(explainer(X[[0, 0, 1]]).values, expected)
+    assert sum(model_rows) == cache.misses < uncached_rows
+    assert cache.hits > 0